@@ -0,0 +1,135 @@
+"""
+Telegram webhook 模式检查脚本
+
+使用本地伪造的 Telegram Bot API（不访问网络）启动 Bot，
+通过 ASGI 调用 webhook 路由，确认密钥校验和更新分发正常
+"""
+import asyncio
+import json
+import os
+import tempfile
+
+import httpx
+from fastapi import FastAPI
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+import services.tg_binding as tg_binding
+from db_pool import pool_manager
+from routers.tg_bot import router
+from services.tg_bot import tg_bot_service, bot_config, WEBHOOK_PATH
+
+
+class FakeTelegramRequest(BaseRequest):
+    """伪造的 Bot API：记录所有调用并返回最小可用的结果"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append((api_method, params))
+
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bot", "username": "fake_bot"}
+        elif api_method == "sendMessage":
+            result = {
+                "message_id": len(self.calls),
+                "date": 0,
+                "chat": {"id": params["chat_id"], "type": "private"},
+                "text": params["text"],
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def start_update(update_id: int, chat_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Tester"},
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+
+async def main() -> None:
+    tg_binding.TG_BINDINGS_DB = os.path.join(tempfile.mkdtemp(), "tg_bindings.db")
+    bot_config._config = {
+        "enabled": True,
+        "bot_token": "123456:TEST",
+        "default_period": "monthly",
+        "mode": "webhook",
+        "webhook_url": "https://stats.example.test/",
+        "webhook_secret": "s3cret",
+    }
+
+    fake = FakeTelegramRequest()
+    tg_bot_service._build_application = lambda token: Application.builder().token(token).request(fake).build()
+
+    app = FastAPI()
+    app.include_router(router)
+    transport = httpx.ASGITransport(app=app)
+
+    await tg_bot_service.start()
+    try:
+        assert tg_bot_service.is_running()
+        assert tg_bot_service.get_mode() == "webhook"
+        webhook_calls = [params for method, params in fake.calls if method == "setWebhook"]
+        assert webhook_calls and webhook_calls[0]["url"] == "https://stats.example.test" + WEBHOOK_PATH
+        assert webhook_calls[0]["secret_token"] == "s3cret"
+        assert not tg_bot_service.application.updater.running
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            resp = await client.post(WEBHOOK_PATH, json=start_update(1, 42))
+            assert resp.status_code == 403, resp.status_code
+
+            resp = await client.post(
+                WEBHOOK_PATH, json=start_update(2, 42),
+                headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"},
+            )
+            assert resp.status_code == 403, resp.status_code
+
+            resp = await client.post(
+                WEBHOOK_PATH, json=start_update(3, 42),
+                headers={"X-Telegram-Bot-Api-Secret-Token": "s3cret"},
+            )
+            assert resp.status_code == 200, resp.status_code
+
+        # 等待 Application 处理更新并回复 /start
+        for _ in range(50):
+            replies = [params for method, params in fake.calls if method == "sendMessage"]
+            if replies:
+                break
+            await asyncio.sleep(0.1)
+        assert len(replies) == 1, replies
+        assert replies[0]["chat_id"] == 42
+    finally:
+        await tg_bot_service.stop()
+        await pool_manager.close_all()
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        resp = await client.post(
+            WEBHOOK_PATH, json=start_update(4, 42),
+            headers={"X-Telegram-Bot-Api-Secret-Token": "s3cret"},
+        )
+        assert resp.status_code == 503, resp.status_code
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -16,6 +16,8 @@ class Settings:
     # Emby 服务器配置
     EMBY_URL: str = os.getenv("EMBY_URL", "http://localhost:8096")
     EMBY_API_KEY: str = os.getenv("EMBY_API_KEY", "")
+    # 每个服务器共享 HTTP 客户端的最大连接数
+    EMBY_HTTP_MAX_CONNECTIONS: int = int(os.getenv("EMBY_HTTP_MAX_CONNECTIONS", "20"))
 
     # 播放过滤配置
     # 最小播放时长过滤（秒），低于此时长的记录将被忽略，0 表示不过滤
@@ -27,6 +29,63 @@ class Settings:
     # 缓存配置
     ITEM_CACHE_MAX_SIZE: int = 500
     ITEM_CACHE_EVICT_COUNT: int = 100
+    # 负缓存（已删除/查询失败的媒体项），TTL 比正常缓存短，避免条目恢复后长时间不可见
+    ITEM_MISS_CACHE_MAX_SIZE: int = int(os.getenv("ITEM_MISS_CACHE_MAX_SIZE", "2000"))
+    ITEM_MISS_CACHE_TTL: int = int(os.getenv("ITEM_MISS_CACHE_TTL", "600"))
+    # 海报图片缓存（字节数上限、生存时间）
+    IMAGE_CACHE_MAX_BYTES: int = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    IMAGE_CACHE_TTL: int = int(os.getenv("IMAGE_CACHE_TTL", "3600"))
+
+    # 收藏统计配置
+    # 并发请求 Emby 的用户数上限
+    FAVORITES_CONCURRENCY: int = int(os.getenv("FAVORITES_CONCURRENCY", "8"))
+    # 收藏快照的有效期（秒），页面读取到过期快照时在后台刷新
+    FAVORITES_CACHE_TTL: int = int(os.getenv("FAVORITES_CACHE_TTL", "600"))
+    # 收藏快照定时刷新的 cron 表达式
+    FAVORITES_SNAPSHOT_CRON: str = os.getenv("FAVORITES_SNAPSHOT_CRON", "*/30 * * * *")
+
+    # 会话缓存配置
+    # 会话在内存中的缓存时间（秒），过期后重新读取数据库
+    SESSION_CACHE_TTL: int = int(os.getenv("SESSION_CACHE_TTL", "60"))
+    SESSION_CACHE_MAX_SIZE: int = int(os.getenv("SESSION_CACHE_MAX_SIZE", "10000"))
+    # 会话最后活动时间批量写入的 cron 表达式
+    SESSION_FLUSH_CRON: str = os.getenv("SESSION_FLUSH_CRON", "* * * * *")
+
+    # 报告渲染配置
+    # 渲染进程数，0 表示在线程中渲染（不使用多进程）
+    REPORT_RENDER_WORKERS: int = int(os.getenv("REPORT_RENDER_WORKERS", "2"))
+    # 除执行中的渲染外，最多允许排队的渲染数量
+    REPORT_RENDER_QUEUE_SIZE: int = int(os.getenv("REPORT_RENDER_QUEUE_SIZE", "8"))
+    # 单次渲染（及等待排队）的超时时间（秒）
+    REPORT_RENDER_TIMEOUT: int = int(os.getenv("REPORT_RENDER_TIMEOUT", "60"))
+    # 报告海报预取的单张超时时间（秒），超时使用占位图
+    REPORT_POSTER_TIMEOUT: float = float(os.getenv("REPORT_POSTER_TIMEOUT", "5"))
+    # 报告图片缓存的字节数上限
+    REPORT_CACHE_MAX_BYTES: int = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    # 定时报告的预生成提前量（秒），在推送前生成并写入缓存，0 表示不预生成
+    REPORT_WARMUP_LEAD_SECONDS: int = int(os.getenv("REPORT_WARMUP_LEAD_SECONDS", "300"))
+    # 同时执行的定时报告任务数上限（预生成和推送共用）
+    REPORT_JOB_CONCURRENCY: int = int(os.getenv("REPORT_JOB_CONCURRENCY", "2"))
+    # 定时报告按服务器错开的最大延迟（秒），由任务ID哈希得到固定值，0 表示不错开
+    REPORT_JOB_JITTER_SECONDS: int = int(os.getenv("REPORT_JOB_JITTER_SECONDS", "0"))
+
+    # 派生数据（筛选维度目录、用户每日汇总）定时刷新的 cron 表达式，为空则在请求中按需刷新
+    DERIVED_REFRESH_CRON: str = os.getenv("DERIVED_REFRESH_CRON", "* * * * *")
+
+    # Telegram Bot 中 /report 同时生成的报告数上限，超出时排队
+    TG_REPORT_CONCURRENCY: int = int(os.getenv("TG_REPORT_CONCURRENCY", "2"))
+
+    # Telegram 个人报告推送配置
+    # 全局发送速率上限（条/秒），Telegram 限制约为 30 条/秒
+    TG_DELIVERY_GLOBAL_RATE: float = float(os.getenv("TG_DELIVERY_GLOBAL_RATE", "25"))
+    # 同一会话两次发送之间的最小间隔（秒）
+    TG_DELIVERY_CHAT_INTERVAL: float = float(os.getenv("TG_DELIVERY_CHAT_INTERVAL", "1"))
+    # 并发发送的任务数
+    TG_DELIVERY_WORKERS: int = int(os.getenv("TG_DELIVERY_WORKERS", "4"))
+    # 待发送队列长度上限，队列满时生成端等待（避免报告图片全部堆积在内存中）
+    TG_DELIVERY_QUEUE_SIZE: int = int(os.getenv("TG_DELIVERY_QUEUE_SIZE", "50"))
+    # 单条消息发送失败（限流、网络错误）的最大重试次数
+    TG_DELIVERY_MAX_RETRIES: int = int(os.getenv("TG_DELIVERY_MAX_RETRIES", "3"))
 
 
 settings = Settings()
@@ -2,6 +2,7 @@
 数据库工具模块
 提供数据库连接和 SQL 辅助函数
 """
+import os
 import aiosqlite
 from typing import Optional
 from config import settings
@@ -17,6 +18,35 @@ def get_playback_db(server_config: Optional[dict] = None):
     return pool_manager.connection(db_path, pool_size=5)
 
 
+def get_playback_db_path(server_config: Optional[dict] = None) -> str:
+    """获取播放记录数据库路径"""
+    if server_config:
+        return server_config.get('playback_db', settings.PLAYBACK_DB)
+    return settings.PLAYBACK_DB
+
+
+async def get_playback_data_version(server_config: Optional[dict] = None) -> tuple:
+    """获取播放数据版本号，数据变化时改变
+
+    由最大 rowid（新增记录）与数据库/WAL 文件的修改时间和大小（更新、删除）组成，
+    用于判断基于播放数据生成的缓存是否过期
+    """
+    db_path = get_playback_db_path(server_config)
+    files = []
+    for path in (db_path, f"{db_path}-wal"):
+        try:
+            st = os.stat(path)
+            files.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            files.append(None)
+
+    async with get_playback_db(server_config) as db:
+        async with db.execute("SELECT MAX(rowid) FROM PlaybackActivity") as cursor:
+            row = await cursor.fetchone()
+    max_rowid = (row[0] if row else None) or 0
+    return (max_rowid, *files)
+
+
 def get_users_db(server_config: Optional[dict] = None):
     """获取用户数据库连接（使用连接池）"""
     if server_config:
@@ -46,6 +76,10 @@ def get_library_db(server_config: Optional[dict] = None):
     return pool_manager.connection(library_db, pool_size=3)
 
 
+def get_app_db(db_path: str):
+    """获取应用自身数据库连接（/config 下的会话、服务器等，使用 WAL 模式连接池）"""
+    return pool_manager.connection(db_path, pool_size=3, wal=True)
+
 
 def get_count_expr() -> str:
     """获取播放次数统计表达式（条件计数，只统计满足时长要求的）"""
@@ -4,6 +4,7 @@
 """
 import asyncio
 import aiosqlite
+from pathlib import Path
 from typing import Dict, Optional
 from contextlib import asynccontextmanager
 from logger import get_logger
@@ -14,18 +15,21 @@ logger = get_logger("db_pool")
 class DatabasePool:
     """数据库连接池类"""
 
-    def __init__(self, db_path: str, pool_size: int = 5):
+    def __init__(self, db_path: str, pool_size: int = 5, wal: bool = False):
         """
         初始化连接池
 
         Args:
             db_path: 数据库文件路径
             pool_size: 连接池大小（默认5个连接）
+            wal: 是否启用 WAL 日志模式（仅用于应用自身的数据库，不修改 Emby 的数据库）
         """
         self.db_path = db_path
         self.pool_size = pool_size
+        self.wal = wal
         self._pool: asyncio.Queue = asyncio.Queue(maxsize=pool_size)
         self._initialized = False
+        self._closed = False
         self._lock = asyncio.Lock()
         logger.info(f"[DBPool] Creating pool for {db_path} (size: {pool_size})")
 
@@ -36,13 +40,12 @@ class DatabasePool:
                 return
 
             logger.info(f"[DBPool] Initializing pool for {self.db_path}")
+            if self.wal:
+                # 应用数据库可能尚未创建，确保目录存在
+                Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
             for i in range(self.pool_size):
                 try:
-                    conn = await aiosqlite.connect(self.db_path)
-                    # 设置行工厂模式，返回字典格式
-                    conn.row_factory = aiosqlite.Row
-                    # 设置 busy_timeout，遇到锁时等待最多 30 秒
-                    await conn.execute("PRAGMA busy_timeout = 30000")
+                    conn = await self._connect()
                     await self._pool.put(conn)
                     logger.debug(f"[DBPool] Created connection {i+1}/{self.pool_size} for {self.db_path}")
                 except Exception as e:
@@ -52,6 +55,19 @@ class DatabasePool:
             self._initialized = True
             logger.info(f"[DBPool] Pool initialized for {self.db_path}")
 
+    async def _connect(self) -> aiosqlite.Connection:
+        """创建并配置一个新连接"""
+        conn = await aiosqlite.connect(self.db_path)
+        # 设置行工厂模式，返回字典格式
+        conn.row_factory = aiosqlite.Row
+        # 设置 busy_timeout，遇到锁时等待最多 30 秒
+        await conn.execute("PRAGMA busy_timeout = 30000")
+        if self.wal:
+            # WAL 模式下读写互不阻塞；synchronous=NORMAL 只在检查点时 fsync
+            await conn.execute("PRAGMA journal_mode = WAL")
+            await conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
     async def acquire(self, timeout: float = 10.0) -> aiosqlite.Connection:
         """
         从连接池获取一个连接
@@ -81,9 +97,7 @@ class DatabasePool:
                     await conn.close()
                 except:
                     pass
-                conn = await aiosqlite.connect(self.db_path)
-                conn.row_factory = aiosqlite.Row
-                await conn.execute("PRAGMA busy_timeout = 30000")
+                conn = await self._connect()
 
             return conn
         except asyncio.TimeoutError:
@@ -97,6 +111,13 @@ class DatabasePool:
         Args:
             conn: 数据库连接对象
         """
+        if self._closed:
+            # 连接池已关闭（服务器被删除或配置变更），直接关闭归还的连接
+            try:
+                await conn.close()
+            except Exception as e:
+                logger.error(f"[DBPool] Error closing connection: {e}")
+            return
         try:
             await self._pool.put(conn)
             logger.debug(f"[DBPool] Released connection for {self.db_path}")
@@ -115,12 +136,21 @@ class DatabasePool:
         conn = await self.acquire()
         try:
             yield conn
+        except BaseException:
+            # 连接会被复用，回滚未提交的事务，避免影响下一个使用者
+            if conn.in_transaction:
+                try:
+                    await conn.rollback()
+                except Exception as e:
+                    logger.error(f"[DBPool] Rollback failed for {self.db_path}: {e}")
+            raise
         finally:
             await self.release(conn)
 
     async def close_all(self):
         """关闭连接池中的所有连接"""
         logger.info(f"[DBPool] Closing pool for {self.db_path}")
+        self._closed = True
         closed_count = 0
 
         while not self._pool.empty():
@@ -145,13 +175,14 @@ class DatabasePoolManager:
         self._lock = asyncio.Lock()
         logger.info("[DBPoolManager] Initialized")
 
-    async def get_pool(self, db_path: str, pool_size: int = 5) -> DatabasePool:
+    async def get_pool(self, db_path: str, pool_size: int = 5, wal: bool = False) -> DatabasePool:
         """
         获取指定数据库的连接池，如果不存在则创建
 
         Args:
             db_path: 数据库文件路径
             pool_size: 连接池大小
+            wal: 是否启用 WAL 日志模式
 
         Returns:
             连接池对象
@@ -164,14 +195,14 @@ class DatabasePoolManager:
             if db_path in self._pools:
                 return self._pools[db_path]
 
-            pool = DatabasePool(db_path, pool_size)
+            pool = DatabasePool(db_path, pool_size, wal=wal)
             await pool.initialize()
             self._pools[db_path] = pool
             logger.info(f"[DBPoolManager] Created new pool for {db_path}")
             return pool
 
     @asynccontextmanager
-    async def connection(self, db_path: str, pool_size: int = 5):
+    async def connection(self, db_path: str, pool_size: int = 5, wal: bool = False):
         """
         获取数据库连接的上下文管理器
 
@@ -179,10 +210,17 @@ class DatabasePoolManager:
             async with pool_manager.connection("/path/to/db.sqlite") as conn:
                 await conn.execute("SELECT * FROM table")
         """
-        pool = await self.get_pool(db_path, pool_size)
+        pool = await self.get_pool(db_path, pool_size, wal=wal)
         async with pool.connection() as conn:
             yield conn
 
+    async def close_pool(self, db_path: str):
+        """关闭并移除指定数据库的连接池（下次使用时重新创建）"""
+        pool = self._pools.pop(db_path, None)
+        if pool is not None:
+            await pool.close_all()
+            logger.info(f"[DBPoolManager] Removed pool for {db_path}")
+
     async def close_all(self):
         """关闭所有连接池"""
         logger.info("[DBPoolManager] Closing all pools")
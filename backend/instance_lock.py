@@ -0,0 +1,62 @@
+"""
+后台任务进程锁模块
+定时任务和 Telegram Bot 只能在一个进程中运行。以多个 worker 启动时，
+只有取得锁文件的进程运行它们，其他进程只处理普通 API 请求
+"""
+import os
+from typing import Optional
+from logger import get_logger
+
+logger = get_logger("instance_lock")
+
+# 锁文件路径（与各应用数据库同目录）
+LOCK_FILE = "/config/.background.lock"
+
+_lock_file = None
+_primary: Optional[bool] = None
+
+
+def acquire() -> bool:
+    """尝试获取后台任务锁（进程退出时由系统自动释放）
+
+    Returns:
+        本进程是否负责运行定时任务和 Telegram Bot
+    """
+    global _lock_file, _primary
+    if _primary is not None:
+        return _primary
+
+    try:
+        import fcntl
+    except ImportError:
+        # 非 POSIX 平台无法加锁，按单进程处理
+        _primary = True
+        return _primary
+
+    try:
+        os.makedirs(os.path.dirname(LOCK_FILE), exist_ok=True)
+        # 追加模式打开，未取得锁的进程不会清空持有者写入的进程号
+        lock_file = open(LOCK_FILE, "a+")
+    except OSError as e:
+        logger.warning(f"无法创建后台任务锁文件 {LOCK_FILE}: {e}，按单进程处理")
+        _primary = True
+        return _primary
+
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        _primary = False
+        return _primary
+
+    lock_file.truncate(0)
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    _lock_file = lock_file
+    _primary = True
+    return _primary
+
+
+def is_primary() -> bool:
+    """本进程是否持有后台任务锁（未尝试获取时先获取）"""
+    return acquire()
@@ -22,9 +22,11 @@ from routers import (
 from routers.auth import get_current_session
 from services.session import session_service
 from services.servers import server_service
+from services.server_registry import server_registry
 from services.tg_binding import tg_binding_service
 from services.tg_bot import tg_bot_service
 from scheduler import setup_scheduler
+import instance_lock
 from logger import init_logging, get_logger
 from db_pool import pool_manager
 
@@ -50,6 +52,7 @@ PUBLIC_PATHS = {
     "/api/auth/check",
     "/api/auth/logout",
     "/api/debug/scheduler",  # 调试端点
+    "/api/tg-bot/webhook",   # Telegram webhook（使用密钥校验）
     "/manifest.json",
     "/sw.js",
 }
@@ -201,6 +204,11 @@ async def startup_event():
     await server_service.init_servers_table()
     logger.info("✓ 服务器配置数据库初始化完成")
 
+    # 初始化收藏快照数据库
+    from services.favorites import favorites_service
+    await favorites_service.init_db()
+    logger.info("✓ 收藏快照数据库初始化完成")
+
     # 迁移旧版配置（从环境变量自动创建默认服务器）
     await server_service.migrate_legacy_config()
     servers = await server_service.get_all_servers()
@@ -217,14 +225,19 @@ async def startup_event():
     # 检查数据库索引优化状态
     await check_database_indexes()
 
-    # 启动定时任务调度器
-    setup_scheduler()
-    logger.info("✓ 定时任务调度器已启动")
-
     # 初始化 TG 绑定数据库
     await tg_binding_service.init_db()
     logger.info("✓ TG 绑定数据库初始化完成")
 
+    # 定时任务和 Telegram Bot 只在一个进程中运行（多 worker 时避免重复推送）
+    if not instance_lock.acquire():
+        logger.warning("⚠ 其他进程已在运行定时任务和 Telegram Bot，本进程只处理 API 请求")
+        return
+
+    # 启动定时任务调度器
+    setup_scheduler()
+    logger.info("✓ 定时任务调度器已启动")
+
     # 启动 Telegram Bot
     await tg_bot_service.start()
     if tg_bot_service.is_running():
@@ -239,6 +252,20 @@ async def shutdown_event():
     # 停止 Telegram Bot
     await tg_bot_service.stop()
 
+    # 写入尚未落盘的会话活动时间
+    await session_service.flush_activity()
+
+    # 回收各服务器的 HTTP 客户端和后台任务
+    await server_registry.close_all()
+
+    # 关闭 Telegram 推送客户端
+    from services.telegram import telegram_service
+    await telegram_service.close()
+
+    # 关闭报告渲染进程池
+    from services.report_renderer import report_renderer
+    report_renderer.shutdown()
+
     # 关闭所有数据库连接池
     await pool_manager.close_all()
     logger.info("✓ 数据库连接池已关闭")
@@ -261,7 +288,8 @@ app.include_router(tools_router)
 @app.get("/api/debug/scheduler")
 async def debug_scheduler_status():
     """查看调度器状态（调试用）"""
-    from scheduler import scheduler
+    from scheduler import scheduler, get_report_job_stats
+    from services.telegram import telegram_service
 
     jobs_info = []
     for job in scheduler.get_jobs():
@@ -274,7 +302,26 @@ async def debug_scheduler_status():
     return {
         "running": scheduler.running,
         "job_count": len(scheduler.get_jobs()),
-        "jobs": jobs_info
+        "jobs": jobs_info,
+        "report_jobs": get_report_job_stats(),
+        "telegram": telegram_service.get_stats()
+    }
+
+
+# 调试用：查看媒体信息缓存命中情况
+@app.get("/api/debug/cache")
+async def debug_cache_status():
+    """查看 Emby 媒体信息缓存、派生数据刷新及各服务器资源状态（调试用）"""
+    from services.emby import emby_service
+    from services.report_cache import report_cache
+    from services.derived_data import derived_data_service
+
+    return {
+        "emby": emby_service.get_cache_stats(),
+        "report": report_cache.get_stats(),
+        # 含错误信息（数据库路径等），只在需要登录的端点返回
+        "derived_data": derived_data_service.get_stats(),
+        "servers": server_registry.get_stats()
     }
 
 
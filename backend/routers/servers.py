@@ -7,6 +7,7 @@ from typing import Optional
 from pydantic import BaseModel
 
 from services.servers import server_service
+from services.server_registry import server_registry
 
 router = APIRouter(prefix="/api/servers", tags=["servers"])
 
@@ -77,6 +78,7 @@ async def create_server(request: ServerCreateRequest):
 @router.put("/{server_id}")
 async def update_server(server_id: str, request: ServerUpdateRequest):
     """更新服务器配置"""
+    old_config = await server_service.get_server(server_id)
     success = await server_service.update_server(
         server_id=server_id,
         name=request.name,
@@ -89,15 +91,19 @@ async def update_server(server_id: str, request: ServerUpdateRequest):
     )
     if not success:
         raise HTTPException(status_code=404, detail="服务器不存在")
+    # 回收旧配置的连接池、HTTP 客户端和缓存，下次使用时按新配置重建
+    await server_registry.release(server_id, old_config)
     return {"success": True}
 
 
 @router.delete("/{server_id}")
 async def delete_server(server_id: str):
     """删除服务器"""
+    old_config = await server_service.get_server(server_id)
     success = await server_service.delete_server(server_id)
     if not success:
         raise HTTPException(status_code=404, detail="服务器不存在")
+    await server_registry.release(server_id, old_config)
     return {"success": True}
 
 
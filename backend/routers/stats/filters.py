@@ -5,8 +5,8 @@ Filters router
 from fastapi import APIRouter, Query
 from typing import Optional
 
-from database import get_playback_db
 from services.users import user_service
+from services.dimension_catalog import dimension_catalog_service
 from name_mappings import name_mapping_service
 from .helpers import get_server_config_from_id
 
@@ -15,81 +15,59 @@ router = APIRouter(prefix="/api", tags=["stats-filters"])
 
 @router.get("/filter-options")
 async def get_filter_options(
-    server_id: Optional[str] = Query(default=None, description="服务器ID")
+    server_id: Optional[str] = Query(default=None, description="服务器ID"),
+    start_date: Optional[str] = Query(default=None, description="只返回该日期（含）之后出现过的取值，YYYY-MM-DD"),
+    end_date: Optional[str] = Query(default=None, description="只返回该日期（含）之前出现过的取值，YYYY-MM-DD"),
 ):
-    """获取所有可用的筛选选项"""
+    """获取所有可用的筛选选项
+
+    数据来自按 rowid 增量维护的维度目录，不再每次全表扫描
+    """
     server_config = await get_server_config_from_id(server_id)
     user_map = await user_service.get_user_map(server_config)
+    catalog = await dimension_catalog_service.get_catalog(server_config)
 
-    async with get_playback_db(server_config) as db:
-        # 获取所有用户
-        async with db.execute("""
-            SELECT DISTINCT UserId FROM PlaybackActivity WHERE UserId IS NOT NULL
-        """) as cursor:
-            user_ids = []
-            async for row in cursor:
-                user_id = row[0]
-                if user_id:
-                    username = user_service.match_username(user_id, user_map)
-                    user_ids.append({"id": user_id, "name": username})
-
-        # 获取所有客户端（返回原始名称和映射后名称）
-        async with db.execute("""
-            SELECT DISTINCT ClientName FROM PlaybackActivity WHERE ClientName IS NOT NULL ORDER BY ClientName
-        """) as cursor:
-            clients = []
-            seen_mapped = set()
-            for row in await cursor.fetchall():
-                if row[0]:
-                    original = row[0]
-                    mapped = name_mapping_service.map_client_name(original)
-                    # 去重：如果映射后名称已存在则跳过
-                    if mapped not in seen_mapped:
-                        clients.append({
-                            "original": original,
-                            "display": mapped
-                        })
-                        seen_mapped.add(mapped)
+    # 获取所有用户
+    user_ids = [
+        {"id": user_id, "name": user_service.match_username(user_id, user_map)}
+        for user_id in catalog.seen_values("UserId", start_date, end_date)
+    ]
 
-        # 获取所有设备（返回原始名称和映射后名称）
-        async with db.execute("""
-            SELECT DISTINCT DeviceName FROM PlaybackActivity WHERE DeviceName IS NOT NULL ORDER BY DeviceName
-        """) as cursor:
-            devices = []
-            seen_mapped = set()
-            for row in await cursor.fetchall():
-                if row[0]:
-                    original = row[0]
-                    mapped = name_mapping_service.map_device_name(original)
-                    # 去重：如果映射后名称已存在则跳过
-                    if mapped not in seen_mapped:
-                        devices.append({
-                            "original": original,
-                            "display": mapped
-                        })
-                        seen_mapped.add(mapped)
+    # 获取所有客户端（返回原始名称和映射后名称）
+    clients = []
+    seen_mapped = set()
+    for original in catalog.seen_values("ClientName", start_date, end_date):
+        mapped = name_mapping_service.map_client_name(original)
+        # 去重：如果映射后名称已存在则跳过
+        if mapped not in seen_mapped:
+            clients.append({
+                "original": original,
+                "display": mapped
+            })
+            seen_mapped.add(mapped)
 
-        # 获取所有媒体类型
-        async with db.execute("""
-            SELECT DISTINCT ItemType FROM PlaybackActivity WHERE ItemType IS NOT NULL ORDER BY ItemType
-        """) as cursor:
-            item_types = [row[0] for row in await cursor.fetchall() if row[0]]
+    # 获取所有设备（返回原始名称和映射后名称）
+    devices = []
+    seen_mapped = set()
+    for original in catalog.seen_values("DeviceName", start_date, end_date):
+        mapped = name_mapping_service.map_device_name(original)
+        # 去重：如果映射后名称已存在则跳过
+        if mapped not in seen_mapped:
+            devices.append({
+                "original": original,
+                "display": mapped
+            })
+            seen_mapped.add(mapped)
 
-        # 获取所有播放方式
-        async with db.execute("""
-            SELECT DISTINCT PlaybackMethod FROM PlaybackActivity WHERE PlaybackMethod IS NOT NULL ORDER BY PlaybackMethod
-        """) as cursor:
-            playback_methods = [row[0] for row in await cursor.fetchall() if row[0]]
+    # 获取所有媒体类型、播放方式
+    item_types = catalog.seen_values("ItemType", start_date, end_date)
+    playback_methods = catalog.seen_values("PlaybackMethod", start_date, end_date)
 
-        # 获取日期范围
-        async with db.execute("""
-            SELECT MIN(date(DateCreated)), MAX(date(DateCreated)) FROM PlaybackActivity
-        """) as cursor:
-            row = await cursor.fetchone()
-            date_range = {
-                "min": row[0] if row else None,
-                "max": row[1] if row else None
-            }
+    # 日期范围
+    date_range = {
+        "min": catalog.min_date,
+        "max": catalog.max_date
+    }
 
     return {
         "users": user_ids,
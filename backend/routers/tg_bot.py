@@ -2,13 +2,15 @@
 Telegram Bot 管理路由
 提供 Bot 配置和绑定管理的 API
 """
-from fastapi import APIRouter, Query
+import secrets
+from fastapi import APIRouter, Query, Request, Header
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional
 
 from services.tg_bot import tg_bot_service, bot_config
 from services.tg_binding import tg_binding_service
+from services.tg_delivery import tg_delivery_queue
 from services.servers import server_service
 
 router = APIRouter(prefix="/api/tg-bot", tags=["tg-bot"])
@@ -20,6 +22,12 @@ class BotConfigRequest(BaseModel):
     enabled: Optional[bool] = None
     bot_token: Optional[str] = None
     default_period: Optional[str] = None
+    personal_reports_enabled: Optional[bool] = None
+    personal_reports_period: Optional[str] = None
+    personal_reports_cron: Optional[str] = None
+    mode: Optional[str] = None
+    webhook_url: Optional[str] = None
+    webhook_secret: Optional[str] = None
 
 
 @router.get("/config")
@@ -40,6 +48,12 @@ async def get_bot_config():
         "bot_token_masked": masked_token,
         "bot_token_configured": bool(config.get("bot_token")),
         "default_period": config.get("default_period", "monthly"),
+        "personal_reports_enabled": config.get("personal_reports_enabled", False),
+        "personal_reports_period": config.get("personal_reports_period", "monthly"),
+        "personal_reports_cron": config.get("personal_reports_cron", ""),
+        "mode": config.get("mode", "polling"),
+        "webhook_url": config.get("webhook_url", ""),
+        "webhook_secret_configured": bool(config.get("webhook_secret")),
         "is_running": tg_bot_service.is_running()
     }
 
@@ -55,12 +69,33 @@ async def save_bot_config(request: BotConfigRequest):
         config["bot_token"] = request.bot_token
     if request.default_period is not None:
         config["default_period"] = request.default_period
+    if request.personal_reports_enabled is not None:
+        config["personal_reports_enabled"] = request.personal_reports_enabled
+    if request.personal_reports_period is not None:
+        config["personal_reports_period"] = request.personal_reports_period
+    if request.personal_reports_cron is not None:
+        config["personal_reports_cron"] = request.personal_reports_cron
+    if request.mode is not None:
+        if request.mode not in ("polling", "webhook"):
+            return JSONResponse(status_code=400, content={"error": "mode 只能是 polling 或 webhook"})
+        config["mode"] = request.mode
+    if request.webhook_url is not None:
+        config["webhook_url"] = request.webhook_url
+    if request.webhook_secret is not None:
+        config["webhook_secret"] = request.webhook_secret
+    if config.get("mode") == "webhook" and not config.get("webhook_secret"):
+        # 密钥只在保存配置时生成一次，所有进程从配置文件读取同一个密钥
+        config["webhook_secret"] = secrets.token_urlsafe(32)
 
     success = bot_config.save(config)
     if not success:
         return JSONResponse(status_code=500, content={"error": "保存配置失败"})
 
-    return {"success": True, "message": "配置已保存，重启服务后生效"}
+    # 定时个人报告任务立即生效
+    from scheduler import setup_personal_report_job
+    setup_personal_report_job()
+
+    return {"success": True, "message": "配置已保存，定时个人报告设置已生效；Token、启用状态和接收方式需重启 Bot 后生效"}
 
 
 @router.post("/restart")
@@ -102,28 +137,52 @@ async def get_bot_status():
     return {
         "enabled": config.get("enabled", False),
         "configured": bool(config.get("bot_token")),
-        "is_running": tg_bot_service.is_running()
+        "is_running": tg_bot_service.is_running(),
+        "mode": tg_bot_service.get_mode(),
+        "delivery": tg_delivery_queue.get_stats()
     }
 
 
+@router.post("/webhook")
+async def telegram_webhook(
+    request: Request,
+    secret_token: Optional[str] = Header(default=None, alias="X-Telegram-Bot-Api-Secret-Token")
+):
+    """接收 Telegram 推送的更新（webhook 模式，使用密钥校验，无需登录）"""
+    if not tg_bot_service.is_running() or tg_bot_service.get_mode() != "webhook":
+        return JSONResponse(status_code=503, content={"error": "Bot 未以 webhook 模式运行"})
+
+    try:
+        data = await request.json()
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "无效的请求"})
+
+    if not await tg_bot_service.process_webhook_update(data, secret_token):
+        return JSONResponse(status_code=403, content={"error": "密钥校验失败"})
+    return {"ok": True}
+
+
 # ==================== 绑定管理 ====================
 
 @router.get("/bindings")
-async def get_all_bindings(server_id: Optional[str] = Query(default=None, description="服务器ID")):
-    """获取所有绑定关系"""
-    bindings = await tg_binding_service.get_all_bindings(server_id)
-
-    # 获取服务器名称映射
-    servers = await server_service.get_all_servers()
-    server_map = {s["id"]: s["name"] for s in servers}
+async def get_all_bindings(
+    server_id: Optional[str] = Query(default=None, description="服务器ID"),
+    limit: Optional[int] = Query(default=None, ge=1, description="每页数量，不指定则返回全部"),
+    offset: int = Query(default=0, ge=0, description="偏移量")
+):
+    """获取所有绑定关系（可分页，total 为总数）"""
+    bindings = await tg_binding_service.get_all_bindings(server_id, limit=limit, offset=offset)
+    total = await tg_binding_service.get_binding_count(server_id)
 
     # 添加服务器名称
+    server_map = await server_service.get_server_map()
     for binding in bindings:
-        binding["server_name"] = server_map.get(binding["server_id"], "未知")
+        server = server_map.get(binding["server_id"])
+        binding["server_name"] = server["name"] if server else "未知"
 
     return {
         "bindings": bindings,
-        "total": len(bindings)
+        "total": total
     }
 
 
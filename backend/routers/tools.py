@@ -6,7 +6,6 @@
 
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-import aiosqlite
 
 from database import get_playback_db
 from services.servers import server_service
@@ -51,15 +50,14 @@ async def replace_item_id(request: ReplaceItemIdRequest):
         if not db_path:
             raise HTTPException(status_code=400, detail="服务器未配置播放记录数据库")
 
-        async with aiosqlite.connect(db_path) as db:
-            # 设置 busy_timeout，避免多服务器环境下的锁死问题
-            await db.execute("PRAGMA busy_timeout = 30000")
+        # 复用播放记录数据库连接池（Emby 的数据库，不修改其日志模式）
+        async with get_playback_db(server_config) as db:
             # 查询受影响的记录数
-            cursor = await db.execute(
+            async with db.execute(
                 "SELECT COUNT(*) FROM PlaybackActivity WHERE ItemId = ?",
                 (request.old_id,)
-            )
-            count_result = await cursor.fetchone()
+            ) as cursor:
+                count_result = await cursor.fetchone()
             count = count_result[0] if count_result else 0
 
             if count == 0:
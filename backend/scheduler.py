@@ -2,9 +2,15 @@
 定时任务调度器
 处理观影报告的定时推送（每个服务器独立配置，每日/每周/每月三个独立任务）
 """
+import asyncio
+import hashlib
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from typing import Literal
+from apscheduler.triggers.date import DateTrigger
+from typing import Literal, Optional
 from logger import get_logger
 
 logger = get_logger("scheduler")
@@ -14,11 +20,100 @@ scheduler = AsyncIOScheduler()
 
 ReportPeriod = Literal["daily", "weekly", "monthly"]
 
+PERSONAL_REPORT_JOB_ID = "tg_personal_reports"
+
+# 报告任务的全局并发名额（首次使用时创建）及排队统计
+_report_semaphore: Optional[asyncio.Semaphore] = None
+_report_job_stats = {
+    "runs": 0,
+    "running": 0,
+    "waiting": 0,
+    "total_wait": 0.0,
+    "max_wait": 0.0,
+    "last_wait": 0.0,
+    "last_job": None,
+    "total_duration": 0.0,
+}
+
+
+def _job_jitter(job_id: str) -> int:
+    """任务的固定延迟（秒），由任务ID哈希得到，同一任务每次相同，不同服务器错开"""
+    from config import settings
+
+    max_jitter = settings.REPORT_JOB_JITTER_SECONDS
+    if max_jitter <= 0:
+        return 0
+    digest = hashlib.md5(job_id.encode()).hexdigest()
+    return int(digest, 16) % (max_jitter + 1)
+
+
+@asynccontextmanager
+async def _report_slot(job_id: str, jitter_job_id: Optional[str] = None):
+    """报告任务执行名额：先按固定延迟错开，再等待全局并发名额，并记录排队耗时
+
+    Args:
+        jitter_job_id: 按该任务ID计算延迟（预生成使用推送任务的延迟，保持提前量）
+    """
+    from config import settings
+
+    global _report_semaphore
+    jitter = _job_jitter(jitter_job_id or job_id)
+    if jitter:
+        await asyncio.sleep(jitter)
+
+    if _report_semaphore is None:
+        _report_semaphore = asyncio.Semaphore(max(settings.REPORT_JOB_CONCURRENCY, 1))
+
+    stats = _report_job_stats
+    stats["waiting"] += 1
+    queued_at = time.monotonic()
+    try:
+        await _report_semaphore.acquire()
+    finally:
+        stats["waiting"] -= 1
+    wait = time.monotonic() - queued_at
+    stats["runs"] += 1
+    stats["running"] += 1
+    stats["total_wait"] += wait
+    stats["max_wait"] = max(stats["max_wait"], wait)
+    stats["last_wait"] = wait
+    stats["last_job"] = job_id
+    started_at = time.monotonic()
+    try:
+        yield
+    finally:
+        stats["running"] -= 1
+        stats["total_duration"] += time.monotonic() - started_at
+        _report_semaphore.release()
 
-async def send_report_for_server(period: ReportPeriod, server_id: str):
-    """发送指定服务器指定周期的观影报告"""
+
+def get_report_job_stats() -> dict:
+    """报告任务排队统计（调试用）"""
+    from config import settings
+
+    stats = _report_job_stats
+    runs = stats["runs"]
+    return {
+        "concurrency": max(settings.REPORT_JOB_CONCURRENCY, 1),
+        "jitter_seconds": settings.REPORT_JOB_JITTER_SECONDS,
+        "runs": runs,
+        "running": stats["running"],
+        "waiting": stats["waiting"],
+        "avg_wait": round(stats["total_wait"] / runs, 3) if runs else 0,
+        "max_wait": round(stats["max_wait"], 3),
+        "last_wait": round(stats["last_wait"], 3),
+        "last_job": stats["last_job"],
+        "avg_duration": round(stats["total_duration"] / runs, 3) if runs else 0,
+    }
+
+
+async def _prepare_report(period: ReportPeriod, server_id: str):
+    """加载定时报告所需的配置，未配置推送或服务器不存在时返回 None
+
+    Returns:
+        (报告配置, 服务器配置, 用户ID列表)
+    """
     from services.report import report_service
-    from services.telegram import telegram_service
     from services.report_config import report_config_service
     from services.servers import server_service
 
@@ -27,17 +122,13 @@ async def send_report_for_server(period: ReportPeriod, server_id: str):
 
     if not config.telegram.enabled or not config.telegram.bot_token or not config.telegram.chat_id:
         logger.info(f"Scheduler [{server_id}][{period}]: Telegram not configured, skipping")
-        return
+        return None
 
     # 获取服务器配置
     server_config = await server_service.get_server(server_id)
     if not server_config:
         logger.warning(f"Scheduler [{server_id}][{period}]: Server not found, skipping")
-        return
-
-    server_name = server_config.get("name", server_id)
-    period_names = {"daily": "今日", "weekly": "本周", "monthly": "本月"}
-    logger.info(f"Scheduler [{server_name}][{period}]: Starting {period_names[period]} report...")
+        return None
 
     # 获取配置的用户ID列表
     user_ids = None
@@ -45,6 +136,59 @@ async def send_report_for_server(period: ReportPeriod, server_id: str):
         report_users = await report_service.get_report_users(config.users, server_config)
         user_ids = [uid for uid, _ in report_users]
 
+    return config, server_config, user_ids
+
+
+async def warm_up_report_for_server(period: ReportPeriod, server_id: str):
+    """预先生成定时报告并写入报告缓存
+
+    推送时如果播放数据没有变化，直接使用缓存的图片；有变化时才重新生成
+    """
+    from services.report import report_service
+
+    job_id = _get_job_id(server_id, period)
+    async with _report_slot(f"{job_id}_warmup", jitter_job_id=job_id):
+        prepared = await _prepare_report(period, server_id)
+        if not prepared:
+            return
+        config, server_config, user_ids = prepared
+
+        server_name = server_config.get("name", server_id)
+        try:
+            await report_service.generate_report_image(
+                user_ids=user_ids,
+                period=period,
+                content_count=config.content_count,
+                server_config=server_config
+            )
+            logger.info(f"Scheduler [{server_name}][{period}]: Report pre-rendered")
+        except Exception as e:
+            logger.error(f"Scheduler [{server_name}][{period}]: Pre-render error: {e}")
+
+
+async def send_report_for_server(period: ReportPeriod, server_id: str):
+    """发送指定服务器指定周期的观影报告"""
+    # 安排下一次推送前的预生成
+    _schedule_warmup(server_id, period)
+
+    async with _report_slot(_get_job_id(server_id, period)):
+        await _send_report(period, server_id)
+
+
+async def _send_report(period: ReportPeriod, server_id: str):
+    """生成并推送报告"""
+    from services.report import report_service
+    from services.telegram import telegram_service
+
+    prepared = await _prepare_report(period, server_id)
+    if not prepared:
+        return
+    config, server_config, user_ids = prepared
+
+    server_name = server_config.get("name", server_id)
+    period_names = {"daily": "今日", "weekly": "本周", "monthly": "本月"}
+    logger.info(f"Scheduler [{server_name}][{period}]: Starting {period_names[period]} report...")
+
     try:
         image_data = await report_service.generate_report_image(
             user_ids=user_ids,
@@ -70,6 +214,14 @@ async def send_report_for_server(period: ReportPeriod, server_id: str):
         logger.error(f"Scheduler [{server_name}][{period}]: Error: {e}")
 
 
+async def send_personal_reports():
+    """向所有绑定的 Telegram 用户推送个人报告"""
+    from services.tg_bot import tg_bot_service
+
+    async with _report_slot(PERSONAL_REPORT_JOB_ID):
+        await tg_bot_service.send_personal_reports()
+
+
 async def clean_expired_sessions():
     """清理过期会话"""
     from services.session import session_service
@@ -77,6 +229,26 @@ async def clean_expired_sessions():
     logger.info(f"Scheduler: Cleaned {cleaned} expired sessions")
 
 
+async def flush_session_activity():
+    """批量写入会话最后活动时间"""
+    from services.session import session_service
+    flushed = await session_service.flush_activity()
+    if flushed:
+        logger.debug(f"Scheduler: Flushed activity for {flushed} sessions")
+
+
+async def refresh_derived_data():
+    """检查播放数据变化并刷新各服务器的派生数据"""
+    from services.derived_data import derived_data_service
+    await derived_data_service.refresh_all()
+
+
+async def refresh_favorites_snapshot():
+    """增量刷新所有服务器的收藏快照"""
+    from services.favorites import favorites_service
+    await favorites_service.refresh_all()
+
+
 def _parse_cron(cron_str: str) -> dict:
     """解析 cron 表达式"""
     parts = cron_str.strip().split()
@@ -114,6 +286,55 @@ def _add_job(job_id: str, func, cron_str: str, args: tuple = None):
         logger.error(f"Scheduler: Failed to add job '{job_id}': {e}")
 
 
+def _add_report_job(server_id: str, period: str, cron_str: str):
+    """添加定时报告任务及其预生成任务"""
+    _add_job(_get_job_id(server_id, period), send_report_for_server, cron_str, (period, server_id))
+    _schedule_warmup(server_id, period)
+
+
+def _schedule_warmup(server_id: str, period: str):
+    """在下一次推送前 REPORT_WARMUP_LEAD_SECONDS 秒安排一次预生成
+
+    推送任务执行时会安排下一轮的预生成；距离下一次推送不足提前量时跳过本轮
+    """
+    from config import settings
+
+    lead = settings.REPORT_WARMUP_LEAD_SECONDS
+    job = scheduler.get_job(_get_job_id(server_id, period))
+    if lead <= 0 or job is None:
+        return
+
+    now = datetime.now(job.trigger.timezone)
+    next_fire = job.trigger.get_next_fire_time(None, now)
+    if next_fire is None:
+        return
+    run_date = next_fire - timedelta(seconds=lead)
+    if run_date <= now:
+        return
+
+    scheduler.add_job(
+        warm_up_report_for_server,
+        trigger=DateTrigger(run_date=run_date),
+        id=f"{_get_job_id(server_id, period)}_warmup",
+        name=f"{_get_job_id(server_id, period)}_warmup",
+        args=(period, server_id),
+        replace_existing=True
+    )
+    logger.debug(f"Scheduler: Report warm-up for '{server_id}' ({period}) at {run_date}")
+
+
+def setup_personal_report_job():
+    """根据 Bot 配置添加或移除定时个人报告任务（Bot 配置保存后也会调用）"""
+    from services.tg_bot import bot_config
+
+    if scheduler.get_job(PERSONAL_REPORT_JOB_ID):
+        scheduler.remove_job(PERSONAL_REPORT_JOB_ID)
+
+    config = bot_config.load()
+    if config.get("enabled") and config.get("personal_reports_enabled") and config.get("personal_reports_cron"):
+        _add_job(PERSONAL_REPORT_JOB_ID, send_personal_reports, config["personal_reports_cron"])
+
+
 def _remove_all_report_jobs():
     """移除所有报告相关的定时任务"""
     jobs_to_remove = []
@@ -141,22 +362,36 @@ def setup_scheduler():
 
         # 每日报告
         if schedule.daily.enabled and schedule.daily.cron:
-            job_id = _get_job_id(server_id, "daily")
-            _add_job(job_id, send_report_for_server, schedule.daily.cron, ("daily", server_id))
+            _add_report_job(server_id, "daily", schedule.daily.cron)
 
         # 每周报告
         if schedule.weekly.enabled and schedule.weekly.cron:
-            job_id = _get_job_id(server_id, "weekly")
-            _add_job(job_id, send_report_for_server, schedule.weekly.cron, ("weekly", server_id))
+            _add_report_job(server_id, "weekly", schedule.weekly.cron)
 
         # 每月报告
         if schedule.monthly.enabled and schedule.monthly.cron:
-            job_id = _get_job_id(server_id, "monthly")
-            _add_job(job_id, send_report_for_server, schedule.monthly.cron, ("monthly", server_id))
+            _add_report_job(server_id, "monthly", schedule.monthly.cron)
+
+    # Telegram 个人报告推送
+    setup_personal_report_job()
 
     # 每小时清理过期会话
     _add_job("clean_sessions", clean_expired_sessions, "0 * * * *")
 
+    from config import settings
+
+    # 定时写入会话活动时间
+    if settings.SESSION_FLUSH_CRON:
+        _add_job("flush_sessions", flush_session_activity, settings.SESSION_FLUSH_CRON)
+
+    # 定时刷新派生数据
+    if settings.DERIVED_REFRESH_CRON:
+        _add_job("derived_data", refresh_derived_data, settings.DERIVED_REFRESH_CRON)
+
+    # 定时刷新收藏快照
+    if settings.FAVORITES_SNAPSHOT_CRON:
+        _add_job("favorites_snapshot", refresh_favorites_snapshot, settings.FAVORITES_SNAPSHOT_CRON)
+
     if not scheduler.running:
         scheduler.start()
         logger.info("Scheduler: Started")
@@ -179,16 +414,13 @@ def reload_scheduler():
         schedule = config.schedule
 
         if schedule.daily.enabled and schedule.daily.cron:
-            job_id = _get_job_id(server_id, "daily")
-            _add_job(job_id, send_report_for_server, schedule.daily.cron, ("daily", server_id))
+            _add_report_job(server_id, "daily", schedule.daily.cron)
 
         if schedule.weekly.enabled and schedule.weekly.cron:
-            job_id = _get_job_id(server_id, "weekly")
-            _add_job(job_id, send_report_for_server, schedule.weekly.cron, ("weekly", server_id))
+            _add_report_job(server_id, "weekly", schedule.weekly.cron)
 
         if schedule.monthly.enabled and schedule.monthly.cron:
-            job_id = _get_job_id(server_id, "monthly")
-            _add_job(job_id, send_report_for_server, schedule.monthly.cron, ("monthly", server_id))
+            _add_report_job(server_id, "monthly", schedule.monthly.cron)
 
     logger.info("Scheduler: Reloaded")
 
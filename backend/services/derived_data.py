@@ -0,0 +1,211 @@
+"""
+派生数据刷新服务模块
+由定时任务统一检查各服务器的播放数据是否变化，变化时依次刷新已注册的派生数据
+（筛选维度目录、用户每日汇总等），用户请求中只读取已有结果
+"""
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Callable, Awaitable
+from apscheduler.triggers.cron import CronTrigger
+from config import settings
+from database import get_playback_db, get_playback_data_version
+from logger import get_logger
+
+logger = get_logger("services.derived_data")
+
+# 全表计数核对删除的最小间隔（秒）。平时各派生数据只比较最小 rowid，
+# 只能发现保留期清理（删除最旧的记录）；中间记录被手动删除时由全表计数发现
+RECONCILE_INTERVAL_SECONDS = 3600
+
+# 刷新函数：(服务器配置, 播放记录最大 rowid, rowid 不超过最大值的记录数或 None) -> None
+Refresher = Callable[[Optional[dict], int, Optional[int]], Awaitable]
+
+
+def _refresh_dimension_catalog(server_config: Optional[dict], max_rowid: int, row_count: Optional[int]):
+    from services.dimension_catalog import dimension_catalog_service
+    return dimension_catalog_service.refresh(server_config, max_rowid=max_rowid, row_count=row_count)
+
+
+def _refresh_rollups(server_config: Optional[dict], max_rowid: int, row_count: Optional[int]):
+    from services.rollups import rollup_service
+    return rollup_service.refresh(server_config, max_rowid=max_rowid, row_count=row_count)
+
+
+class DerivedDataService:
+    """派生数据刷新服务类
+
+    - 播放数据版本（最大 rowid + 数据库及 -wal 文件的修改时间和大小）未变化时跳过，
+      但每 RECONCILE_INTERVAL_SECONDS 秒做一次全表计数核对删除
+    - 各派生数据自行按 rowid 高水位分批增量更新，批次之间让出事件循环
+    - 按服务器记录刷新耗时和滞后情况，供调试接口查看
+    - 最近一次检查成功且未超过两个定时周期时视为最新，否则读取方自行刷新
+    """
+
+    def __init__(self):
+        self._refreshers: Dict[str, Refresher] = {}
+        # 服务器ID -> 上次刷新时的播放数据版本
+        self._versions: Dict[str, tuple] = {}
+        # 服务器ID -> 上次成功检查（含无变化）的时间（monotonic）
+        self._last_ok: Dict[str, float] = {}
+        # 服务器ID -> 上次全表计数核对的时间（monotonic）
+        self._last_reconcile: Dict[str, float] = {}
+        # 服务器ID -> 首次检查到尚未刷新的新数据的时间（monotonic），刷新成功后清除
+        self._pending_since: Dict[str, float] = {}
+        # 服务器ID -> 刷新统计
+        self._stats: Dict[str, dict] = {}
+        # (cron 表达式, 定时周期秒数)
+        self._interval: tuple = ("", 0.0)
+        self.register("dimension_catalog", _refresh_dimension_catalog)
+        self.register("rollups", _refresh_rollups)
+
+    def register(self, name: str, refresher: Refresher):
+        """注册派生数据的刷新函数"""
+        self._refreshers[name] = refresher
+
+    async def refresh_server(self, server_config: Optional[dict] = None, force: bool = False) -> bool:
+        """检查并刷新单个服务器的派生数据
+
+        Returns:
+            是否执行了刷新（数据未变化时返回 False）
+        """
+        server_id = server_config.get('id', 'default') if server_config else 'default'
+        stats = self._stats.setdefault(server_id, {
+            "last_checked": None,
+            "last_refreshed": None,
+            "last_duration_ms": 0,
+            "lag_seconds": None,
+            "lag_rows": 0,
+            "refreshes": 0,
+            "errors": 0,
+            "last_error": None,
+            "refreshers": {},
+        })
+        now = datetime.now()
+        stats["last_checked"] = now.isoformat()
+
+        try:
+            version = await get_playback_data_version(server_config)
+        except Exception:
+            self._last_ok.pop(server_id, None)
+            raise
+        previous = self._versions.get(server_id)
+        last_reconcile = self._last_reconcile.get(server_id)
+        reconcile = last_reconcile is None or time.monotonic() - last_reconcile >= RECONCILE_INTERVAL_SECONDS
+        # 数据未变化且不需要核对时跳过
+        if not force and version == previous and not reconcile:
+            stats["lag_rows"] = 0
+            self._last_ok[server_id] = time.monotonic()
+            return False
+
+        started = time.monotonic()
+        if version != previous:
+            self._pending_since.setdefault(server_id, started)
+        max_rowid = version[0]
+        stats["lag_rows"] = max_rowid - previous[0] if previous else max_rowid
+
+        row_count = None
+        if reconcile:
+            # 全表计数一次，供所有派生数据共用；失败时本轮只做最小 rowid 检查
+            try:
+                async with get_playback_db(server_config) as db:
+                    async with db.execute(
+                        "SELECT COUNT(*) FROM PlaybackActivity WHERE rowid <= ?", (max_rowid,)
+                    ) as cursor:
+                        row_count = (await cursor.fetchone())[0]
+                self._last_reconcile[server_id] = started
+            except Exception as e:
+                logger.warning(f"Derived data row count failed for server {server_id}: {e}")
+
+        failed = False
+        for name, refresher in self._refreshers.items():
+            step_started = time.monotonic()
+            try:
+                await refresher(server_config, max_rowid, row_count)
+            except Exception as e:
+                failed = True
+                stats["errors"] += 1
+                stats["last_error"] = f"{name}: {e}"
+                logger.error(f"Derived data '{name}' refresh failed for server {server_id}: {e}")
+            stats["refreshers"][name] = int((time.monotonic() - step_started) * 1000)
+
+        stats["last_duration_ms"] = int((time.monotonic() - started) * 1000)
+        stats["refreshes"] += 1
+        stats["last_refreshed"] = datetime.now().isoformat()
+        # 有失败时不记录版本，下次继续重试；在此之前读取方自行刷新
+        if failed:
+            self._last_ok.pop(server_id, None)
+        else:
+            self._versions[server_id] = version
+            self._last_ok[server_id] = time.monotonic()
+            pending_since = self._pending_since.pop(server_id, None)
+            if pending_since is not None:
+                # 从首次检查到新数据（含之后失败重试的时间）到刷新完成的耗时
+                stats["lag_seconds"] = round(time.monotonic() - pending_since, 1)
+        return True
+
+    async def refresh_all(self):
+        """检查并刷新所有服务器的派生数据（定时任务调用）"""
+        from services.servers import server_service
+
+        for server in await server_service.get_all_servers():
+            try:
+                await self.refresh_server(server)
+            except Exception as e:
+                # 播放数据库不可用等，不影响其他服务器
+                logger.error(f"Derived data check failed for server {server.get('id')}: {e}")
+
+    def invalidate(self, server_id: str):
+        """丢弃服务器的版本记录，下次定时任务时强制刷新"""
+        self._versions.pop(server_id, None)
+        self._last_ok.pop(server_id, None)
+        self._last_reconcile.pop(server_id, None)
+        self._pending_since.pop(server_id, None)
+        self._stats.pop(server_id, None)
+
+    def _get_interval(self) -> float:
+        """DERIVED_REFRESH_CRON 的定时周期（秒），未配置或无法解析时返回 0"""
+        cron = settings.DERIVED_REFRESH_CRON
+        if self._interval[0] != cron:
+            seconds = 0.0
+            try:
+                trigger = CronTrigger.from_crontab(cron)
+                first = trigger.get_next_fire_time(None, datetime.now(trigger.timezone))
+                second = trigger.get_next_fire_time(first, first + timedelta(seconds=1))
+                seconds = (second - first).total_seconds()
+            except Exception as e:
+                logger.warning(f"Invalid DERIVED_REFRESH_CRON '{cron}': {e}")
+            self._interval = (cron, seconds)
+        return self._interval[1]
+
+    def is_fresh(self, server_config: Optional[dict] = None) -> bool:
+        """定时任务最近是否成功检查过该服务器（两个定时周期内且没有失败）
+
+        定时任务停止或持续失败时返回 False，读取方回退为请求中刷新
+        """
+        server_id = server_config.get('id', 'default') if server_config else 'default'
+        last_ok = self._last_ok.get(server_id)
+        interval = self._get_interval()
+        if last_ok is None or not interval:
+            return False
+        return time.monotonic() - last_ok <= interval * 2
+
+    def get_stats(self) -> dict:
+        """获取各服务器的刷新统计（调试用）
+
+        lag_seconds 为最近一次刷新的滞后（首次检查到新数据至刷新完成），
+        pending_seconds 为当前检查到但尚未刷新成功的新数据已等待的时间
+        """
+        now = time.monotonic()
+        result = {}
+        for server_id, stats in self._stats.items():
+            pending_since = self._pending_since.get(server_id)
+            result[server_id] = {
+                **stats,
+                "refreshers": dict(stats["refreshers"]),
+                "pending_seconds": round(now - pending_since, 1) if pending_since is not None else 0,
+            }
+        return result
+
+
+# 单例实例
+derived_data_service = DerivedDataService()
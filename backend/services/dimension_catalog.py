@@ -0,0 +1,198 @@
+"""
+筛选维度目录服务模块
+按服务器维护 PlaybackActivity 各筛选维度的取值目录，
+基于 rowid 高水位增量更新，筛选面板直接从内存读取
+"""
+import asyncio
+from typing import Optional, Dict, List
+from config import settings
+from database import get_playback_db, local_date
+from logger import get_logger
+
+logger = get_logger("services.dimension_catalog")
+
+# 目录维护的维度（列名）
+DIMENSIONS = ("UserId", "ClientName", "DeviceName", "ItemType", "PlaybackMethod")
+
+# 每批扫描的 rowid 数量，批次之间让出事件循环
+CATALOG_BATCH_ROWS = 50000
+
+
+class DimensionCatalog:
+    """单个播放数据库的维度目录"""
+
+    def __init__(self):
+        # 已处理的最大 rowid
+        self.high_water_mark = 0
+        # 已处理的行数和建立时的最小 rowid（用于检测高水位以下的删除）
+        self.row_count = 0
+        self.min_rowid = 0
+        # 建立目录时的时区偏移
+        self.tz_offset = settings.TZ_OFFSET
+        # 维度 -> 取值 -> 本地日期 -> 行数
+        self.days: Dict[str, Dict[str, Dict[str, int]]] = {dim: {} for dim in DIMENSIONS}
+        # 维度 -> 取值 -> {"first_seen", "last_seen", "count"}
+        self.values: Dict[str, Dict[str, dict]] = {dim: {} for dim in DIMENSIONS}
+        # 全表日期范围（UTC 日期，与原接口一致）
+        self.min_date: Optional[str] = None
+        self.max_date: Optional[str] = None
+
+    def add(self, dim: str, value: str, day: Optional[str], count: int):
+        """合并一组增量统计"""
+        value_days = self.days[dim].setdefault(value, {})
+        if day:
+            value_days[day] = value_days.get(day, 0) + count
+        info = self.values[dim].get(value)
+        if info is None:
+            info = {"first_seen": day, "last_seen": day, "count": 0}
+            self.values[dim][value] = info
+        info["count"] += count
+        if day:
+            if not info["first_seen"] or day < info["first_seen"]:
+                info["first_seen"] = day
+            if not info["last_seen"] or day > info["last_seen"]:
+                info["last_seen"] = day
+
+    def update_date_range(self, min_date: Optional[str], max_date: Optional[str]):
+        """合并日期范围"""
+        if min_date and (not self.min_date or min_date < self.min_date):
+            self.min_date = min_date
+        if max_date and (not self.max_date or max_date > self.max_date):
+            self.max_date = max_date
+
+    def seen_values(self, dim: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> List[str]:
+        """获取维度的取值（可限定在指定日期范围内出现过），按取值排序"""
+        if not start_date and not end_date:
+            return sorted(self.values[dim])
+
+        result = []
+        for value, info in self.values[dim].items():
+            # 先用首次/最后出现日期快速排除
+            if start_date and info["last_seen"] and info["last_seen"] < start_date:
+                continue
+            if end_date and info["first_seen"] and info["first_seen"] > end_date:
+                continue
+            for day in self.days[dim][value]:
+                if (not start_date or day >= start_date) and (not end_date or day <= end_date):
+                    result.append(value)
+                    break
+        return sorted(result)
+
+
+class DimensionCatalogService:
+    """筛选维度目录服务类"""
+
+    def __init__(self):
+        # playback_db 路径 -> DimensionCatalog
+        self._catalogs: Dict[str, DimensionCatalog] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _get_db_path(self, server_config: Optional[dict] = None) -> str:
+        """获取播放数据库路径"""
+        if server_config:
+            return server_config.get('playback_db', settings.PLAYBACK_DB)
+        return settings.PLAYBACK_DB
+
+    def invalidate(self, server_config: Optional[dict] = None):
+        """丢弃指定服务器（或全部）的目录，下次访问时重建"""
+        if server_config is None:
+            self._catalogs.clear()
+            return
+        self._catalogs.pop(self._get_db_path(server_config), None)
+
+    async def refresh(
+        self,
+        server_config: Optional[dict] = None,
+        max_rowid: Optional[int] = None,
+        row_count: Optional[int] = None
+    ) -> DimensionCatalog:
+        """根据 rowid 高水位增量更新目录
+
+        只扫描上次之后新增的行（按 CATALOG_BATCH_ROWS 分批）；以下情况整体重建：
+        最大 rowid 回退（数据库被替换或清理）、最小 rowid 变化（旧记录被保留期清理）、
+        传入 row_count 时高水位以下的行数不一致（中间的记录被手动删除）、时区配置变化
+
+        Args:
+            max_rowid: 已知的播放记录最大 rowid（不传则查询）
+            row_count: rowid 不超过 max_rowid 的记录数（由派生数据任务低频计数后传入）
+        """
+        db_path = self._get_db_path(server_config)
+        lock = self._locks.setdefault(db_path, asyncio.Lock())
+        async with lock:
+            catalog = self._catalogs.get(db_path)
+
+            async with get_playback_db(server_config) as db:
+                async with db.execute("SELECT MIN(rowid), MAX(rowid) FROM PlaybackActivity") as cursor:
+                    row = await cursor.fetchone()
+                min_rowid = (row[0] if row else None) or 0
+                if max_rowid is None:
+                    max_rowid = (row[1] if row else None) or 0
+
+                stale = False
+                if catalog is not None:
+                    if max_rowid < catalog.high_water_mark or catalog.tz_offset != settings.TZ_OFFSET:
+                        stale = True
+                    elif catalog.high_water_mark:
+                        stale = min_rowid != catalog.min_rowid
+                        if not stale and row_count is not None:
+                            # 高水位以下的行数 = 总行数 - 高水位之后的新增行数（只扫描新增部分）
+                            async with db.execute(
+                                "SELECT COUNT(*) FROM PlaybackActivity WHERE rowid > ? AND rowid <= ?",
+                                (catalog.high_water_mark, max_rowid)
+                            ) as cursor:
+                                new_rows = (await cursor.fetchone())[0]
+                            stale = row_count - new_rows != catalog.row_count
+
+                if catalog is None or stale:
+                    if stale:
+                        logger.info(f"播放记录被删除或替换、或时区配置变化，重建维度目录: {db_path}")
+                    catalog = DimensionCatalog()
+                catalog.min_rowid = min_rowid
+
+                day_expr = local_date("DateCreated")
+                while catalog.high_water_mark < max_rowid:
+                    low = catalog.high_water_mark
+                    high = min(low + CATALOG_BATCH_ROWS, max_rowid)
+                    for dim in DIMENSIONS:
+                        async with db.execute(f"""
+                            SELECT {dim}, {day_expr} as day, COUNT(*)
+                            FROM PlaybackActivity
+                            WHERE rowid > ? AND rowid <= ? AND {dim} IS NOT NULL
+                            GROUP BY {dim}, day
+                        """, (low, high)) as cursor:
+                            for value, day, count in await cursor.fetchall():
+                                if value:
+                                    catalog.add(dim, value, day, count)
+
+                    async with db.execute("""
+                        SELECT MIN(date(DateCreated)), MAX(date(DateCreated)), COUNT(*)
+                        FROM PlaybackActivity
+                        WHERE rowid > ? AND rowid <= ?
+                    """, (low, high)) as cursor:
+                        row = await cursor.fetchone()
+                        if row:
+                            catalog.update_date_range(row[0], row[1])
+                            catalog.row_count += row[2]
+
+                    catalog.high_water_mark = high
+                    await asyncio.sleep(0)
+
+            self._catalogs[db_path] = catalog
+            return catalog
+
+    async def get_catalog(self, server_config: Optional[dict] = None) -> DimensionCatalog:
+        """获取维度目录
+
+        派生数据定时任务已在刷新该服务器时直接返回内存中的目录，
+        否则（首次使用或未启用定时刷新）在请求中增量更新
+        """
+        from services.derived_data import derived_data_service
+
+        catalog = self._catalogs.get(self._get_db_path(server_config))
+        if catalog is not None and settings.DERIVED_REFRESH_CRON and derived_data_service.is_fresh(server_config):
+            return catalog
+        return await self.refresh(server_config)
+
+
+# 单例实例
+dimension_catalog_service = DimensionCatalogService()
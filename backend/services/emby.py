@@ -7,6 +7,7 @@ import aiosqlite
 from typing import Optional, Dict, List
 from cachetools import TTLCache
 from config import settings
+from services.server_registry import server_registry
 from logger import get_logger
 
 logger = get_logger("services.emby")
@@ -28,6 +29,47 @@ class EmbyService:
             maxsize=settings.ITEM_CACHE_MAX_SIZE,
             ttl=CACHE_TTL_SECONDS
         )
+        # 负缓存：记录已删除或查询失败的媒体项/搜索词，避免每次请求都重新访问 Emby
+        # get_item_info、get_items_info_batch、search_item_by_name 共用
+        self._miss_cache: TTLCache = TTLCache(
+            maxsize=settings.ITEM_MISS_CACHE_MAX_SIZE,
+            ttl=settings.ITEM_MISS_CACHE_TTL
+        )
+        # 海报图片缓存（按字节数限制大小），报告渲染和海报接口共用
+        self._image_cache: TTLCache = TTLCache(
+            maxsize=settings.IMAGE_CACHE_MAX_BYTES,
+            ttl=settings.IMAGE_CACHE_TTL,
+            getsizeof=lambda value: max(len(value[0]), 1)
+        )
+        self._cache_stats: Dict[str, int] = {
+            "hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+        }
+
+    def get_cache_stats(self) -> dict:
+        """获取媒体信息缓存的命中统计"""
+        return {
+            **self._cache_stats,
+            "item_cache_size": len(self._item_info_cache),
+            "item_cache_max_size": self._item_info_cache.maxsize,
+            "miss_cache_size": len(self._miss_cache),
+            "miss_cache_max_size": self._miss_cache.maxsize,
+            "miss_cache_ttl": self._miss_cache.ttl,
+            "image_cache_items": len(self._image_cache),
+            "image_cache_bytes": self._image_cache.currsize,
+            "image_cache_max_bytes": self._image_cache.maxsize,
+        }
+
+    def invalidate_server(self, server_id: str):
+        """清除指定服务器的 API Key、用户ID和媒体信息缓存（服务器配置变更或删除时调用）"""
+        self._api_key_cache.pop(server_id, None)
+        self._user_id_cache.pop(server_id, None)
+        prefix = f"{server_id}:"
+        search_prefix = f"search:{server_id}:"
+        for cache in (self._item_info_cache, self._miss_cache, self._image_cache):
+            for key in [k for k in list(cache.keys()) if k.startswith(prefix) or k.startswith(search_prefix)]:
+                cache.pop(key, None)
 
     async def _is_admin_api_key(self, api_key: str, server_config: Optional[dict] = None) -> bool:
         """检查 api_key 对应用户是否为管理员（用于选择更稳定的 Token）"""
@@ -36,7 +78,7 @@ class EmbyService:
 
         emby_url = server_config.get('emby_url', settings.EMBY_URL) if server_config else settings.EMBY_URL
         try:
-            async with httpx.AsyncClient() as client:
+            async with server_registry.http_client(server_config) as client:
                 resp = await client.get(
                     f"{emby_url}/emby/Users/Me",
                     params={"api_key": api_key},
@@ -134,7 +176,7 @@ class EmbyService:
 
         try:
             api_key = await self.get_api_key(server_config)
-            async with httpx.AsyncClient() as client:
+            async with server_registry.http_client(server_config) as client:
                 resp = await client.get(
                     f"{emby_url}/emby/Users",
                     params={"api_key": api_key},
@@ -164,16 +206,23 @@ class EmbyService:
         """
         emby_url = server_config.get('emby_url', settings.EMBY_URL) if server_config else settings.EMBY_URL
 
+        # 对于剧集，提取剧名（去掉"剧名 - S01E01"中的集数部分）
+        search_name = name.split(" - ")[0] if item_type == "Episode" and " - " in name else name
+
+        server_id = server_config.get('id', 'default') if server_config else 'default'
+        miss_key = f"search:{server_id}:{item_type}:{search_name}"
+        if miss_key in self._miss_cache:
+            self._cache_stats["negative_hits"] += 1
+            return None
+        self._cache_stats["misses"] += 1
+
         try:
             api_key = await self.get_api_key(server_config)
             user_id = await self.get_user_id(server_config)
             if not api_key or not user_id:
                 return None
 
-            # 对于剧集，提取剧名（去掉"剧名 - S01E01"中的集数部分）
-            search_name = name.split(" - ")[0] if item_type == "Episode" and " - " in name else name
-
-            async with httpx.AsyncClient() as client:
+            async with server_registry.http_client(server_config) as client:
                 resp = await client.get(
                     f"{emby_url}/emby/Users/{user_id}/Items",
                     params={
@@ -195,7 +244,9 @@ class EmbyService:
                                 return item.get("Id")
                         # 如果没有精确匹配，返回第一个结果
                         return results[0].get("Id")
+                    self._miss_cache[miss_key] = True
                 else:
+                    # 认证失败、限流、服务端错误等不代表条目不存在，不写入负缓存
                     logger.warning(f"Failed to search item '{name}': {resp.status_code}")
         except Exception as e:
             logger.error(f"Error searching item by name '{name}': {e}")
@@ -205,7 +256,12 @@ class EmbyService:
         """获取媒体项目信息（包含海报等）"""
         cache_key = f"{server_config.get('id', 'default') if server_config else 'default'}:{item_id}"
         if cache_key in self._item_info_cache:
+            self._cache_stats["hits"] += 1
             return self._item_info_cache[cache_key]
+        if cache_key in self._miss_cache:
+            self._cache_stats["negative_hits"] += 1
+            return {}
+        self._cache_stats["misses"] += 1
 
         emby_url = server_config.get('emby_url', settings.EMBY_URL) if server_config else settings.EMBY_URL
 
@@ -215,7 +271,7 @@ class EmbyService:
             if not api_key or not user_id:
                 return {}
 
-            async with httpx.AsyncClient() as client:
+            async with server_registry.http_client(server_config) as client:
                 resp = await client.get(
                     f"{emby_url}/emby/Users/{user_id}/Items/{item_id}",
                     params={
@@ -230,6 +286,9 @@ class EmbyService:
                     return info
                 else:
                     logger.warning(f"Failed to get item info for {item_id}: {resp.status_code}")
+                    if resp.status_code == 404:
+                        # 只有 404 明确表示条目已被删除，才写入负缓存
+                        self._miss_cache[cache_key] = True
         except Exception as e:
             logger.error(f"Error getting item info for {item_id}: {e}")
         return {}
@@ -256,8 +315,13 @@ class EmbyService:
         for item_id in item_ids:
             cache_key = f"{server_id}:{item_id}"
             if cache_key in self._item_info_cache:
+                self._cache_stats["hits"] += 1
                 result[item_id] = self._item_info_cache[cache_key]
+            elif cache_key in self._miss_cache:
+                self._cache_stats["negative_hits"] += 1
+                result[item_id] = {}
             else:
+                self._cache_stats["misses"] += 1
                 uncached_ids.append(item_id)
 
         # 如果所有都已缓存,直接返回
@@ -275,7 +339,7 @@ class EmbyService:
 
         try:
             # Emby API支持通过Ids参数批量查询
-            async with httpx.AsyncClient() as client:
+            async with server_registry.http_client(server_config) as client:
                 resp = await client.get(
                     f"{emby_url}/emby/Users/{user_id}/Items",
                     params={
@@ -297,12 +361,11 @@ class EmbyService:
                             self._item_info_cache[cache_key] = item
                             result[item_id] = item
 
-                    # 对于未返回的item_id,返回空字典
+                    # 对于未返回的item_id,返回空字典并写入负缓存
                     for item_id in uncached_ids:
                         if item_id not in result:
                             result[item_id] = {}
-                            cache_key = f"{server_id}:{item_id}"
-                            self._item_info_cache[cache_key] = {}
+                            self._miss_cache[f"{server_id}:{item_id}"] = True
                 else:
                     logger.warning(f"Failed to batch get items info: {resp.status_code}")
                     # 失败时,为未缓存的ID返回空字典
@@ -330,7 +393,7 @@ class EmbyService:
         if not api_key:
             return b"", "image/jpeg"
 
-        async with httpx.AsyncClient(follow_redirects=True) as client:
+        async with server_registry.http_client(server_config) as client:
             resp = await client.get(
                 f"{emby_url}/emby/Items/{item_id}/Images/{image_type}",
                 params={
@@ -340,6 +403,7 @@ class EmbyService:
                     "quality": 90,
                 },
                 timeout=15,
+                follow_redirects=True,
             )
             if resp.status_code == 200 and resp.content:
                 return resp.content, resp.headers.get("content-type", "image/jpeg")
@@ -347,12 +411,20 @@ class EmbyService:
 
     async def get_poster(self, item_id: str, max_height: int = 300, max_width: int = 200, server_config: Optional[dict] = None) -> tuple[bytes, str]:
         """获取海报图片，返回 (图片数据, content_type)"""
+        server_id = server_config.get('id', 'default') if server_config else 'default'
+        cache_key = f"{server_id}:{item_id}:poster:{max_height}x{max_width}"
+        cached = self._image_cache.get(cache_key)
+        if cached:
+            return cached
+
         try:
             # 有些条目 Emby 没有 Primary，但有 Thumb/继承图；这里做兜底
             content, content_type = await self._get_image(item_id, "Primary", max_height, max_width, server_config)
-            if content:
-                return content, content_type
-            return await self._get_image(item_id, "Thumb", max_height, max_width, server_config)
+            if not content:
+                content, content_type = await self._get_image(item_id, "Thumb", max_height, max_width, server_config)
+            if content and len(content) <= self._image_cache.maxsize:
+                self._image_cache[cache_key] = (content, content_type)
+            return content, content_type
         except Exception as e:
             logger.error(f"Error fetching poster for {item_id}: {e}")
 
@@ -367,7 +439,7 @@ class EmbyService:
             if not api_key:
                 return b"", "image/jpeg"
 
-            async with httpx.AsyncClient() as client:
+            async with server_registry.http_client(server_config) as client:
                 resp = await client.get(
                     f"{emby_url}/emby/Items/{item_id}/Images/Backdrop",
                     params={
@@ -436,7 +508,7 @@ class EmbyService:
             if not api_key:
                 return []
 
-            async with httpx.AsyncClient() as client:
+            async with server_registry.http_client(server_config) as client:
                 resp = await client.get(
                     f"{emby_url}/emby/Sessions",
                     params={"api_key": api_key},
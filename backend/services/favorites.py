@@ -0,0 +1,461 @@
+"""
+收藏统计服务
+并发获取各用户的 Emby 收藏，按服务器写入快照表（favorites.db），
+页面从快照表中用 SQL 聚合读取；快照由定时任务增量刷新
+"""
+import asyncio
+import hashlib
+import json
+import time
+import httpx
+from typing import Optional, Dict, List, Tuple
+from config import settings
+from database import get_app_db
+from services.emby import emby_service
+from services.server_registry import server_registry
+from services.users import user_service
+from logger import get_logger
+
+logger = get_logger("services.favorites")
+
+# 收藏快照数据库路径
+FAVORITES_DB = "/config/favorites.db"
+
+# 收藏查询需要的字段（DateLastSaved 用于计算变更签名）
+FAVORITE_FIELDS = "ProductionYear,SeriesInfo,ImageTags,SeriesPrimaryImageTag,SeriesId,SeriesName,DateLastSaved"
+
+PERMISSION_WARNING = "当前 API Key 可能没有管理员权限，无法读取其他用户收藏；请在服务器配置中填写管理员 API Key。"
+
+
+def normalize_user_id(uid: str) -> str:
+    """标准化用户ID（去除短横线，转小写）"""
+    return (uid or "").replace("-", "").lower()
+
+
+def to_dashed_guid(uid: str) -> str:
+    """将无短横线的 GUID 转换为标准格式（带短横线）"""
+    raw = normalize_user_id(uid)
+    if len(raw) != 32:
+        return uid
+    return f"{raw[0:8]}-{raw[8:12]}-{raw[12:16]}-{raw[16:20]}-{raw[20:32]}"
+
+
+def build_favorite_item(item: dict) -> dict:
+    """从 Emby 返回的条目中提取收藏展示所需字段"""
+    series_id = item.get("SeriesId")
+    if not series_id:
+        series_info = item.get("SeriesInfo") or {}
+        if isinstance(series_info, dict):
+            series_id = series_info.get("Id") or series_info.get("SeriesId")
+
+    return {
+        "item_id": item.get("Id", ""),
+        "name": item.get("Name", "Unknown"),
+        "type": item.get("Type", "Unknown"),
+        "year": item.get("ProductionYear"),
+        "has_poster": bool((item.get("ImageTags") or {}).get("Primary") or series_id),
+        "series_id": series_id,
+        "series_name": item.get("SeriesName"),
+    }
+
+
+def favorites_signature(items: list) -> str:
+    """根据收藏条目 ID 和 DateLastSaved 计算变更签名"""
+    parts = sorted(f"{item.get('Id', '')}:{item.get('DateLastSaved', '')}" for item in items)
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def empty_favorites_response() -> dict:
+    """空的收藏统计结果"""
+    return {
+        "users_favorites": [],
+        "items": [],
+        "total_users": 0,
+        "users_with_favorites": 0
+    }
+
+
+class FavoritesService:
+    """收藏统计服务类"""
+
+    def __init__(self):
+        self._refresh_locks: Dict[str, asyncio.Lock] = {}
+
+    async def init_db(self):
+        """初始化收藏快照表"""
+        async with get_app_db(FAVORITES_DB) as db:
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS favorite_users (
+                    server_id TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    etag TEXT,
+                    signature TEXT,
+                    refreshed_at REAL NOT NULL,
+                    PRIMARY KEY (server_id, user_id)
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS favorite_items (
+                    server_id TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    item_id TEXT NOT NULL,
+                    name TEXT,
+                    type TEXT,
+                    year INTEGER,
+                    has_poster INTEGER NOT NULL DEFAULT 0,
+                    series_id TEXT,
+                    series_name TEXT,
+                    PRIMARY KEY (server_id, user_id, item_id)
+                )
+            """)
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_favorite_items_item
+                ON favorite_items(server_id, item_id)
+            """)
+            # 每个服务器最近一次完成的刷新（快照是否过期以此为准，不受个别用户持续失败影响）
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS favorite_refresh_runs (
+                    server_id TEXT PRIMARY KEY,
+                    refreshed_at REAL NOT NULL,
+                    failed_users INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            await db.commit()
+
+    async def _list_users(
+        self,
+        client: httpx.AsyncClient,
+        emby_url: str,
+        api_key: str,
+        user_map: dict,
+    ) -> List[Tuple[str, str]]:
+        """获取用户列表，优先使用 Emby API（避免 users.db 缺失或 UserId 格式不匹配导致全空）"""
+        users: List[Tuple[str, str]] = []
+        try:
+            resp = await client.get(
+                f"{emby_url}/emby/Users",
+                params={"api_key": api_key},
+                timeout=10,
+            )
+            if resp.status_code == 200:
+                for u in resp.json() or []:
+                    uid = u.get("Id")
+                    name = u.get("Name") or "Unknown"
+                    if uid:
+                        users.append((uid, name))
+        except Exception as e:
+            logger.error(f"Error fetching users list: {e}")
+
+        if not users:
+            users = list(user_map.items())
+        return users
+
+    async def _fetch_user_favorites(
+        self,
+        client: httpx.AsyncClient,
+        emby_url: str,
+        api_key: str,
+        user_id: str,
+        etag: Optional[str] = None,
+    ) -> Tuple[str, str, Optional[str], Optional[list]]:
+        """获取单个用户的收藏
+
+        Returns:
+            (状态, 实际使用的用户ID, ETag, 原始条目列表)
+            状态为 ok / unchanged / denied / error；unchanged 表示服务器返回 304
+        """
+        params = {
+            "api_key": api_key,
+            "Filters": "IsFavorite",
+            "Recursive": "true",
+            "Fields": FAVORITE_FIELDS,
+        }
+        headers = {"If-None-Match": etag} if etag else None
+        resp = await client.get(f"{emby_url}/emby/Users/{user_id}/Items", params=params, headers=headers, timeout=15)
+
+        if resp.status_code == 304:
+            return "unchanged", user_id, etag, None
+
+        if resp.status_code in (401, 403):
+            return "denied", user_id, None, []
+
+        # 兼容部分环境 UserId 带/不带短横线导致的 404
+        if resp.status_code == 404:
+            alt_user_id = to_dashed_guid(user_id) if "-" not in (user_id or "") else normalize_user_id(user_id)
+            if alt_user_id and alt_user_id != user_id:
+                resp = await client.get(f"{emby_url}/emby/Users/{alt_user_id}/Items", params=params, timeout=15)
+                if resp.status_code == 200:
+                    user_id = alt_user_id
+
+        if resp.status_code != 200:
+            return "error", user_id, None, []
+
+        data = resp.json() or {}
+        return "ok", user_id, resp.headers.get("etag"), data.get("Items", []) or []
+
+    async def _load_user_states(self, server_id: str) -> Dict[str, dict]:
+        """读取快照中每个用户的 ETag 和签名"""
+        async with get_app_db(FAVORITES_DB) as db:
+            async with db.execute(
+                "SELECT user_id, status, etag, signature FROM favorite_users WHERE server_id = ?",
+                (server_id,)
+            ) as cursor:
+                return {row["user_id"]: dict(row) for row in await cursor.fetchall()}
+
+    async def refresh(self, server_config: dict) -> dict:
+        """增量刷新指定服务器的收藏快照
+
+        每个用户都会请求一次 Emby（携带上次的 ETag），但只有收藏签名变化的用户
+        才会重写快照表；服务器返回 304 时直接跳过。
+
+        Returns:
+            刷新统计 {"users": 总用户数, "changed": 重写的用户数, "failed": 失败用户数}
+        """
+        server_id = server_config.get("id", "default")
+        lock = self._refresh_locks.setdefault(server_id, asyncio.Lock())
+        async with lock, server_registry.http_client(server_config) as client:
+            return await self._refresh_locked(server_config, client)
+
+    async def _refresh_locked(self, server_config: dict, client: httpx.AsyncClient) -> dict:
+        server_id = server_config.get("id", "default")
+        stats = {"users": 0, "changed": 0, "failed": 0}
+
+        emby_url = server_config.get("emby_url")
+        api_key = await emby_service.get_api_key(server_config)
+        if not emby_url or not api_key:
+            return stats
+
+        user_map = await user_service.get_user_map(server_config)
+        users = await self._list_users(client, emby_url, api_key, user_map)
+        stats["users"] = len(users)
+
+        states = await self._load_user_states(server_id)
+        # 快照中的用户ID可能是替换格式后的ID，按标准化ID建立索引
+        states_by_norm = {normalize_user_id(uid): state for uid, state in states.items()}
+
+        semaphore = asyncio.Semaphore(max(settings.FAVORITES_CONCURRENCY, 1))
+
+        async def _fetch(user_id: str):
+            state = states_by_norm.get(normalize_user_id(user_id)) or {}
+            async with semaphore:
+                try:
+                    return await self._fetch_user_favorites(client, emby_url, api_key, user_id, state.get("etag"))
+                except Exception as e:
+                    logger.error(f"Error fetching favorites for user {user_id}: {e}")
+                    return "error", user_id, None, []
+
+        results = await asyncio.gather(*[_fetch(user_id) for user_id, _ in users])
+
+        now = time.time()
+        seen_user_ids = []
+        async with get_app_db(FAVORITES_DB) as db:
+            for (user_id_raw, username_raw), (status, user_id, etag, items) in zip(users, results):
+                username = user_map.get(normalize_user_id(user_id_raw), username_raw)
+                state = states_by_norm.get(normalize_user_id(user_id_raw))
+
+                if status == "error":
+                    stats["failed"] += 1
+                    # 获取失败时保留上一次的快照
+                    if state:
+                        seen_user_ids.append(state["user_id"])
+                        continue
+
+                if status == "unchanged" and state:
+                    seen_user_ids.append(state["user_id"])
+                    await db.execute(
+                        "UPDATE favorite_users SET refreshed_at = ? WHERE server_id = ? AND user_id = ?",
+                        (now, server_id, state["user_id"])
+                    )
+                    continue
+
+                seen_user_ids.append(user_id)
+                signature = favorites_signature(items or [])
+                if state and state["user_id"] == user_id and state["status"] == status and state["signature"] == signature:
+                    # 收藏未变化，只更新刷新时间和 ETag
+                    await db.execute(
+                        "UPDATE favorite_users SET refreshed_at = ?, etag = ? WHERE server_id = ? AND user_id = ?",
+                        (now, etag, server_id, user_id)
+                    )
+                    continue
+
+                stats["changed"] += 1
+                if state:
+                    await db.execute(
+                        "DELETE FROM favorite_items WHERE server_id = ? AND user_id = ?",
+                        (server_id, state["user_id"])
+                    )
+                    await db.execute(
+                        "DELETE FROM favorite_users WHERE server_id = ? AND user_id = ?",
+                        (server_id, state["user_id"])
+                    )
+                await db.execute("""
+                    INSERT OR REPLACE INTO favorite_users
+                    (server_id, user_id, username, status, etag, signature, refreshed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (server_id, user_id, username, status, etag, signature, now))
+                await db.execute(
+                    "DELETE FROM favorite_items WHERE server_id = ? AND user_id = ?",
+                    (server_id, user_id)
+                )
+                if items:
+                    rows = []
+                    for item in items:
+                        fav = build_favorite_item(item)
+                        rows.append((
+                            server_id, user_id, fav["item_id"], fav["name"], fav["type"], fav["year"],
+                            1 if fav["has_poster"] else 0, fav["series_id"], fav["series_name"]
+                        ))
+                    await db.executemany("""
+                        INSERT OR REPLACE INTO favorite_items
+                        (server_id, user_id, item_id, name, type, year, has_poster, series_id, series_name)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, rows)
+
+            # 清理已不存在的用户
+            seen = set(seen_user_ids)
+            stale_user_ids = [uid for uid in states if uid not in seen]
+            for uid in stale_user_ids:
+                await db.execute("DELETE FROM favorite_items WHERE server_id = ? AND user_id = ?", (server_id, uid))
+                await db.execute("DELETE FROM favorite_users WHERE server_id = ? AND user_id = ?", (server_id, uid))
+
+            await db.execute("""
+                INSERT OR REPLACE INTO favorite_refresh_runs (server_id, refreshed_at, failed_users)
+                VALUES (?, ?, ?)
+            """, (server_id, now, stats["failed"]))
+            await db.commit()
+
+        logger.info(
+            f"Favorites snapshot [{server_id}]: {stats['users']} users, "
+            f"{stats['changed']} changed, {stats['failed']} failed"
+        )
+        return stats
+
+    async def refresh_all(self):
+        """刷新所有服务器的收藏快照（定时任务使用）"""
+        from services.servers import server_service
+
+        for server in await server_service.get_all_servers():
+            try:
+                await self.refresh(server)
+            except Exception as e:
+                logger.error(f"Favorites snapshot failed for server {server.get('id')}: {e}")
+
+    def _schedule_refresh(self, server_config: dict):
+        """在后台刷新快照（同一服务器同时只有一个刷新任务，任务随服务器资源一起回收）"""
+        server_id = server_config.get("id", "default")
+        lock = self._refresh_locks.get(server_id)
+        if lock and lock.locked():
+            return
+        server_registry.get(server_config).spawn(
+            "favorites_refresh", lambda: self.refresh(server_config)
+        )
+
+    async def _read_snapshot(self, server_id: str) -> Optional[dict]:
+        """从快照表聚合收藏统计，快照不存在时返回 None"""
+        async with get_app_db(FAVORITES_DB) as db:
+
+            async with db.execute("""
+                SELECT COUNT(*) AS total_users,
+                       SUM(CASE WHEN status = 'denied' THEN 1 ELSE 0 END) AS denied_users,
+                       MIN(refreshed_at) AS oldest_refresh
+                FROM favorite_users
+                WHERE server_id = ?
+            """, (server_id,)) as cursor:
+                summary = await cursor.fetchone()
+            if not summary or not summary["total_users"]:
+                return None
+
+            # 获取失败的用户保留上次的快照行，不更新 refreshed_at，
+            # 因此以最近一次刷新的完成时间判断是否过期（旧版本没有记录时退回最早的用户刷新时间）
+            async with db.execute(
+                "SELECT refreshed_at FROM favorite_refresh_runs WHERE server_id = ?", (server_id,)
+            ) as cursor:
+                run = await cursor.fetchone()
+            refreshed_at = run["refreshed_at"] if run else summary["oldest_refresh"]
+
+            # 按内容聚合收藏次数
+            async with db.execute("""
+                SELECT fi.item_id,
+                       MIN(fi.name) AS name,
+                       MIN(fi.type) AS type,
+                       COUNT(*) AS favorite_count,
+                       MAX(fi.has_poster) AS has_poster,
+                       MAX(fi.series_id) AS series_id,
+                       json_group_array(json_object('user_id', fu.user_id, 'username', fu.username)) AS users
+                FROM favorite_items fi
+                JOIN favorite_users fu ON fu.server_id = fi.server_id AND fu.user_id = fi.user_id
+                WHERE fi.server_id = ?
+                GROUP BY fi.item_id
+                ORDER BY favorite_count DESC
+            """, (server_id,)) as cursor:
+                items = [
+                    {
+                        "item_id": row["item_id"],
+                        "name": row["name"],
+                        "type": row["type"],
+                        "favorite_count": row["favorite_count"],
+                        "has_poster": bool(row["has_poster"]),
+                        "series_id": row["series_id"],
+                        "users": json.loads(row["users"]),
+                    }
+                    async for row in cursor
+                ]
+
+            # 按用户列出收藏
+            users_favorites: Dict[str, dict] = {}
+            async with db.execute("""
+                SELECT fu.user_id, fu.username, fi.item_id, fi.name, fi.type, fi.year,
+                       fi.has_poster, fi.series_id, fi.series_name
+                FROM favorite_items fi
+                JOIN favorite_users fu ON fu.server_id = fi.server_id AND fu.user_id = fi.user_id
+                WHERE fi.server_id = ?
+                ORDER BY fu.username, fi.rowid
+            """, (server_id,)) as cursor:
+                async for row in cursor:
+                    entry = users_favorites.setdefault(row["user_id"], {
+                        "user_id": row["user_id"],
+                        "username": row["username"],
+                        "favorites": [],
+                    })
+                    entry["favorites"].append({
+                        "item_id": row["item_id"],
+                        "name": row["name"],
+                        "type": row["type"],
+                        "year": row["year"],
+                        "has_poster": bool(row["has_poster"]),
+                        "series_id": row["series_id"],
+                        "series_name": row["series_name"],
+                    })
+
+        users_with_favorites = len(users_favorites)
+        resp_data = {
+            "users_favorites": list(users_favorites.values()),
+            "items": items,
+            "total_users": summary["total_users"],
+            "users_with_favorites": users_with_favorites,
+            "refreshed_at": refreshed_at,
+        }
+        if summary["denied_users"] and users_with_favorites == 0:
+            resp_data["warning"] = PERMISSION_WARNING
+        return resp_data
+
+    async def get_favorites(self, server_config: dict) -> dict:
+        """获取收藏统计
+
+        从快照表读取；快照过期时在后台刷新，首次访问（无快照）时同步刷新。
+        """
+        server_id = server_config.get("id", "default")
+        data = await self._read_snapshot(server_id)
+        if data is not None:
+            if time.time() - (data["refreshed_at"] or 0) > settings.FAVORITES_CACHE_TTL:
+                self._schedule_refresh(server_config)
+            return data
+
+        await self.refresh(server_config)
+        return await self._read_snapshot(server_id) or empty_favorites_response()
+
+
+# 单例实例
+favorites_service = FavoritesService()
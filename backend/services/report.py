@@ -2,21 +2,55 @@
 观影报告生成服务
 生成观影统计报告图片（美化版）
 """
+import asyncio
 import io
+from functools import lru_cache
 from datetime import datetime, timedelta
 from collections import defaultdict
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from PIL import Image, ImageDraw, ImageFont
 from typing import Optional, Literal
 
 from config import settings
-from database import get_playback_db, get_count_expr, get_duration_filter, local_date
+from database import get_playback_db, get_playback_data_version, get_count_expr, get_duration_filter, local_date
 from services.users import user_service
 from services.emby import emby_service
+from services.report_renderer import report_renderer
+from services.report_cache import report_cache, make_report_key
+from services.report_assets import get_font, blurred_shadow, rounded_mask, rank_badge
+from logger import get_logger
+
+logger = get_logger("services.report")
 
 
 # 报告类型
 ReportPeriod = Literal["daily", "weekly", "monthly", "yearly"]
 
+# 批量查询时每条 SQL 的最大用户数（避免超出 SQLite 参数数量限制）
+BATCH_USER_CHUNK = 500
+
+# 常规字体路径（按优先级排序）
+REGULAR_FONT_PATHS = (
+    # Debian/Ubuntu fonts-noto-cjk 包的常见路径
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    # 简体中文特定字体
+    "/usr/share/fonts/opentype/noto/NotoSansCJKsc-Regular.otf",
+    "/usr/share/fonts/truetype/noto/NotoSansCJKsc-Regular.otf",
+    # 其他可能的路径
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+)
+
+# 粗体字体路径（找不到粗体时回退到常规字体）
+BOLD_FONT_PATHS = (
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/truetype/noto/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSansCJKsc-Bold.otf",
+    "/usr/share/fonts/truetype/noto/NotoSansCJKsc-Bold.otf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+) + REGULAR_FONT_PATHS
+
 
 class ReportService:
     """观影报告服务"""
@@ -37,36 +71,16 @@ class ReportService:
         self.success_color = (34, 197, 94)         # #22c55e - Vuetify success
 
     def _get_font(self, size: int, bold: bool = False) -> ImageFont.FreeTypeFont:
-        """获取字体"""
-        # 常规字体路径（按优先级排序）
-        font_paths = [
-            # Debian/Ubuntu fonts-noto-cjk 包的常见路径
-            "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
-            "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
-            "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
-            # 简体中文特定字体
-            "/usr/share/fonts/opentype/noto/NotoSansCJKsc-Regular.otf",
-            "/usr/share/fonts/truetype/noto/NotoSansCJKsc-Regular.otf",
-            # 其他可能的路径
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-        ]
-        if bold:
-            bold_paths = [
-                "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc",
-                "/usr/share/fonts/truetype/noto/NotoSansCJK-Bold.ttc",
-                "/usr/share/fonts/noto-cjk/NotoSansCJK-Bold.ttc",
-                "/usr/share/fonts/opentype/noto/NotoSansCJKsc-Bold.otf",
-                "/usr/share/fonts/truetype/noto/NotoSansCJKsc-Bold.otf",
-                "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-            ]
-            font_paths = bold_paths + font_paths
-        for path in font_paths:
-            try:
-                return ImageFont.truetype(path, size)
-            except (OSError, IOError):
-                # 字体文件不存在或无法读取，尝试下一个
-                continue
-        return ImageFont.load_default()
+        """获取字体（进程级缓存，字体路径只探测一次）"""
+        return get_font(BOLD_FONT_PATHS if bold else REGULAR_FONT_PATHS, size)
+
+    def warm_up(self, scale: float = 2.0):
+        """预先解析字体路径并加载常用字号（渲染进程启动时调用）"""
+        for size in (32, 28, 24, 18, 16):
+            self._get_font(int(size * scale), bold=True)
+        for size in (14, 13, 11):
+            self._get_font(int(size * scale))
+        self._get_font(int(11 * scale), bold=True)
 
     def _format_duration(self, seconds: int) -> str:
         """格式化时长"""
@@ -118,11 +132,33 @@ class ReportService:
             # 海报获取失败（网络错误、API 错误等），返回空
             return None
 
+    async def _prefetch_posters(self, items: list[dict], server_config: dict = None):
+        """并发获取所有热门内容的海报，写入 item["poster"]
+
+        相同 poster_id 只获取一次；并发数不超过 Emby 连接池大小，
+        单张超时从实际发起请求时开始计算。超时或失败的条目使用占位图，不影响其他条目
+        """
+        slots = asyncio.Semaphore(max(settings.EMBY_HTTP_MAX_CONNECTIONS, 1))
+
+        async def _fetch(poster_id: str) -> Optional[bytes]:
+            async with slots:
+                try:
+                    return await asyncio.wait_for(
+                        self._get_poster_bytes(poster_id, server_config),
+                        timeout=settings.REPORT_POSTER_TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    return None
+
+        poster_ids = list(dict.fromkeys(item["poster_id"] for item in items if item.get("poster_id")))
+        posters = dict(zip(poster_ids, await asyncio.gather(*[_fetch(pid) for pid in poster_ids])))
+        for item in items:
+            item["poster"] = posters.get(item.get("poster_id"))
+
     def _create_gradient_background(self, width: int, height: int) -> Image.Image:
-        """创建渐变背景 - 简化测试版本"""
+        """创建渐变背景 - 简化测试版本（按尺寸缓存，每次渲染复制一份）"""
         # 先用纯色测试，确保文字能显示
-        img = Image.new("RGB", (width, height), self.bg_gradient_start)
-        return img
+        return _solid_background(width, height, self.bg_gradient_start).copy()
 
     def _draw_rounded_rect(self, draw: ImageDraw.ImageDraw, xy: tuple, radius: int, fill: tuple):
         """绘制圆角矩形"""
@@ -134,21 +170,20 @@ class ReportService:
             poster = Image.open(io.BytesIO(poster_data))
             poster = poster.resize((width, height), Image.Resampling.LANCZOS)
 
-            # 创建阴影（根据缩放调整）
+            # 阴影（根据缩放调整，按尺寸缓存）
             shadow_offset = int(10 * scale)
             shadow_blur = int(5 * scale)
-            shadow = Image.new("RGBA", (width + shadow_offset, height + shadow_offset), (0, 0, 0, 0))
-            shadow_draw = ImageDraw.Draw(shadow)
-            shadow_draw.rounded_rectangle((shadow_offset // 2, shadow_offset // 2, width + shadow_offset // 2, height + shadow_offset // 2), radius=int(8 * scale), fill=(0, 0, 0, 100))
-            shadow = shadow.filter(ImageFilter.GaussianBlur(radius=shadow_blur))
+            shadow = blurred_shadow(
+                (width + shadow_offset, height + shadow_offset),
+                (shadow_offset // 2, shadow_offset // 2, width + shadow_offset // 2, height + shadow_offset // 2),
+                int(8 * scale), 100, shadow_blur
+            )
 
             # 合成阴影
             img.paste(shadow, (x - int(3 * scale), y - int(1 * scale)), shadow)
 
-            # 创建圆角遮罩
-            mask = Image.new("L", (width, height), 0)
-            mask_draw = ImageDraw.Draw(mask)
-            mask_draw.rounded_rectangle((0, 0, width, height), radius=int(6 * scale), fill=255)
+            # 圆角遮罩
+            mask = rounded_mask(width, height, int(6 * scale))
 
             # 粘贴海报
             img.paste(poster, (x, y), mask)
@@ -178,60 +213,41 @@ class ReportService:
             if user_ids:
                 placeholders = ",".join(["?" for _ in user_ids])
                 user_filter = f"AND UserId IN ({placeholders})"
-                params_base = user_ids
+                params_base = list(user_ids)
 
             date_filter = ""
             if start_date:
                 date_filter = f"AND {date_col} >= date(?)"
                 params_base.append(start_date)
 
-            # 总时长
-            query = f"""
-                SELECT COALESCE(SUM(PlayDuration), 0)
-                FROM PlaybackActivity
-                WHERE 1=1 {user_filter} {date_filter} {duration_filter}
-            """
-            async with db.execute(query, params_base) as cursor:
-                row = await cursor.fetchone()
-                total_duration = row[0] or 0
-
-            # 播放次数
+            # 一次扫描按类型分组：时长、播放次数、去重内容数量（同一个 ItemId 只算一次）
             count_expr = get_count_expr()
             query = f"""
-                SELECT COALESCE({count_expr}, 0)
-                FROM PlaybackActivity
-                WHERE 1=1 {user_filter} {date_filter} {duration_filter}
-            """
-            async with db.execute(query, params_base) as cursor:
-                row = await cursor.fetchone()
-                play_count = int(row[0] or 0)
-
-            # 电影/剧集分类统计（时长）
-            query = f"""
-                SELECT ItemType, COALESCE(SUM(PlayDuration), 0)
+                SELECT ItemType,
+                       COALESCE(SUM(PlayDuration), 0),
+                       COALESCE({count_expr}, 0),
+                       COUNT(DISTINCT ItemId)
                 FROM PlaybackActivity
                 WHERE 1=1 {user_filter} {date_filter} {duration_filter}
                 GROUP BY ItemType
             """
-            type_stats = {"Movie": {"duration": 0, "count": 0}, "Episode": {"duration": 0, "count": 0}}
             async with db.execute(query, params_base) as cursor:
-                async for row in cursor:
-                    item_type, duration = row
-                    if item_type in type_stats:
-                        type_stats[item_type]["duration"] = duration or 0
-
-            # 电影/剧集分类统计（去重内容数量 - 同一个 ItemId 只算一次）
-            query = f"""
-                SELECT ItemType, COUNT(DISTINCT ItemId)
-                FROM PlaybackActivity
-                WHERE 1=1 {user_filter} {date_filter} {duration_filter}
-                GROUP BY ItemType
-            """
-            async with db.execute(query, params_base) as cursor:
-                async for row in cursor:
-                    item_type, count = row
-                    if item_type in type_stats:
-                        type_stats[item_type]["count"] = int(count or 0)
+                rows = await cursor.fetchall()
+
+        return self._build_stats(rows)
+
+    def _build_stats(self, rows) -> dict:
+        """由按类型分组的 (ItemType, 时长, 播放次数, 内容数) 行汇总统计数据"""
+        total_duration = 0
+        play_count = 0
+        type_stats = {"Movie": {"duration": 0, "count": 0}, "Episode": {"duration": 0, "count": 0}}
+        for item_type, duration, plays, items in rows:
+            # 总计为各类型之和
+            total_duration += duration or 0
+            play_count += int(plays or 0)
+            if item_type in type_stats:
+                type_stats[item_type]["duration"] = duration or 0
+                type_stats[item_type]["count"] = int(items or 0)
 
         return {
             "total_duration": total_duration,
@@ -270,62 +286,268 @@ class ReportService:
                 GROUP BY ItemId, ItemName, ItemType
             """
 
-            content_map = defaultdict(lambda: {"play_count": 0, "duration": 0, "item_id": None, "item_type": None})
-
             async with db.execute(query, params) as cursor:
-                async for row in cursor:
-                    item_id, item_name, item_type, play_count, duration = row
-                    item_name = item_name or "Unknown"
-
-                    # 剧集按剧名聚合
-                    if item_type == "Episode" and " - " in item_name:
-                        key = item_name.split(" - ")[0]
-                    else:
-                        key = item_name
-
-                    content_map[key]["play_count"] += int(play_count or 0)
-                    content_map[key]["duration"] += duration or 0
-                    if not content_map[key]["item_id"]:
-                        content_map[key]["item_id"] = item_id
-                        content_map[key]["item_type"] = item_type
-
-            # 按播放次数排序
-            sorted_content = sorted(content_map.items(), key=lambda x: x[1]["play_count"], reverse=True)[:limit]
-
-            results = []
-            for name, data in sorted_content:
-                poster_id = data["item_id"]
-                if data["item_type"] == "Episode":
+                rows = await cursor.fetchall()
+
+        return await self._build_top_content(rows, limit, server_config)
+
+    async def _build_top_content(self, rows, limit: int, server_config: dict = None, series_ids: dict = None) -> list[dict]:
+        """由按内容分组的 (ItemId, ItemName, ItemType, 播放次数, 时长) 行生成热门内容排行
+
+        Args:
+            series_ids: 剧集ID -> 剧ID 的查询结果缓存（批量生成时在多个用户之间共用）
+        """
+        content_map = defaultdict(lambda: {"play_count": 0, "duration": 0, "item_id": None, "item_type": None})
+
+        for item_id, item_name, item_type, play_count, duration in rows:
+            item_name = item_name or "Unknown"
+
+            # 剧集按剧名聚合
+            if item_type == "Episode" and " - " in item_name:
+                key = item_name.split(" - ")[0]
+            else:
+                key = item_name
+
+            content_map[key]["play_count"] += int(play_count or 0)
+            content_map[key]["duration"] += duration or 0
+            if not content_map[key]["item_id"]:
+                content_map[key]["item_id"] = item_id
+                content_map[key]["item_type"] = item_type
+
+        # 按播放次数排序
+        sorted_content = sorted(content_map.items(), key=lambda x: x[1]["play_count"], reverse=True)[:limit]
+
+        if series_ids is None:
+            series_ids = {}
+
+        results = []
+        for name, data in sorted_content:
+            poster_id = data["item_id"]
+            if data["item_type"] == "Episode":
+                if data["item_id"] not in series_ids:
                     item_info = await emby_service.get_item_info(data["item_id"], server_config)
-                    if item_info.get("SeriesId"):
-                        poster_id = item_info["SeriesId"]
+                    series_ids[data["item_id"]] = item_info.get("SeriesId")
+                if series_ids[data["item_id"]]:
+                    poster_id = series_ids[data["item_id"]]
 
-                results.append({
-                    "name": name,
-                    "play_count": data["play_count"],
-                    "duration": data["duration"],
-                    "item_type": data["item_type"],
-                    "poster_id": poster_id
-                })
+            results.append({
+                "name": name,
+                "play_count": data["play_count"],
+                "duration": data["duration"],
+                "item_type": data["item_type"],
+                "poster_id": poster_id
+            })
 
-            return results
+        return results
 
-    async def generate_report_image(
+    async def get_report_data_batch(
+        self,
+        user_ids: list[str],
+        start_date: str = None,
+        limit: int = 5,
+        server_config: dict = None
+    ) -> dict[str, dict]:
+        """批量获取多个用户各自的统计数据和热门内容
+
+        按 UserId 分组一次扫描得到所有用户的结果（用户较多时按 BATCH_USER_CHUNK 分段），
+        代替逐个用户调用 get_stats / get_top_content
+
+        Returns:
+            {user_id: {"stats": {...}, "top_content": [...]}}，没有播放记录的用户也会返回空结果
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        duration_filter = get_duration_filter()
+        count_expr = get_count_expr()
+        date_col = local_date("DateCreated")
+
+        stats_rows = defaultdict(list)
+        content_rows = defaultdict(list)
+        async with get_playback_db(server_config) as db:
+            for i in range(0, len(user_ids), BATCH_USER_CHUNK):
+                chunk = user_ids[i:i + BATCH_USER_CHUNK]
+                placeholders = ",".join(["?" for _ in chunk])
+                params = list(chunk)
+                date_filter = ""
+                if start_date:
+                    date_filter = f"AND {date_col} >= date(?)"
+                    params.append(start_date)
+
+                # 按 (用户, 内容) 分组一次扫描，按类型的统计数据由内容行在内存中汇总
+                query = f"""
+                    SELECT UserId, ItemId, ItemName, ItemType,
+                           {count_expr} as play_count,
+                           COALESCE(SUM(PlayDuration), 0) as total_duration
+                    FROM PlaybackActivity
+                    WHERE UserId IN ({placeholders}) {date_filter} {duration_filter}
+                    GROUP BY UserId, ItemId, ItemName, ItemType
+                """
+                async with db.execute(query, params) as cursor:
+                    async for user_id, item_id, item_name, item_type, play_count, duration in cursor:
+                        content_rows[user_id].append((item_id, item_name, item_type, play_count, duration))
+
+        for user_id, rows in content_rows.items():
+            # 与 get_stats 一致：时长和播放次数按类型求和，内容数按去重 ItemId 计
+            by_type = {}
+            for item_id, _, item_type, play_count, duration in rows:
+                entry = by_type.setdefault(item_type, [0, 0, set()])
+                entry[0] += duration or 0
+                entry[1] += int(play_count or 0)
+                entry[2].add(item_id)
+            stats_rows[user_id] = [
+                (item_type, duration, plays, len(items))
+                for item_type, (duration, plays, items) in by_type.items()
+            ]
+
+        series_ids = {}
+        results = {}
+        for user_id in user_ids:
+            results[user_id] = {
+                "stats": self._build_stats(stats_rows.get(user_id, [])),
+                "top_content": await self._build_top_content(
+                    content_rows.get(user_id, []), limit, server_config, series_ids
+                ),
+            }
+        return results
+
+    async def build_report_spec(
         self,
         user_ids: list[str] = None,
         period: ReportPeriod = "weekly",
         content_count: int = 5,
         server_config: dict = None,
         scale: float = 2.0
+    ) -> dict:
+        """收集报告数据（统计、热门内容、海报），生成可序列化的渲染参数
+
+        只包含普通的字典/字符串/数字/字节数据，可以直接传给渲染进程
+        """
+        title, start_date, subtitle = self._get_period_info(period)
+        stats = await self.get_stats(user_ids, start_date, server_config)
+        top_content = await self.get_top_content(user_ids, start_date, content_count, server_config)
+
+        await self._prefetch_posters(top_content, server_config)
+
+        return {
+            "title": title,
+            "subtitle": subtitle,
+            "stats": stats,
+            "top_content": top_content,
+            "scale": scale,
+        }
+
+    async def generate_report_image(
+        self,
+        user_ids: list[str] = None,
+        period: ReportPeriod = "weekly",
+        content_count: int = 5,
+        server_config: dict = None,
+        scale: float = 2.0,
+        use_cache: bool = True
     ) -> bytes:
         """生成观影报告图片（现代化重设计版本）
 
+        数据在事件循环中收集，绘图在渲染进程池中执行；
+        相同参数且播放数据未变化时直接返回缓存的图片，并发的相同请求只渲染一次
+
         Args:
             scale: 缩放因子，默认2.0表示2倍分辨率（960px宽）
+            use_cache: 是否使用报告缓存
+        """
+        async def _render() -> bytes:
+            spec = await self.build_report_spec(user_ids, period, content_count, server_config, scale)
+            return await report_renderer.render(render_report_spec, spec)
+
+        if not use_cache:
+            return await _render()
+        cache_key = await self.get_cache_key(user_ids, period, content_count, server_config, scale)
+        return await report_cache.get_or_render(cache_key, _render)
+
+    async def get_cache_key(
+        self,
+        user_ids: list[str] = None,
+        period: ReportPeriod = "weekly",
+        content_count: int = 5,
+        server_config: dict = None,
+        scale: float = 2.0
+    ) -> tuple:
+        """获取报告缓存键（包含当前播放数据版本）"""
+        _, start_date, _ = self._get_period_info(period)
+        data_version = await get_playback_data_version(server_config)
+        return make_report_key(server_config, user_ids, period, start_date, content_count, "full", scale, data_version)
+
+    async def generate_report_images_batch(
+        self,
+        user_ids: list[str],
+        period: ReportPeriod = "weekly",
+        content_count: int = 5,
+        server_config: dict = None,
+        scale: float = 2.0,
+        use_cache: bool = True
+    ) -> dict[str, bytes]:
+        """批量生成多个用户的个人报告图片
+
+        未命中缓存的用户通过一次分组扫描获取数据，然后并发提交到渲染进程池
+        （同时渲染数不超过渲染进程数）。单个用户渲染失败不影响其他用户
+
+        Returns:
+            {user_id: 图片字节}，渲染失败的用户不在结果中
         """
+        user_ids = list(dict.fromkeys(user_ids))
         title, start_date, subtitle = self._get_period_info(period)
-        stats = await self.get_stats(user_ids, start_date, server_config)
-        top_content = await self.get_top_content(user_ids, start_date, content_count, server_config)
+
+        images = {}
+        cache_keys = {}
+        if use_cache:
+            data_version = await get_playback_data_version(server_config)
+            for user_id in user_ids:
+                key = make_report_key(server_config, [user_id], period, start_date, content_count, "full", scale, data_version)
+                cached = report_cache.get(key)
+                if cached:
+                    images[user_id] = cached
+                else:
+                    cache_keys[user_id] = key
+
+        pending = [uid for uid in user_ids if uid not in images]
+        if not pending:
+            return images
+
+        data = await self.get_report_data_batch(pending, start_date, content_count, server_config)
+        await self._prefetch_posters(
+            [item for uid in pending for item in data[uid]["top_content"]], server_config
+        )
+
+        # 批量渲染同时占用的渲染名额不超过工作进程数，排队名额留给网页预览和 Bot 的即时请求，
+        # 批量中的其余用户在此等待，不会因渲染队列等待超时而失败
+        batch_slots = asyncio.Semaphore(max(report_renderer.workers, 1))
+
+        async def _render(user_id: str):
+            spec = {
+                "title": title,
+                "subtitle": subtitle,
+                "stats": data[user_id]["stats"],
+                "top_content": data[user_id]["top_content"],
+                "scale": scale,
+            }
+            async with batch_slots:
+                return await report_renderer.render(render_report_spec, spec)
+
+        rendered = await asyncio.gather(*[_render(uid) for uid in pending], return_exceptions=True)
+        for user_id, result in zip(pending, rendered):
+            if isinstance(result, BaseException):
+                logger.error(f"Failed to render report for user {user_id}: {result}")
+                continue
+            images[user_id] = result
+            if user_id in cache_keys:
+                report_cache.put(cache_keys[user_id], result)
+        return images
+
+    def render_report(self, spec: dict) -> bytes:
+        """根据渲染参数绘制报告图片（同步，CPU 密集，在渲染进程中执行）"""
+        title = spec["title"]
+        subtitle = spec["subtitle"]
+        stats = spec["stats"]
+        top_content = spec["top_content"]
+        scale = spec["scale"]
 
         # 基础尺寸
         base_width = 540
@@ -461,23 +683,23 @@ class ReportService:
                 badge_y = item_y + int(20 * scale)
                 badge_size = int(36 * scale)
 
-                # 徽章背景
-                draw.ellipse((badge_x, badge_y, badge_x + badge_size, badge_y + badge_size), fill=rank_color)
-
-                # 排名数字
+                # 徽章背景和排名数字（预渲染并缓存）
                 rank_text = str(rank)
                 bbox = draw.textbbox((0, 0), rank_text, font=font_rank)
                 text_w, text_h = bbox[2] - bbox[0], bbox[3] - bbox[1]
-                draw.text((badge_x + badge_size // 2 - text_w // 2,
-                          badge_y + badge_size // 2 - text_h // 2 - int(2 * scale)),
-                         rank_text, font=font_rank, fill=(255, 255, 255))
+                badge = rank_badge(
+                    badge_size, rank_color, rank_text, font_rank,
+                    (badge_size // 2 - text_w // 2, badge_size // 2 - text_h // 2 - int(2 * scale))
+                )
+                img.paste(badge, (badge_x, badge_y), badge)
+                draw = ImageDraw.Draw(img)
 
                 # 海报
                 poster_x = badge_x + badge_size + int(16 * scale)
                 poster_y = item_y + int(15 * scale)
                 poster_w, poster_h = int(65 * scale), int(90 * scale)
 
-                poster_data = await self._get_poster_bytes(item["poster_id"], server_config)
+                poster_data = item.get("poster")
                 if poster_data:
                     self._draw_poster_with_shadow(img, poster_data, poster_x, poster_y, poster_w, poster_h, scale)
                     # paste操作后必须重新创建draw对象
@@ -563,4 +785,15 @@ class ReportService:
         return list(user_map.items())
 
 
+@lru_cache(maxsize=16)
+def _solid_background(width: int, height: int, color: tuple) -> Image.Image:
+    """纯色背景（缓存，使用时需复制）"""
+    return Image.new("RGB", (width, height), color)
+
+
 report_service = ReportService()
+
+
+def render_report_spec(spec: dict) -> bytes:
+    """渲染进程入口（模块级函数，便于进程池序列化调用）"""
+    return report_service.render_report(spec)
@@ -0,0 +1,76 @@
+"""
+报告渲染资源缓存模块
+字体、阴影、遮罩、排名徽章等可复用的绘图资源按参数在进程内缓存，
+重复渲染时不再重新探测字体路径、加载字体文件或重新计算模糊阴影
+
+缓存返回的图片对象是共享的，只能作为 paste 的来源使用，不要直接在上面绘制
+"""
+from functools import lru_cache
+from typing import Optional
+from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from logger import get_logger
+
+logger = get_logger("services.report_assets")
+
+
+@lru_cache(maxsize=None)
+def resolve_font_path(candidates: tuple) -> Optional[str]:
+    """按优先级探测第一个可用的字体文件（每组候选路径只探测一次）"""
+    for path in candidates:
+        try:
+            ImageFont.truetype(path, 12)
+            return path
+        except (OSError, IOError):
+            # 字体文件不存在或无法读取，尝试下一个
+            continue
+    logger.warning("No TrueType font found, falling back to default bitmap font")
+    return None
+
+
+@lru_cache(maxsize=128)
+def load_font(path: Optional[str], size: int) -> ImageFont.ImageFont:
+    """加载指定路径和字号的字体（按 (路径, 字号) 缓存）"""
+    if path is None:
+        return ImageFont.load_default()
+    return ImageFont.truetype(path, size)
+
+
+def get_font(candidates: tuple, size: int) -> ImageFont.ImageFont:
+    """获取字体；字重由候选路径决定（粗体候选解析到粗体文件），缓存键为 (路径, 字号)"""
+    return load_font(resolve_font_path(candidates), size)
+
+
+@lru_cache(maxsize=64)
+def blurred_shadow(canvas_size: tuple, rect: tuple, radius: int, alpha: int, blur: int) -> Image.Image:
+    """生成圆角矩形的模糊阴影（RGBA）"""
+    shadow = Image.new("RGBA", canvas_size, (0, 0, 0, 0))
+    shadow_draw = ImageDraw.Draw(shadow)
+    shadow_draw.rounded_rectangle(rect, radius=radius, fill=(0, 0, 0, alpha))
+    return shadow.filter(ImageFilter.GaussianBlur(radius=blur))
+
+
+@lru_cache(maxsize=64)
+def rounded_mask(width: int, height: int, radius: int) -> Image.Image:
+    """生成圆角遮罩（L 模式）"""
+    mask = Image.new("L", (width, height), 0)
+    mask_draw = ImageDraw.Draw(mask)
+    mask_draw.rounded_rectangle((0, 0, width, height), radius=radius, fill=255)
+    return mask
+
+
+@lru_cache(maxsize=64)
+def rank_badge(
+    size: int,
+    color: tuple,
+    text: str,
+    font: ImageFont.ImageFont,
+    text_xy: tuple,
+    anchor: Optional[str] = None,
+) -> Image.Image:
+    """生成圆形排名徽章（RGBA，透明背景），以自身作为遮罩粘贴"""
+    # ellipse 的右下角坐标是包含的，画布需要多一个像素
+    badge = Image.new("RGBA", (size + 1, size + 1), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(badge)
+    draw.ellipse((0, 0, size, size), fill=color)
+    draw.text(text_xy, text, font=font, fill=(255, 255, 255), anchor=anchor)
+    return badge
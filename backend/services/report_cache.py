@@ -0,0 +1,113 @@
+"""
+报告图片缓存模块
+缓存已渲染的报告 PNG，预览、定时任务和 Telegram Bot 共用；
+缓存键包含播放数据版本，数据变化后自动失效；
+相同报告的并发请求合并为一次渲染
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Optional, Iterable, Callable, Awaitable
+from config import settings
+from logger import get_logger
+
+logger = get_logger("services.report_cache")
+
+
+def make_report_key(
+    server_config: Optional[dict],
+    user_ids: Optional[Iterable[str]],
+    period: str,
+    start_date: str,
+    content_count: int,
+    renderer: str,
+    scale: float,
+    data_version: tuple,
+) -> tuple:
+    """生成报告缓存键
+
+    start_date 随时间段滚动（新的一天/周/月），保证跨周期不会命中旧报告
+    """
+    server_id = server_config.get('id', 'default') if server_config else 'default'
+    users = tuple(sorted(user_ids)) if user_ids else None
+    return (server_id, users, period, start_date, content_count, renderer, scale, data_version)
+
+
+class ReportCache:
+    """按字节数限制大小的 LRU 报告图片缓存"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._size = 0
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "coalesced": 0}
+
+    def get(self, key: tuple) -> Optional[bytes]:
+        """读取缓存（命中时移到最近使用）"""
+        data = self._items.get(key)
+        if data is None:
+            self._stats["misses"] += 1
+            return None
+        self._items.move_to_end(key)
+        self._stats["hits"] += 1
+        return data
+
+    def put(self, key: tuple, data: bytes):
+        """写入缓存，超出字节预算时淘汰最久未使用的报告"""
+        if not data or len(data) > self.max_bytes:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._items[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes and self._items:
+            _, evicted = self._items.popitem(last=False)
+            self._size -= len(evicted)
+            self._stats["evictions"] += 1
+
+    async def get_or_render(self, key: tuple, render: Callable[[], Awaitable[bytes]]) -> bytes:
+        """读取缓存；未命中时渲染并写入缓存
+
+        同一个键已有渲染在进行时，等待该渲染的结果而不是重复渲染。
+        渲染在独立任务中执行，某个等待方取消不会影响其他等待方
+        """
+        cached = self.get(key)
+        if cached:
+            return cached
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(render())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_render_done(key, t))
+        else:
+            self._stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def _on_render_done(self, key: tuple, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled():
+            return
+        if task.exception() is None:
+            self.put(key, task.result())
+
+    def invalidate_server(self, server_id: str):
+        """清除指定服务器的所有报告"""
+        for key in [k for k in self._items if k[0] == server_id]:
+            self._size -= len(self._items.pop(key))
+
+    def get_stats(self) -> dict:
+        """获取缓存统计（调试用）"""
+        return {
+            **self._stats,
+            "items": len(self._items),
+            "inflight": len(self._inflight),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+# 单例实例
+report_cache = ReportCache(settings.REPORT_CACHE_MAX_BYTES)
@@ -0,0 +1,130 @@
+"""
+报告渲染进程池模块
+报告图片的 Pillow 绘制（文字排版、阴影模糊、缩放、PNG 编码）是 CPU 密集操作，
+放到独立进程中执行，避免阻塞事件循环上的其他 API 请求
+"""
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Callable
+from config import settings
+from logger import get_logger
+
+logger = get_logger("services.report_renderer")
+
+
+def _init_worker():
+    """渲染进程初始化：预先解析字体路径并加载常用字号，首个渲染无需再探测字体"""
+    try:
+        from services.report import report_service
+        from services.report_simple import report_service_simple
+        report_service.warm_up()
+        report_service_simple.warm_up()
+    except Exception as e:
+        logger.warning(f"Report render worker warm-up failed: {e}")
+
+
+class RenderQueueFullError(RuntimeError):
+    """渲染队列已满"""
+
+
+class ReportRenderer:
+    """报告渲染进程池
+
+    - 渲染函数必须是模块级函数，参数为可序列化的渲染参数（dict）
+    - 同时排队/执行的渲染数量有上限，超出时等待，等待超时则报错
+    - 单次渲染超时会重建进程池，避免卡死的工作进程一直占用名额
+    - REPORT_RENDER_WORKERS=0 时退化为线程中执行（不支持多进程的环境）
+    """
+
+    def __init__(self):
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def workers(self) -> int:
+        return max(settings.REPORT_RENDER_WORKERS, 0)
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        """渲染名额（执行中 + 排队中）"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(max(self.workers, 1) + max(settings.REPORT_RENDER_QUEUE_SIZE, 0))
+        return self._slots
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """获取进程池（首次使用时创建，使用 spawn 避免继承事件循环和连接等状态）"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+            logger.info(f"Report render pool started with {self.workers} workers")
+        return self._executor
+
+    def _reset_executor(self):
+        """丢弃当前进程池并结束其工作进程（下次渲染时重新创建）"""
+        executor = self._executor
+        self._executor = None
+        if executor is None:
+            return
+        # ProcessPoolExecutor 无法取消正在执行的任务，直接结束工作进程
+        processes = list(getattr(executor, "_processes", {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            try:
+                process.terminate()
+            except Exception:
+                pass
+
+    async def render(self, func: Callable[[dict], bytes], spec: dict) -> bytes:
+        """在渲染进程中执行 func(spec)，返回图片字节
+
+        Raises:
+            RenderQueueFullError: 等待渲染名额超时
+            asyncio.TimeoutError: 渲染超时
+        """
+        timeout = settings.REPORT_RENDER_TIMEOUT
+        slots = self._get_slots()
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise RenderQueueFullError("报告渲染队列已满，请稍后重试")
+
+        try:
+            if self.workers == 0:
+                return await asyncio.wait_for(asyncio.to_thread(func, spec), timeout=timeout)
+
+            loop = asyncio.get_running_loop()
+            for attempt in range(2):
+                executor = self._get_executor()
+                try:
+                    return await asyncio.wait_for(
+                        loop.run_in_executor(executor, func, spec), timeout=timeout
+                    )
+                except asyncio.TimeoutError:
+                    logger.error(f"Report render timed out after {timeout}s, restarting render pool")
+                    if self._executor is executor:
+                        self._reset_executor()
+                    raise
+                except BrokenProcessPool:
+                    # 工作进程异常退出（或进程池因超时被重建），重建后重试一次
+                    logger.warning("Report render pool broken, restarting")
+                    if self._executor is executor:
+                        self._reset_executor()
+                    if attempt:
+                        raise
+        finally:
+            slots.release()
+
+    def shutdown(self):
+        """关闭进程池（应用关闭时调用）"""
+        executor = self._executor
+        self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 单例实例
+report_renderer = ReportRenderer()
@@ -1,19 +1,30 @@
 """
 简化版报告生成服务 - 确保可靠工作
 """
+import asyncio
 import io
+from functools import lru_cache
 from datetime import datetime, timedelta
 from collections import defaultdict
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 from typing import Optional, Literal
 
-from database import get_playback_db, get_count_expr, get_duration_filter, local_date
+from config import settings
+from database import get_playback_db, get_playback_data_version, get_count_expr, get_duration_filter, local_date
 from services.users import user_service
 from services.emby import emby_service
+from services.report_renderer import report_renderer
+from services.report_cache import report_cache, make_report_key
+from services.report_assets import get_font, blurred_shadow, rounded_mask, rank_badge
 
 
 ReportPeriod = Literal["daily", "weekly", "monthly", "yearly"]
 
+FONT_PATHS = (
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
+)
+
 
 class ReportServiceSimple:
     """简化报告服务"""
@@ -29,17 +40,13 @@ class ReportServiceSimple:
         self.bronze_color = (251, 146, 60)       # 铜色（第三名）
 
     def _get_font(self, size: int):
-        """获取字体"""
-        paths = [
-            "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
-            "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
-        ]
-        for path in paths:
-            try:
-                return ImageFont.truetype(path, size)
-            except:
-                continue
-        return ImageFont.load_default()
+        """获取字体（进程级缓存，字体路径只探测一次）"""
+        return get_font(FONT_PATHS, size)
+
+    def warm_up(self, scale: float = 1.5):
+        """预先解析字体路径并加载常用字号（渲染进程启动时调用）"""
+        for size in (40, 26, 22, 18):
+            self._get_font(int(size * scale))
 
     def _format_duration(self, seconds: int) -> str:
         """格式化时长"""
@@ -78,24 +85,8 @@ class ReportServiceSimple:
         return self.accent_color
 
     def _create_gradient_bg(self, width: int, height: int) -> Image.Image:
-        """创建渐变背景"""
-        img = Image.new("RGB", (width, height))
-        draw = ImageDraw.Draw(img)
-
-        # 垂直渐变
-        r1, g1, b1 = self.bg_gradient_start
-        r2, g2, b2 = self.bg_gradient_end
-
-        for y in range(height):
-            # 计算当前行的颜色
-            ratio = y / height
-            r = int(r1 + (r2 - r1) * ratio)
-            g = int(g1 + (g2 - g1) * ratio)
-            b = int(b1 + (b2 - b1) * ratio)
-
-            draw.line([(0, y), (width, y)], fill=(r, g, b))
-
-        return img
+        """创建渐变背景（按尺寸和颜色缓存，每次渲染复制一份）"""
+        return _gradient_background(width, height, self.bg_gradient_start, self.bg_gradient_end).copy()
 
     def _draw_poster_with_shadow(self, img: Image.Image, poster_data: bytes, x: int, y: int, width: int, height: int, scale: float = 1.0):
         """绘制带圆角和阴影的海报"""
@@ -103,80 +94,53 @@ class ReportServiceSimple:
             poster = Image.open(io.BytesIO(poster_data))
             poster = poster.resize((width, height), Image.Resampling.LANCZOS)
 
-            # 创建圆角遮罩
-            mask = Image.new("L", (width, height), 0)
-            mask_draw = ImageDraw.Draw(mask)
-            mask_draw.rounded_rectangle((0, 0, width, height), radius=int(8 * scale), fill=255)
+            # 圆角遮罩（缓存）
+            mask = rounded_mask(width, height, int(8 * scale))
 
-            # 创建轻微的阴影
+            # 轻微的阴影（按尺寸缓存）
             shadow_offset = int(4 * scale)   # 减小偏移
             shadow_blur = int(8 * scale)     # 减小模糊
-            shadow = Image.new("RGBA", (width + shadow_offset * 2, height + shadow_offset * 2), (0, 0, 0, 0))
-            shadow_draw = ImageDraw.Draw(shadow)
-            shadow_draw.rounded_rectangle(
+            shadow = blurred_shadow(
+                (width + shadow_offset * 2, height + shadow_offset * 2),
                 (shadow_offset, shadow_offset, width + shadow_offset, height + shadow_offset),
-                radius=int(8 * scale),
-                fill=(0, 0, 0, 80)  # 降低透明度
+                int(8 * scale),
+                80,  # 降低透明度
+                shadow_blur
             )
 
-            # 应用模糊
-            from PIL import ImageFilter
-            shadow = shadow.filter(ImageFilter.GaussianBlur(radius=shadow_blur))
-
-            # 转换主图为RGBA以支持透明度合成
-            if img.mode != "RGBA":
-                img_rgba = img.convert("RGBA")
-            else:
-                img_rgba = img
-
-            # 粘贴阴影
-            img_rgba.paste(shadow, (x - shadow_offset, y - shadow_offset), shadow)
+            # 以阴影自身的透明度为遮罩直接合成，无需整图转换为 RGBA
+            img.paste(shadow, (x - shadow_offset, y - shadow_offset), shadow)
 
             # 粘贴海报
-            if poster.mode != "RGBA":
-                poster = poster.convert("RGBA")
-            img_rgba.paste(poster, (x, y), mask)
-
-            # 转回RGB
-            if img.mode == "RGB":
-                return img_rgba.convert("RGB")
-            return img_rgba
+            if poster.mode != "RGB":
+                poster = poster.convert("RGB")
+            img.paste(poster, (x, y), mask)
+            return img
 
         except Exception as e:
             return img
 
     def _draw_card_with_shadow(self, draw: ImageDraw.ImageDraw, img: Image.Image, x: int, y: int, width: int, height: int, radius: int, fill: tuple, scale: float = 1.0):
         """绘制带阴影的卡片"""
-        # 创建阴影
+        # 阴影（按尺寸缓存）
         shadow_offset = int(4 * scale)
         shadow_blur = int(12 * scale)
-        shadow = Image.new("RGBA", (width + shadow_offset * 2, height + shadow_offset * 2), (0, 0, 0, 0))
-        shadow_draw = ImageDraw.Draw(shadow)
-        shadow_draw.rounded_rectangle(
+        shadow = blurred_shadow(
+            (width + shadow_offset * 2, height + shadow_offset * 2),
             (shadow_offset, shadow_offset, width + shadow_offset, height + shadow_offset),
-            radius=radius,
-            fill=(0, 0, 0, 100)
+            radius,
+            100,
+            shadow_blur
         )
 
-        # 应用模糊
-        from PIL import ImageFilter
-        shadow = shadow.filter(ImageFilter.GaussianBlur(radius=shadow_blur))
-
-        # 转换为RGBA
-        if img.mode != "RGBA":
-            img_rgba = img.convert("RGBA")
-        else:
-            img_rgba = img
-
-        # 粘贴阴影
-        img_rgba.paste(shadow, (x - shadow_offset, y - shadow_offset), shadow)
+        # 以阴影自身的透明度为遮罩直接合成，无需整图转换为 RGBA
+        img.paste(shadow, (x - shadow_offset, y - shadow_offset), shadow)
 
-        # 转回RGB并绘制卡片
-        img_rgb = img_rgba.convert("RGB")
-        draw_new = ImageDraw.Draw(img_rgb)
+        # 绘制卡片
+        draw_new = ImageDraw.Draw(img)
         draw_new.rounded_rectangle((x, y, x + width, y + height), radius=radius, fill=fill)
 
-        return img_rgb
+        return img
 
     async def _get_poster_bytes(self, item_id: str, item_type: str, server_config: dict = None) -> Optional[bytes]:
         """获取海报图片"""
@@ -186,6 +150,21 @@ class ReportServiceSimple:
         except:
             return None
 
+    async def _prefetch_posters(self, items, server_config=None):
+        """并发获取所有热门内容的海报（单张超时使用占位图），写入 item["poster"]"""
+        async def _fetch(item):
+            try:
+                return await asyncio.wait_for(
+                    self._get_poster_bytes(item["poster_id"], item["item_type"], server_config),
+                    timeout=settings.REPORT_POSTER_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                return None
+
+        posters = await asyncio.gather(*[_fetch(item) for item in items])
+        for item, poster in zip(items, posters):
+            item["poster"] = poster
+
     async def get_stats(self, user_ids=None, start_date=None, server_config=None):
         """获取统计数据"""
         async with get_playback_db(server_config) as db:
@@ -197,31 +176,25 @@ class ReportServiceSimple:
             if user_ids:
                 placeholders = ",".join(["?" for _ in user_ids])
                 user_filter = f"AND UserId IN ({placeholders})"
-                params = user_ids
+                params = list(user_ids)
 
             date_filter = ""
             if start_date:
                 date_filter = f"AND {date_col} >= date(?)"
                 params.append(start_date)
 
-            # 总时长
-            query = f"SELECT COALESCE(SUM(PlayDuration), 0) FROM PlaybackActivity WHERE 1=1 {user_filter} {date_filter} {duration_filter}"
-            async with db.execute(query, params) as cursor:
-                row = await cursor.fetchone()
-                total_duration = row[0] or 0
-
-            # 播放次数
+            # 一次扫描得到总时长、播放次数和内容数量
             count_expr = get_count_expr()
-            query = f"SELECT COALESCE({count_expr}, 0) FROM PlaybackActivity WHERE 1=1 {user_filter} {date_filter} {duration_filter}"
-            async with db.execute(query, params) as cursor:
-                row = await cursor.fetchone()
-                play_count = int(row[0] or 0)
-
-            # 内容数量
-            query = f"SELECT COUNT(DISTINCT ItemId) FROM PlaybackActivity WHERE 1=1 {user_filter} {date_filter} {duration_filter}"
+            query = f"""
+                SELECT COALESCE(SUM(PlayDuration), 0), COALESCE({count_expr}, 0), COUNT(DISTINCT ItemId)
+                FROM PlaybackActivity
+                WHERE 1=1 {user_filter} {date_filter} {duration_filter}
+            """
             async with db.execute(query, params) as cursor:
                 row = await cursor.fetchone()
-                item_count = int(row[0] or 0)
+                total_duration = row[0] or 0
+                play_count = int(row[1] or 0)
+                item_count = int(row[2] or 0)
 
             return {
                 "total_duration": total_duration,
@@ -304,12 +277,41 @@ class ReportServiceSimple:
 
             return results
 
-    async def generate_report_image(self, user_ids=None, period="weekly", content_count=5, server_config=None, scale=1.5):
-        """生成报告图片 - 带海报的美化版本"""
+    async def build_report_spec(self, user_ids=None, period="weekly", content_count=5, server_config=None, scale=1.5):
+        """收集报告数据，生成可序列化的渲染参数"""
         title, start_date = self._get_period_info(period)
         stats = await self.get_stats(user_ids, start_date, server_config)
         top_content = await self.get_top_content(user_ids, start_date, content_count, server_config)
 
+        await self._prefetch_posters(top_content, server_config)
+
+        return {
+            "title": title,
+            "stats": stats,
+            "top_content": top_content,
+            "scale": scale,
+        }
+
+    async def generate_report_image(self, user_ids=None, period="weekly", content_count=5, server_config=None, scale=1.5, use_cache=True):
+        """生成报告图片 - 带海报的美化版本（绘图在渲染进程池中执行，结果缓存）"""
+        async def _render():
+            spec = await self.build_report_spec(user_ids, period, content_count, server_config, scale)
+            return await report_renderer.render(render_simple_report_spec, spec)
+
+        if not use_cache:
+            return await _render()
+        _, start_date = self._get_period_info(period)
+        data_version = await get_playback_data_version(server_config)
+        cache_key = make_report_key(server_config, user_ids, period, start_date, content_count, "simple", scale, data_version)
+        return await report_cache.get_or_render(cache_key, _render)
+
+    def render_report(self, spec: dict) -> bytes:
+        """根据渲染参数绘制报告图片（同步，在渲染进程中执行）"""
+        title = spec["title"]
+        stats = spec["stats"]
+        top_content = spec["top_content"]
+        scale = spec["scale"]
+
         # 尺寸计算
         width = int(600 * scale)
         padding = int(30 * scale)
@@ -402,22 +404,15 @@ class ReportServiceSimple:
                 img = self._draw_card_with_shadow(draw, img, padding, item_y, width - padding * 2, item_h, int(10 * scale), self.card_color, scale)
                 draw = ImageDraw.Draw(img)
 
-                # 排名圆圈
+                # 排名圆圈和数字（预渲染并缓存）
                 rank_x = padding + int(20 * scale)
                 rank_y = item_y + int(20 * scale)
                 rank_size = int(40 * scale)
-                draw.ellipse(
-                    (rank_x, rank_y, rank_x + rank_size, rank_y + rank_size),
-                    fill=rank_color
-                )
-                # 排名数字
-                draw.text(
-                    (rank_x + rank_size // 2, rank_y + rank_size // 2),
-                    str(rank),
-                    font=font_medium,
-                    fill=(255, 255, 255),
-                    anchor="mm"
+                badge = rank_badge(
+                    rank_size, rank_color, str(rank), font_medium,
+                    (rank_size // 2, rank_size // 2), "mm"
                 )
+                img.paste(badge, (rank_x, rank_y), badge)
 
                 # 海报区域
                 poster_x = rank_x + rank_size + int(20 * scale)
@@ -426,7 +421,7 @@ class ReportServiceSimple:
                 poster_h = int(110 * scale)
 
                 # 获取并绘制海报
-                poster_data = await self._get_poster_bytes(item["poster_id"], item["item_type"], server_config)
+                poster_data = item.get("poster")
                 if poster_data:
                     img = self._draw_poster_with_shadow(img, poster_data, poster_x, poster_y, poster_w, poster_h, scale)
                     # 重新创建 draw 对象
@@ -531,4 +526,29 @@ class ReportServiceSimple:
         return list(user_map.items())
 
 
+@lru_cache(maxsize=16)
+def _gradient_background(width: int, height: int, start: tuple, end: tuple) -> Image.Image:
+    """生成垂直渐变背景（缓存，使用时需复制）
+
+    先生成 1 像素宽的渐变列，再一次性拉伸到目标宽度，代替逐行 draw.line
+    """
+    r1, g1, b1 = start
+    r2, g2, b2 = end
+    column = Image.new("RGB", (1, height))
+    column.putdata([
+        (
+            int(r1 + (r2 - r1) * y / height),
+            int(g1 + (g2 - g1) * y / height),
+            int(b1 + (b2 - b1) * y / height),
+        )
+        for y in range(height)
+    ])
+    return column.resize((width, height), Image.Resampling.NEAREST)
+
+
 report_service_simple = ReportServiceSimple()
+
+
+def render_simple_report_spec(spec: dict) -> bytes:
+    """渲染进程入口（模块级函数，便于进程池序列化调用）"""
+    return report_service_simple.render_report(spec)
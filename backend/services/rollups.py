@@ -0,0 +1,356 @@
+"""
+用户每日汇总服务模块
+按 (用户, 本地日期) 和 (用户, 本地日期, 标题) 预先汇总播放次数和时长，
+保存在独立的 rollups.db 中，基于 rowid 高水位增量更新；
+Bot 的 /stats 等轻量查询直接读取汇总表，不扫描播放记录
+"""
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional, Dict
+from config import settings
+from database import get_app_db, get_playback_db, get_count_expr, get_duration_filter, local_date
+from logger import get_logger
+
+logger = get_logger("services.rollups")
+
+# 汇总数据库路径
+ROLLUPS_DB = "/config/rollups.db"
+
+# 每批处理的播放记录 rowid 数量（每批一个事务，批次之间让出事件循环）
+ROLLUP_BATCH_ROWS = 50000
+
+# 计算连续观看天数时最多回看的天数
+MAX_STREAK_DAYS = 400
+
+
+def title_of(item_name: Optional[str], item_type: Optional[str]) -> str:
+    """汇总用标题：剧集按剧名聚合（与报告的热门内容规则一致）"""
+    item_name = item_name or "Unknown"
+    if item_type == "Episode" and " - " in item_name:
+        return item_name.split(" - ")[0]
+    return item_name
+
+
+class RollupService:
+    """用户每日汇总服务类"""
+
+    def __init__(self):
+        self._initialized = False
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _get_db_path(self, server_config: Optional[dict] = None) -> str:
+        """获取播放数据库路径（汇总按播放数据库区分）"""
+        if server_config:
+            return server_config.get('playback_db', settings.PLAYBACK_DB)
+        return settings.PLAYBACK_DB
+
+    async def init_db(self):
+        """初始化汇总数据库（进程内只执行一次）"""
+        if self._initialized:
+            return
+        async with get_app_db(ROLLUPS_DB) as db:
+            async with db.execute("PRAGMA table_info(rollup_state)") as cursor:
+                column_names = [col[1] for col in await cursor.fetchall()]
+            if column_names and not {"row_count", "min_rowid"} <= set(column_names):
+                # 旧版汇总没有记录行数、最小 rowid 和时区，无法检测删除，清空后重建
+                logger.info("检测到旧版汇总表，正在重建...")
+                for table in ("rollup_state", "user_daily", "user_daily_titles"):
+                    await db.execute(f"DROP TABLE IF EXISTS {table}")
+
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS rollup_state (
+                    db_path TEXT PRIMARY KEY,
+                    high_water_mark INTEGER NOT NULL DEFAULT 0,
+                    row_count INTEGER NOT NULL DEFAULT 0,
+                    min_rowid INTEGER NOT NULL DEFAULT 0,
+                    min_play_duration INTEGER NOT NULL DEFAULT 0,
+                    tz_offset INTEGER NOT NULL DEFAULT 0,
+                    updated_at TEXT
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS user_daily (
+                    db_path TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    plays INTEGER NOT NULL DEFAULT 0,
+                    duration INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (db_path, user_id, day)
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS user_daily_titles (
+                    db_path TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    plays INTEGER NOT NULL DEFAULT 0,
+                    duration INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (db_path, user_id, day, title)
+                )
+            """)
+            await db.commit()
+        self._initialized = True
+
+    async def get_state(self, server_config: Optional[dict] = None) -> Optional[dict]:
+        """获取汇总进度（未建立过汇总时返回 None）"""
+        await self.init_db()
+        async with get_app_db(ROLLUPS_DB) as db:
+            async with db.execute(
+                "SELECT * FROM rollup_state WHERE db_path = ?",
+                (self._get_db_path(server_config),)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+
+    async def refresh(
+        self,
+        server_config: Optional[dict] = None,
+        max_rowid: Optional[int] = None,
+        row_count: Optional[int] = None
+    ) -> int:
+        """根据 rowid 高水位增量更新汇总
+
+        新增记录按 ROLLUP_BATCH_ROWS 分批汇总，每批一个事务；以下情况整体重建：
+        - 最大 rowid 回退（数据库被替换或清理）
+        - 最小 rowid 变化（旧记录被保留期清理）
+        - 传入 row_count 时，高水位以下的行数与已汇总的行数不一致（中间的记录被手动删除）
+        - 最小播放时长或时区配置变化
+
+        每次只查询最小 rowid（走主键，开销很小）；需要全表计数的核对由调用方低频进行
+
+        Args:
+            max_rowid: 已知的播放记录最大 rowid（不传则查询）
+            row_count: rowid 不超过 max_rowid 的记录数（传入时与 max_rowid 一起传）
+
+        Returns:
+            本次处理的 rowid 数量
+        """
+        await self.init_db()
+        db_path = self._get_db_path(server_config)
+        lock = self._locks.setdefault(db_path, asyncio.Lock())
+        async with lock:
+            state = await self.get_state(server_config)
+            high_water_mark = state["high_water_mark"] if state else 0
+            done_rows = state["row_count"] if state else 0
+
+            deleted = False
+            async with get_playback_db(server_config) as db:
+                async with db.execute("SELECT MIN(rowid), MAX(rowid) FROM PlaybackActivity") as cursor:
+                    row = await cursor.fetchone()
+                min_rowid = (row[0] if row else None) or 0
+                if max_rowid is None:
+                    max_rowid = (row[1] if row else None) or 0
+                if state and high_water_mark and high_water_mark <= max_rowid:
+                    deleted = min_rowid != state["min_rowid"]
+                    if not deleted and row_count is not None:
+                        # 高水位以下的行数 = 总行数 - 高水位之后的新增行数（只扫描新增部分）
+                        async with db.execute(
+                            "SELECT COUNT(*) FROM PlaybackActivity WHERE rowid > ? AND rowid <= ?",
+                            (high_water_mark, max_rowid)
+                        ) as cursor:
+                            new_rows = (await cursor.fetchone())[0]
+                        deleted = row_count - new_rows != done_rows
+
+            min_duration = settings.MIN_PLAY_DURATION
+            tz_offset = settings.TZ_OFFSET
+            rebuild = state is None
+            if state and (
+                max_rowid < high_water_mark
+                or deleted
+                or state["min_play_duration"] != min_duration
+                or state["tz_offset"] != tz_offset
+            ):
+                logger.info(f"播放记录被删除或替换、或过滤/时区配置变化，重建用户汇总: {db_path}")
+                await self._clear(db_path)
+                high_water_mark = 0
+                done_rows = 0
+                rebuild = True
+
+            start = high_water_mark
+            while high_water_mark < max_rowid:
+                batch_end = min(high_water_mark + ROLLUP_BATCH_ROWS, max_rowid)
+                done_rows += await self._apply_batch(
+                    server_config, db_path, high_water_mark, batch_end, done_rows, min_rowid, min_duration
+                )
+                high_water_mark = batch_end
+                # 大量历史数据首次汇总时，批次之间让出事件循环
+                await asyncio.sleep(0)
+
+            if rebuild and max_rowid == 0:
+                await self._save_state(db_path, 0, 0, 0, min_duration)
+            return high_water_mark - start
+
+    async def _clear(self, db_path: str):
+        async with get_app_db(ROLLUPS_DB) as db:
+            await db.execute("DELETE FROM user_daily WHERE db_path = ?", (db_path,))
+            await db.execute("DELETE FROM user_daily_titles WHERE db_path = ?", (db_path,))
+            await db.execute("DELETE FROM rollup_state WHERE db_path = ?", (db_path,))
+            await db.commit()
+
+    async def _save_state(
+        self, db_path: str, high_water_mark: int, row_count: int, min_rowid: int, min_duration: int, db=None
+    ):
+        sql = """
+            INSERT INTO rollup_state
+            (db_path, high_water_mark, row_count, min_rowid, min_play_duration, tz_offset, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(db_path) DO UPDATE SET
+                high_water_mark = excluded.high_water_mark,
+                row_count = excluded.row_count,
+                min_rowid = excluded.min_rowid,
+                min_play_duration = excluded.min_play_duration,
+                tz_offset = excluded.tz_offset,
+                updated_at = excluded.updated_at
+        """
+        params = (
+            db_path, high_water_mark, row_count, min_rowid, min_duration, settings.TZ_OFFSET,
+            datetime.now().isoformat()
+        )
+        if db is not None:
+            await db.execute(sql, params)
+            return
+        async with get_app_db(ROLLUPS_DB) as db:
+            await db.execute(sql, params)
+            await db.commit()
+
+    async def _apply_batch(
+        self,
+        server_config: Optional[dict],
+        db_path: str,
+        low: int,
+        high: int,
+        row_count: int,
+        min_rowid: int,
+        min_duration: int
+    ) -> int:
+        """汇总 rowid 在 (low, high] 范围内的播放记录并合并到汇总表
+
+        Args:
+            row_count: 此前已汇总的行数
+            min_rowid: 播放记录当前的最小 rowid
+
+        Returns:
+            本批次的行数
+        """
+        count_expr = get_count_expr()
+        duration_filter = get_duration_filter()
+        day_expr = local_date("DateCreated")
+
+        titles = defaultdict(lambda: [0, 0])
+        async with get_playback_db(server_config) as db:
+            async with db.execute(
+                "SELECT COUNT(*) FROM PlaybackActivity WHERE rowid > ? AND rowid <= ?", (low, high)
+            ) as cursor:
+                batch_rows = (await cursor.fetchone())[0]
+            async with db.execute(f"""
+                SELECT UserId, {day_expr} as day, ItemName, ItemType,
+                       {count_expr}, COALESCE(SUM(PlayDuration), 0)
+                FROM PlaybackActivity
+                WHERE rowid > ? AND rowid <= ? AND UserId IS NOT NULL {duration_filter}
+                GROUP BY UserId, day, ItemName, ItemType
+            """, (low, high)) as cursor:
+                async for user_id, day, item_name, item_type, plays, duration in cursor:
+                    if not day:
+                        continue
+                    entry = titles[(user_id, day, title_of(item_name, item_type))]
+                    entry[0] += int(plays or 0)
+                    entry[1] += int(duration or 0)
+
+        daily = defaultdict(lambda: [0, 0])
+        for (user_id, day, _), (plays, duration) in titles.items():
+            entry = daily[(user_id, day)]
+            entry[0] += plays
+            entry[1] += duration
+
+        async with get_app_db(ROLLUPS_DB) as db:
+            await db.executemany("""
+                INSERT INTO user_daily (db_path, user_id, day, plays, duration)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(db_path, user_id, day) DO UPDATE SET
+                    plays = plays + excluded.plays,
+                    duration = duration + excluded.duration
+            """, [(db_path, user_id, day, plays, duration) for (user_id, day), (plays, duration) in daily.items()])
+            await db.executemany("""
+                INSERT INTO user_daily_titles (db_path, user_id, day, title, plays, duration)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(db_path, user_id, day, title) DO UPDATE SET
+                    plays = plays + excluded.plays,
+                    duration = duration + excluded.duration
+            """, [(db_path, user_id, day, title, plays, duration) for (user_id, day, title), (plays, duration) in titles.items()])
+            await self._save_state(db_path, high, row_count + batch_rows, min_rowid, min_duration, db)
+            await db.commit()
+        return batch_rows
+
+    async def get_user_summary(
+        self,
+        user_id: str,
+        start_date: Optional[str] = None,
+        server_config: Optional[dict] = None,
+        top: int = 3
+    ) -> dict:
+        """读取用户的汇总数据
+
+        Returns:
+            {"plays", "duration", "top_titles": [{"title", "plays", "duration"}], "streak"}
+        """
+        await self.init_db()
+        db_path = self._get_db_path(server_config)
+        start_date = start_date or "0000-00-00"
+        async with get_app_db(ROLLUPS_DB) as db:
+            async with db.execute("""
+                SELECT COALESCE(SUM(plays), 0), COALESCE(SUM(duration), 0)
+                FROM user_daily
+                WHERE db_path = ? AND user_id = ? AND day >= ?
+            """, (db_path, user_id, start_date)) as cursor:
+                plays, duration = await cursor.fetchone()
+
+            async with db.execute("""
+                SELECT title, SUM(plays) as p, SUM(duration) as d
+                FROM user_daily_titles
+                WHERE db_path = ? AND user_id = ? AND day >= ?
+                GROUP BY title
+                ORDER BY p DESC, d DESC
+                LIMIT ?
+            """, (db_path, user_id, start_date, top)) as cursor:
+                top_titles = [
+                    {"title": title, "plays": p, "duration": d}
+                    for title, p, d in await cursor.fetchall()
+                ]
+
+            async with db.execute("""
+                SELECT day FROM user_daily
+                WHERE db_path = ? AND user_id = ? AND plays > 0
+                ORDER BY day DESC
+                LIMIT ?
+            """, (db_path, user_id, MAX_STREAK_DAYS)) as cursor:
+                days = [row[0] for row in await cursor.fetchall()]
+
+        return {
+            "plays": plays,
+            "duration": duration,
+            "top_titles": top_titles,
+            "streak": self._streak(days),
+        }
+
+    @staticmethod
+    def _streak(days_desc: list[str]) -> int:
+        """连续观看天数：截至今天（今天还没看则截至昨天）的连续有播放的天数"""
+        if not days_desc:
+            return 0
+        today = datetime.now().date()
+        expected = today
+        if days_desc[0] != expected.isoformat():
+            expected = today - timedelta(days=1)
+        streak = 0
+        for day in days_desc:
+            if day != expected.isoformat():
+                break
+            streak += 1
+            expected -= timedelta(days=1)
+        return streak
+
+
+# 单例实例
+rollup_service = RollupService()
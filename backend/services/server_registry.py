@@ -0,0 +1,246 @@
+"""
+服务器资源注册表模块
+统一管理每个服务器持有的资源（HTTP 客户端、数据库连接池、缓存、后台任务），
+首次使用时创建，服务器配置变更或删除时回收
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Callable, Awaitable
+import httpx
+from config import settings
+from db_pool import pool_manager
+from logger import get_logger
+
+logger = get_logger("services.server_registry")
+
+# 服务器配置中与资源相关的字段，变化时需要重建资源
+RESOURCE_FIELDS = ("emby_url", "emby_api_key", "playback_db", "users_db", "auth_db")
+
+# 回收旧资源前的最长等待时间（秒）：等待进行中的请求和后台任务结束后再关闭
+RESOURCE_CLOSE_GRACE_SECONDS = 30
+
+
+def _db_paths(server_config: Optional[dict]) -> set:
+    """获取服务器使用的数据库文件路径（与 database.py 中的规则一致）"""
+    if server_config:
+        users_db = server_config.get('users_db', settings.USERS_DB)
+        paths = {
+            server_config.get('playback_db', settings.PLAYBACK_DB),
+            users_db,
+            server_config.get('auth_db', settings.AUTH_DB),
+        }
+    else:
+        users_db = settings.USERS_DB
+        paths = {settings.PLAYBACK_DB, users_db, settings.AUTH_DB}
+    paths.add(users_db.replace('users.db', 'library.db'))
+    return {p for p in paths if p}
+
+
+class ServerResources:
+    """单个服务器持有的资源"""
+
+    def __init__(self, server_id: str, server_config: Optional[dict]):
+        self.server_id = server_id
+        self.config = dict(server_config) if server_config else None
+        self.fingerprint = self._fingerprint(server_config)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # 正在使用共享客户端的请求数，回收时等待归零
+        self._in_use = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @staticmethod
+    def _fingerprint(server_config: Optional[dict]) -> tuple:
+        if not server_config:
+            return ()
+        return tuple(server_config.get(field) for field in RESOURCE_FIELDS)
+
+    def get_client(self) -> httpx.AsyncClient:
+        """获取该服务器共享的 HTTP 客户端（首次使用时创建）"""
+        if self._client is None or self._client.is_closed:
+            limit = max(settings.EMBY_HTTP_MAX_CONNECTIONS, 1)
+            self._client = httpx.AsyncClient(
+                timeout=15,
+                limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit),
+            )
+        return self._client
+
+    @asynccontextmanager
+    async def use_client(self):
+        """借用共享 HTTP 客户端；回收资源时会等待借用结束再关闭客户端"""
+        self._in_use += 1
+        self._idle.clear()
+        try:
+            yield self.get_client()
+        finally:
+            self._in_use -= 1
+            if not self._in_use:
+                self._idle.set()
+
+    def spawn(self, name: str, coro_factory: Callable[[], Awaitable]) -> asyncio.Task:
+        """启动后台任务；同名任务仍在运行时直接返回该任务"""
+        task = self._tasks.get(name)
+        if task and not task.done():
+            return task
+
+        async def _run():
+            try:
+                await coro_factory()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Background task '{name}' failed for server {self.server_id}: {e}")
+            finally:
+                if self._tasks.get(name) is task:
+                    self._tasks.pop(name, None)
+
+        task = asyncio.create_task(_run())
+        self._tasks[name] = task
+        return task
+
+    def is_running(self, name: str) -> bool:
+        """检查后台任务是否正在运行"""
+        task = self._tasks.get(name)
+        return bool(task and not task.done())
+
+    async def _drain(self):
+        """等待后台任务和进行中的请求结束"""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        if tasks:
+            await asyncio.wait(tasks)
+        await self._idle.wait()
+
+    async def close(self, grace: float = 0):
+        """关闭资源：最多等待 grace 秒让后台任务和进行中的请求结束，
+        之后取消剩余的后台任务并关闭 HTTP 客户端
+        """
+        if grace > 0:
+            try:
+                await asyncio.wait_for(self._drain(), timeout=grace)
+            except asyncio.TimeoutError:
+                logger.warning(f"Server {self.server_id} resources still busy after {grace}s, closing anyway")
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class ServerRegistry:
+    """服务器资源注册表"""
+
+    def __init__(self):
+        self._resources: Dict[str, ServerResources] = {}
+        # 正在后台回收的旧资源（保留任务引用，避免被垃圾回收）
+        self._closing: Dict[asyncio.Task, ServerResources] = {}
+
+    def get(self, server_config: Optional[dict] = None) -> ServerResources:
+        """获取服务器资源（懒加载）；配置发生变化时回收旧资源并重建"""
+        server_id = server_config.get('id', 'default') if server_config else 'default'
+        resources = self._resources.get(server_id)
+        if resources is not None and resources.fingerprint != ServerResources._fingerprint(server_config):
+            logger.info(f"Server {server_id} config changed, rebuilding resources")
+            self._close_later(resources)
+            resources = None
+        if resources is None:
+            resources = ServerResources(server_id, server_config)
+            self._resources[server_id] = resources
+        return resources
+
+    def _close_later(self, resources: ServerResources):
+        """在后台回收旧资源，等待进行中的请求结束后再关闭"""
+        task = asyncio.create_task(resources.close(grace=RESOURCE_CLOSE_GRACE_SECONDS))
+        self._closing[task] = resources
+        task.add_done_callback(self._on_closed)
+
+    def _on_closed(self, task: asyncio.Task):
+        self._closing.pop(task, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Failed to close server resources: {task.exception()}")
+
+    def get_client(self, server_config: Optional[dict] = None) -> httpx.AsyncClient:
+        """获取服务器共享的 HTTP 客户端"""
+        return self.get(server_config).get_client()
+
+    @asynccontextmanager
+    async def http_client(self, server_config: Optional[dict] = None):
+        """以上下文管理器形式获取共享 HTTP 客户端（退出时不关闭客户端）
+
+        使用期间服务器配置变更时，旧客户端在退出后才会被关闭
+        """
+        async with self.get(server_config).use_client() as client:
+            yield client
+
+    def get_stats(self) -> dict:
+        """获取各服务器的资源状态（调试用）"""
+        return {
+            server_id: {
+                "http_client": resources._client is not None and not resources._client.is_closed,
+                "tasks": [name for name in resources._tasks if resources.is_running(name)],
+            }
+            for server_id, resources in self._resources.items()
+        }
+
+    async def release(self, server_id: str, old_config: Optional[dict] = None):
+        """回收服务器资源（配置更新或删除后调用）
+
+        在后台等待进行中的请求结束后关闭 HTTP 客户端和后台任务，清除相关缓存，
+        并关闭不再被其他服务器使用的数据库连接池
+
+        Args:
+            server_id: 服务器ID
+            old_config: 变更前的服务器配置，用于定位旧的数据库文件
+        """
+        resources = self._resources.pop(server_id, None)
+        if resources is not None:
+            self._close_later(resources)
+            if old_config is None:
+                old_config = resources.config
+
+        self._invalidate_caches(server_id, old_config)
+
+        if old_config:
+            from services.servers import server_service
+
+            in_use = set()
+            for server in await server_service.get_all_servers():
+                in_use |= _db_paths(server)
+            for db_path in _db_paths(old_config) - in_use:
+                await pool_manager.close_pool(db_path)
+
+        logger.info(f"Released resources for server {server_id}")
+
+    def _invalidate_caches(self, server_id: str, server_config: Optional[dict]):
+        """清除各服务中与该服务器相关的缓存"""
+        from services.emby import emby_service
+        from services.users import user_service
+        from services.dimension_catalog import dimension_catalog_service
+        from services.report_cache import report_cache
+        from services.derived_data import derived_data_service
+
+        emby_service.invalidate_server(server_id)
+        report_cache.invalidate_server(server_id)
+        derived_data_service.invalidate(server_id)
+        if server_config:
+            user_service.invalidate(server_config)
+            dimension_catalog_service.invalidate(server_config)
+
+    async def close_all(self):
+        """关闭所有服务器资源（应用关闭时调用，不再等待进行中的请求）"""
+        closing = list(self._closing.items())
+        for task, _ in closing:
+            task.cancel()
+        if closing:
+            await asyncio.gather(*[task for task, _ in closing], return_exceptions=True)
+        for resources in [*(r for _, r in closing), *self._resources.values()]:
+            await resources.close()
+        self._resources.clear()
+
+
+# 单例实例
+server_registry = ServerRegistry()
@@ -4,9 +4,9 @@
 """
 import json
 import os
-import aiosqlite
 from typing import Optional, List, Dict
 from config import settings
+from database import get_app_db
 
 SERVERS_DB = "/config/servers.db"
 
@@ -16,11 +16,19 @@ class ServerService:
 
     def __init__(self):
         self._servers_cache: Optional[List[Dict]] = None
+        # 服务器ID -> 配置，由 _servers_cache 派生，列表重新加载后重建
+        self._server_map: Dict[str, Dict] = {}
+        self._server_map_source: Optional[List[Dict]] = None
+        self._table_ready = False
+
+    async def _ensure_table(self):
+        """确保服务器配置表已创建（进程内只执行一次）"""
+        if not self._table_ready:
+            await self.init_servers_table()
 
     async def init_servers_table(self):
         """初始化服务器配置表"""
-        async with aiosqlite.connect(SERVERS_DB) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
+        async with get_app_db(SERVERS_DB) as db:
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS servers (
                     id TEXT PRIMARY KEY,
@@ -39,16 +47,15 @@ class ServerService:
                 CREATE INDEX IF NOT EXISTS idx_servers_default ON servers(is_default)
             """)
             await db.commit()
+        self._table_ready = True
 
     async def get_all_servers(self) -> List[Dict]:
         """获取所有服务器配置"""
         if self._servers_cache:
             return self._servers_cache
 
-        await self.init_servers_table()
-        async with aiosqlite.connect(SERVERS_DB) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
-            db.row_factory = aiosqlite.Row
+        await self._ensure_table()
+        async with get_app_db(SERVERS_DB) as db:
             async with db.execute("""
                 SELECT id, name, emby_url, emby_api_key, playback_db, users_db, auth_db, is_default
                 FROM servers
@@ -69,13 +76,17 @@ class ServerService:
                 self._servers_cache = servers
                 return servers
 
+    async def get_server_map(self) -> Dict[str, Dict]:
+        """获取 服务器ID -> 配置 的映射（批量查询服务器名称等场景使用）"""
+        servers = await self.get_all_servers()
+        if self._server_map_source is not servers:
+            self._server_map = {server["id"]: server for server in servers}
+            self._server_map_source = servers
+        return self._server_map
+
     async def get_server(self, server_id: str) -> Optional[Dict]:
         """获取指定服务器配置"""
-        servers = await self.get_all_servers()
-        for server in servers:
-            if server["id"] == server_id:
-                return server
-        return None
+        return (await self.get_server_map()).get(server_id)
 
     async def get_default_server(self) -> Optional[Dict]:
         """获取默认服务器"""
@@ -100,17 +111,15 @@ class ServerService:
         import uuid
         server_id = str(uuid.uuid4())
 
-        await self.init_servers_table()
+        await self._ensure_table()
 
         # 如果设置为默认，先取消其他默认服务器
         if is_default:
-            async with aiosqlite.connect(SERVERS_DB) as db:
-                await db.execute("PRAGMA busy_timeout = 30000")
+            async with get_app_db(SERVERS_DB) as db:
                 await db.execute("UPDATE servers SET is_default = 0")
                 await db.commit()
 
-        async with aiosqlite.connect(SERVERS_DB) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
+        async with get_app_db(SERVERS_DB) as db:
             await db.execute("""
                 INSERT INTO servers (id, name, emby_url, emby_api_key, playback_db, users_db, auth_db, is_default, updated_at)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, unixepoch())
@@ -133,12 +142,11 @@ class ServerService:
         is_default: Optional[bool] = None
     ) -> bool:
         """更新服务器配置"""
-        await self.init_servers_table()
+        await self._ensure_table()
 
         # 如果设置为默认，先取消其他默认服务器
         if is_default:
-            async with aiosqlite.connect(SERVERS_DB) as db:
-                await db.execute("PRAGMA busy_timeout = 30000")
+            async with get_app_db(SERVERS_DB) as db:
                 await db.execute("UPDATE servers SET is_default = 0")
                 await db.commit()
 
@@ -173,8 +181,7 @@ class ServerService:
         updates.append("updated_at = unixepoch()")
         params.append(server_id)
 
-        async with aiosqlite.connect(SERVERS_DB) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
+        async with get_app_db(SERVERS_DB) as db:
             await db.execute(
                 f"UPDATE servers SET {', '.join(updates)} WHERE id = ?",
                 params
@@ -187,9 +194,8 @@ class ServerService:
 
     async def delete_server(self, server_id: str) -> bool:
         """删除服务器"""
-        await self.init_servers_table()
-        async with aiosqlite.connect(SERVERS_DB) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
+        await self._ensure_table()
+        async with get_app_db(SERVERS_DB) as db:
             cursor = await db.execute("DELETE FROM servers WHERE id = ?", (server_id,))
             await db.commit()
             deleted = cursor.rowcount > 0
@@ -4,9 +4,10 @@
 """
 import secrets
 import time
-import aiosqlite
-from typing import Optional
-from pathlib import Path
+from typing import Optional, Dict
+from cachetools import TTLCache
+from config import settings
+from database import get_app_db
 from logger import get_logger
 
 logger = get_logger("services.session")
@@ -24,19 +25,32 @@ class SessionService:
         self.db_path = db_path
         # 会话有效期（秒）- 30 天
         self.session_expire = 30 * 24 * 60 * 60
+        # 会话内存缓存（短 TTL），避免每次请求都读数据库
+        self._cache: TTLCache = TTLCache(
+            maxsize=settings.SESSION_CACHE_MAX_SIZE,
+            ttl=settings.SESSION_CACHE_TTL
+        )
+        # 负缓存：不存在或已过期的会话ID
+        self._miss_cache: TTLCache = TTLCache(
+            maxsize=settings.SESSION_CACHE_MAX_SIZE,
+            ttl=settings.SESSION_CACHE_TTL
+        )
+        # 待写入的最后活动时间：session_id -> last_activity
+        self._dirty_activity: Dict[str, int] = {}
+
+    def _forget(self, session_id: str):
+        """移除会话的内存状态"""
+        self._cache.pop(session_id, None)
+        self._dirty_activity.pop(session_id, None)
 
     async def init_db(self):
         """初始化数据库表"""
-        # 确保目录存在
-        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
-
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
+        async with get_app_db(self.db_path) as db:
             # 检查表是否已存在
-            cursor = await db.execute(
+            async with db.execute(
                 "SELECT name FROM sqlite_master WHERE type='table' AND name='sessions'"
-            )
-            table_exists = await cursor.fetchone()
+            ) as cursor:
+                table_exists = await cursor.fetchone()
 
             if table_exists:
                 # 表已存在，检查是否有 expires_at 列（新版字段）
@@ -94,8 +108,7 @@ class SessionService:
         now = int(time.time())
         expires_at = now + self.session_expire
 
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
+        async with get_app_db(self.db_path) as db:
             await db.execute("""
                 INSERT INTO sessions
                 (session_id, user_id, username, is_admin, server_id,
@@ -108,11 +121,24 @@ class SessionService:
             ))
             await db.commit()
 
+        self._miss_cache.pop(session_id, None)
+        self._cache[session_id] = {
+            "session_id": session_id,
+            "user_id": user_id,
+            "username": username,
+            "is_admin": bool(is_admin),
+            "server_id": server_id,
+            "created_at": now,
+            "expires_at": expires_at,
+            "last_activity": now
+        }
         return session_id
 
     async def get_session(self, session_id: str) -> Optional[dict]:
         """获取会话信息
 
+        优先读取内存缓存；最后活动时间只记录在内存中，由 flush_activity 定期批量写入
+
         Args:
             session_id: 会话ID
 
@@ -124,30 +150,26 @@ class SessionService:
 
         now = int(time.time())
 
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute("""
-                SELECT session_id, user_id, username, is_admin,
-                       server_id, created_at, expires_at, last_activity
-                FROM sessions
-                WHERE session_id = ? AND expires_at > ?
-            """, (session_id, now))
+        if session_id in self._miss_cache:
+            return None
 
-            row = await cursor.fetchone()
+        session = self._cache.get(session_id)
+        if session is None:
+            async with get_app_db(self.db_path) as db:
+                # 使用 async with 及时结束语句，避免池化连接长期持有读快照
+                async with db.execute("""
+                    SELECT session_id, user_id, username, is_admin,
+                           server_id, created_at, expires_at, last_activity
+                    FROM sessions
+                    WHERE session_id = ? AND expires_at > ?
+                """, (session_id, now)) as cursor:
+                    row = await cursor.fetchone()
 
             if not row:
+                self._miss_cache[session_id] = True
                 return None
 
-            # 更新最后活动时间
-            await db.execute("""
-                UPDATE sessions
-                SET last_activity = ?
-                WHERE session_id = ?
-            """, (now, session_id))
-            await db.commit()
-
-            return {
+            session = {
                 "session_id": row["session_id"],
                 "user_id": row["user_id"],
                 "username": row["username"],
@@ -157,6 +179,47 @@ class SessionService:
                 "expires_at": row["expires_at"],
                 "last_activity": row["last_activity"]
             }
+            self._cache[session_id] = session
+        elif session["expires_at"] <= now:
+            self._forget(session_id)
+            self._miss_cache[session_id] = True
+            return None
+
+        # 更新最后活动时间（延迟写入）
+        session["last_activity"] = now
+        self._dirty_activity[session_id] = now
+
+        return dict(session)
+
+    async def flush_activity(self) -> int:
+        """将内存中累积的最后活动时间批量写入数据库
+
+        Returns:
+            写入的会话数量
+        """
+        if not self._dirty_activity:
+            return 0
+
+        pending = self._dirty_activity
+        self._dirty_activity = {}
+
+        try:
+            async with get_app_db(self.db_path) as db:
+                await db.executemany("""
+                    UPDATE sessions
+                    SET last_activity = ?
+                    WHERE session_id = ?
+                """, [(last_activity, session_id) for session_id, last_activity in pending.items()])
+                await db.commit()
+        except Exception as e:
+            # 写入失败时放回队列，等待下次刷新（保留更新的时间）
+            for session_id, last_activity in pending.items():
+                if self._dirty_activity.get(session_id, 0) < last_activity:
+                    self._dirty_activity[session_id] = last_activity
+            logger.error(f"写入会话活动时间失败: {e}")
+            return 0
+
+        return len(pending)
 
     async def delete_session(self, session_id: str) -> bool:
         """删除会话
@@ -170,8 +233,10 @@ class SessionService:
         if not session_id:
             return False
 
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
+        self._forget(session_id)
+        self._miss_cache[session_id] = True
+
+        async with get_app_db(self.db_path) as db:
             cursor = await db.execute("""
                 DELETE FROM sessions WHERE session_id = ?
             """, (session_id,))
@@ -187,8 +252,7 @@ class SessionService:
         """
         now = int(time.time())
 
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
+        async with get_app_db(self.db_path) as db:
             cursor = await db.execute("""
                 DELETE FROM sessions WHERE expires_at <= ?
             """, (now,))
@@ -210,9 +274,9 @@ class SessionService:
 
         now = int(time.time())
         new_expires = now + self.session_expire
+        self._forget(session_id)
 
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
+        async with get_app_db(self.db_path) as db:
             cursor = await db.execute("""
                 UPDATE sessions
                 SET expires_at = ?, last_activity = ?
@@ -231,11 +295,12 @@ class SessionService:
         Returns:
             会话列表
         """
+        # 先写入累积的活动时间，保证排序准确
+        await self.flush_activity()
+
         now = int(time.time())
 
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
-            db.row_factory = aiosqlite.Row
+        async with get_app_db(self.db_path) as db:
 
             if user_id:
                 cursor = await db.execute("""
@@ -1,7 +1,15 @@
 """
 Telegram 推送服务
 处理向 Telegram 发送消息和图片
+
+- 按 (Bot Token, 代理) 复用 HTTP 客户端
+- 同一会话的消息按调用顺序逐条发送，全局和单会话发送速率受限
+- 429 按 retry_after 等待后重试，5xx 和网络错误指数退避重试
 """
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Optional
 import httpx
 from config import settings
 from logger import get_logger
@@ -9,72 +17,177 @@ from logger import get_logger
 logger = get_logger("services.telegram")
 
 
+class TelegramRateLimiter:
+    """单个 Bot 的发送限速器
+
+    每次发送前预约全局和会话两个时间槽；收到 429 时全局暂停
+    """
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._next_global = 0.0
+        self._next_chat: dict[str, float] = {}
+
+    async def wait_turn(self, chat_id: str):
+        """预约发送时间槽并等待到该时间"""
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            start = max(now, self._next_global, self._next_chat.get(chat_id, 0.0))
+            self._next_global = start + 1.0 / max(settings.TG_DELIVERY_GLOBAL_RATE, 0.1)
+            self._next_chat[chat_id] = start + settings.TG_DELIVERY_CHAT_INTERVAL
+            # 清理已过期的会话时间槽
+            if len(self._next_chat) > 10000:
+                self._next_chat = {cid: t for cid, t in self._next_chat.items() if t > now}
+        delay = start - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def pause(self, seconds: float):
+        """全局暂停发送（收到 429 时调用）"""
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            self._next_global = max(self._next_global, loop.time() + seconds)
+
+
 class TelegramService:
     """Telegram 推送服务"""
 
     def __init__(self):
         self.base_url = "https://api.telegram.org"
+        self._clients: dict[tuple, httpx.AsyncClient] = {}
+        self._limiters: dict[str, TelegramRateLimiter] = {}
+        # (Bot Token, 会话ID) -> [锁, 使用中（持有或等待）的请求数]
+        self._chat_locks: dict[tuple, list] = {}
+        self._stats = {"sent": 0, "failed": 0, "retried": 0, "rate_limited": 0}
 
     def is_configured(self) -> bool:
         """检查 Telegram 是否已配置"""
         return bool(settings.TELEGRAM_BOT_TOKEN and settings.TELEGRAM_CHAT_ID)
 
+    def get_rate_limiter(self, bot_token: str) -> TelegramRateLimiter:
+        """获取 Bot 的限速器（同一 Bot 的所有发送共用）"""
+        limiter = self._limiters.get(bot_token)
+        if limiter is None:
+            limiter = self._limiters[bot_token] = TelegramRateLimiter()
+        return limiter
+
+    def _get_client(self, bot_token: str, proxy: str = "") -> httpx.AsyncClient:
+        """获取 (Bot Token, 代理) 对应的共享 HTTP 客户端"""
+        key = (bot_token, proxy or "")
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(proxies=proxy if proxy else None)
+            self._clients[key] = client
+        return client
+
+    @asynccontextmanager
+    async def _chat_turn(self, bot_token: str, chat_id: str):
+        """同一会话的发送锁（asyncio.Lock 按等待顺序唤醒，保证消息顺序）
+
+        锁在最后一个持有者和等待者都离开后才移除，不会打乱仍在排队的消息
+        """
+        key = (bot_token, str(chat_id))
+        entry = self._chat_locks.get(key)
+        if entry is None:
+            entry = self._chat_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and self._chat_locks.get(key) is entry:
+                del self._chat_locks[key]
+
+    async def _request(
+        self,
+        method: str,
+        bot_token: str,
+        chat_id: str,
+        proxy: str = "",
+        timeout: float = 30,
+        **kwargs
+    ) -> bool:
+        """调用 Bot API：同一会话按顺序排队、限速，失败时重试
+
+        Args:
+            method: Bot API 方法名（sendMessage / sendPhoto / sendMediaGroup）
+            kwargs: 传给 httpx 的 json / data / files 参数
+        """
+        chat_id = str(chat_id)
+        limiter = self.get_rate_limiter(bot_token)
+        max_retries = max(settings.TG_DELIVERY_MAX_RETRIES, 0)
+
+        async with self._chat_turn(bot_token, chat_id):
+            for attempt in range(max_retries + 1):
+                await limiter.wait_turn(chat_id)
+                retry_delay = 2 ** attempt
+                try:
+                    resp = await self._get_client(bot_token, proxy).post(
+                        f"{self.base_url}/bot{bot_token}/{method}",
+                        timeout=timeout,
+                        **kwargs
+                    )
+                    if resp.status_code == 200:
+                        self._stats["sent"] += 1
+                        return True
+                    if resp.status_code == 429:
+                        self._stats["rate_limited"] += 1
+                        retry_after = self._get_retry_after(resp)
+                        logger.warning(f"Telegram {method} rate limited, retry after {retry_after}s")
+                        await limiter.pause(retry_after)
+                        retry_delay = 0
+                    elif resp.status_code < 500:
+                        # 4xx（Token 错误、会话不存在等），重试无意义
+                        logger.error(f"Telegram {method} failed: {resp.status_code} - {resp.text}")
+                        break
+                    else:
+                        logger.warning(f"Telegram {method} failed: {resp.status_code} - {resp.text}")
+                except httpx.HTTPError as e:
+                    logger.warning(f"Error calling Telegram {method}: {e}")
+                except Exception as e:
+                    # 代理地址无效等非网络错误，重试无意义
+                    logger.error(f"Error calling Telegram {method}: {e}")
+                    break
+
+                if attempt < max_retries:
+                    self._stats["retried"] += 1
+                    if retry_delay:
+                        await asyncio.sleep(retry_delay)
+
+        self._stats["failed"] += 1
+        return False
+
+    @staticmethod
+    def _get_retry_after(resp: httpx.Response) -> float:
+        """从 429 响应中读取 retry_after（秒）"""
+        try:
+            return float(resp.json()["parameters"]["retry_after"])
+        except Exception:
+            pass
+        try:
+            return float(resp.headers.get("Retry-After", 1))
+        except ValueError:
+            return 1.0
+
     async def send_message(self, text: str, parse_mode: str = "HTML") -> bool:
         """发送文本消息"""
         if not self.is_configured():
             logger.warning("Telegram not configured")
             return False
-
-        try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.post(
-                    f"{self.base_url}/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage",
-                    json={
-                        "chat_id": settings.TELEGRAM_CHAT_ID,
-                        "text": text,
-                        "parse_mode": parse_mode
-                    },
-                    timeout=30
-                )
-                if resp.status_code == 200:
-                    return True
-                else:
-                    logger.error(f"Telegram send message failed: {resp.status_code} - {resp.text}")
-                    return False
-        except Exception as e:
-            logger.error(f"Error sending Telegram message: {e}")
-            return False
+        return await self.send_message_with_config(
+            text, settings.TELEGRAM_BOT_TOKEN, settings.TELEGRAM_CHAT_ID, parse_mode=parse_mode
+        )
 
     async def send_photo(self, photo: bytes, caption: str = "", parse_mode: str = "HTML") -> bool:
         """发送图片"""
         if not self.is_configured():
             logger.warning("Telegram not configured")
             return False
-
-        try:
-            async with httpx.AsyncClient() as client:
-                files = {"photo": ("report.png", photo, "image/png")}
-                data = {
-                    "chat_id": settings.TELEGRAM_CHAT_ID,
-                }
-                if caption:
-                    data["caption"] = caption
-                    data["parse_mode"] = parse_mode
-
-                resp = await client.post(
-                    f"{self.base_url}/bot{settings.TELEGRAM_BOT_TOKEN}/sendPhoto",
-                    data=data,
-                    files=files,
-                    timeout=60
-                )
-                if resp.status_code == 200:
-                    return True
-                else:
-                    logger.error(f"Telegram send photo failed: {resp.status_code} - {resp.text}")
-                    return False
-        except Exception as e:
-            logger.error(f"Error sending Telegram photo: {e}")
-            return False
+        return await self.send_photo_with_config(
+            photo, caption, settings.TELEGRAM_BOT_TOKEN, settings.TELEGRAM_CHAT_ID, parse_mode=parse_mode
+        )
 
     async def send_media_group(self, photos: list[bytes], caption: str = "") -> bool:
         """发送多张图片（媒体组）"""
@@ -85,86 +198,64 @@ class TelegramService:
         if not photos:
             return False
 
-        try:
-            async with httpx.AsyncClient() as client:
-                # 构建媒体组
-                media = []
-                files = {}
-                for i, photo in enumerate(photos):
-                    attach_name = f"photo{i}"
-                    media.append({
-                        "type": "photo",
-                        "media": f"attach://{attach_name}",
-                        "caption": caption if i == 0 else "",
-                        "parse_mode": "HTML" if i == 0 and caption else None
-                    })
-                    files[attach_name] = (f"report_{i}.png", photo, "image/png")
-
-                import json
-                data = {
-                    "chat_id": settings.TELEGRAM_CHAT_ID,
-                    "media": json.dumps(media)
-                }
-
-                resp = await client.post(
-                    f"{self.base_url}/bot{settings.TELEGRAM_BOT_TOKEN}/sendMediaGroup",
-                    data=data,
-                    files=files,
-                    timeout=120
-                )
-                if resp.status_code == 200:
-                    return True
-                else:
-                    logger.error(f"Telegram send media group failed: {resp.status_code} - {resp.text}")
-                    return False
-        except Exception as e:
-            logger.error(f"Error sending Telegram media group: {e}")
-            return False
+        # 构建媒体组
+        media = []
+        files = {}
+        for i, photo in enumerate(photos):
+            attach_name = f"photo{i}"
+            media.append({
+                "type": "photo",
+                "media": f"attach://{attach_name}",
+                "caption": caption if i == 0 else "",
+                "parse_mode": "HTML" if i == 0 and caption else None
+            })
+            files[attach_name] = (f"report_{i}.png", photo, "image/png")
+
+        data = {
+            "chat_id": settings.TELEGRAM_CHAT_ID,
+            "media": json.dumps(media)
+        }
+        return await self._request(
+            "sendMediaGroup", settings.TELEGRAM_BOT_TOKEN, settings.TELEGRAM_CHAT_ID,
+            timeout=120, data=data, files=files
+        )
 
     # ==================== 使用自定义配置的方法 ====================
 
     async def send_message_with_config(self, text: str, bot_token: str, chat_id: str, proxy: str = "", parse_mode: str = "HTML") -> bool:
         """使用指定配置发送文本消息"""
-        try:
-            async with httpx.AsyncClient(proxies=proxy if proxy else None) as client:
-                resp = await client.post(
-                    f"{self.base_url}/bot{bot_token}/sendMessage",
-                    json={"chat_id": chat_id, "text": text, "parse_mode": parse_mode},
-                    timeout=30
-                )
-                if resp.status_code == 200:
-                    return True
-                else:
-                    logger.error(f"Telegram send message failed: {resp.status_code} - {resp.text}")
-                    return False
-        except Exception as e:
-            logger.error(f"Error sending Telegram message: {e}")
-            return False
+        return await self._request(
+            "sendMessage", bot_token, chat_id, proxy,
+            timeout=30,
+            json={"chat_id": chat_id, "text": text, "parse_mode": parse_mode}
+        )
 
     async def send_photo_with_config(self, photo: bytes, caption: str, bot_token: str, chat_id: str, proxy: str = "", parse_mode: str = "HTML") -> bool:
         """使用指定配置发送图片"""
-        try:
-            async with httpx.AsyncClient(proxies=proxy if proxy else None) as client:
-                files = {"photo": ("report.png", photo, "image/png")}
-                data = {"chat_id": chat_id}
-                if caption:
-                    data["caption"] = caption
-                    data["parse_mode"] = parse_mode
-
-                resp = await client.post(
-                    f"{self.base_url}/bot{bot_token}/sendPhoto",
-                    data=data,
-                    files=files,
-                    timeout=60
-                )
-                if resp.status_code == 200:
-                    return True
-                else:
-                    logger.error(f"Telegram send photo failed: {resp.status_code} - {resp.text}")
-                    return False
-        except Exception as e:
-            logger.error(f"Error sending Telegram photo: {e}")
-            return False
+        files = {"photo": ("report.png", photo, "image/png")}
+        data = {"chat_id": chat_id}
+        if caption:
+            data["caption"] = caption
+            data["parse_mode"] = parse_mode
+        return await self._request(
+            "sendPhoto", bot_token, chat_id, proxy,
+            timeout=60, data=data, files=files
+        )
+
+    def get_stats(self) -> dict:
+        """获取发送统计（调试用）"""
+        return {
+            **self._stats,
+            "clients": len(self._clients),
+            "active_chats": len(self._chat_locks),
+        }
+
+    async def close(self):
+        """关闭所有 HTTP 客户端（应用关闭时调用）"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
 
 
 # 单例实例
@@ -2,9 +2,11 @@
 Telegram 用户绑定服务
 管理 Telegram 用户与 Emby 账户的绑定关系
 """
-import aiosqlite
+import asyncio
+import os
 from datetime import datetime
 from typing import Optional
+from database import get_app_db
 from logger import get_logger
 
 logger = get_logger("services.tg_binding")
@@ -13,13 +15,36 @@ logger = get_logger("services.tg_binding")
 TG_BINDINGS_DB = "/config/tg_bindings.db"
 
 
+def _db_signature() -> Optional[tuple]:
+    """根据绑定数据库文件（及 WAL 文件）的修改时间和大小生成签名，其他进程写入后会变化"""
+    signature = []
+    for path in (TG_BINDINGS_DB, f"{TG_BINDINGS_DB}-wal"):
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
 class TgBindingService:
     """Telegram 绑定服务"""
 
+    def __init__(self):
+        self._initialized = False
+        # 内存索引：tg_user_id -> {server_id: 绑定}，server_id -> {tg_user_id: 绑定}
+        # 整表加载，本进程创建/删除绑定时同步更新；
+        # 数据库文件签名变化（如其他 worker 进程通过管理接口删除绑定）时重新加载
+        self._by_user: Optional[dict[str, dict[str, dict]]] = None
+        self._by_server: dict[str, dict[str, dict]] = {}
+        self._signature: Optional[tuple] = None
+        self._index_lock = asyncio.Lock()
+
     async def init_db(self):
-        """初始化绑定数据库"""
-        async with aiosqlite.connect(TG_BINDINGS_DB) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
+        """初始化绑定数据库（进程内只执行一次）"""
+        if self._initialized:
+            return
+        async with get_app_db(TG_BINDINGS_DB) as db:
             # 检查是否需要迁移旧表
             await self._migrate_if_needed(db)
 
@@ -48,6 +73,7 @@ class TgBindingService:
                 ON tg_bindings(tg_user_id)
             """)
             await db.commit()
+        self._initialized = True
 
     async def _migrate_if_needed(self, db):
         """检查并迁移旧表结构（单主键 -> 复合主键）"""
@@ -117,53 +143,68 @@ class TgBindingService:
             logger.error(f"TgBinding: Migration failed: {e}")
             raise
 
+    async def _ensure_index(self):
+        """从数据库加载全部绑定到内存索引（首次使用或数据库文件变化时）"""
+        if self._by_user is not None and _db_signature() == self._signature:
+            return
+        async with self._index_lock:
+            if self._by_user is not None and _db_signature() == self._signature:
+                return
+            await self.init_db()
+            # 先取签名再读取：读取期间的写入会使下次检查时签名不一致而重新加载
+            signature = _db_signature()
+            by_user = {}
+            async with get_app_db(TG_BINDINGS_DB) as db:
+                async with db.execute("SELECT * FROM tg_bindings") as cursor:
+                    async for row in cursor:
+                        binding = dict(row)
+                        by_user.setdefault(binding["tg_user_id"], {})[binding["server_id"]] = binding
+            by_server = {}
+            for tg_user_id, bindings in by_user.items():
+                for server_id, binding in bindings.items():
+                    by_server.setdefault(server_id, {})[tg_user_id] = binding
+            self._by_user = by_user
+            self._by_server = by_server
+            self._signature = signature
+            logger.debug(f"TgBinding: Loaded {sum(len(b) for b in by_user.values())} bindings into index")
+
+    def _index_put(self, binding: dict):
+        self._by_user.setdefault(binding["tg_user_id"], {})[binding["server_id"]] = binding
+        self._by_server.setdefault(binding["server_id"], {})[binding["tg_user_id"]] = binding
+
+    def _index_remove(self, tg_user_id: str, server_id: str):
+        bindings = self._by_user.get(tg_user_id, {})
+        bindings.pop(server_id, None)
+        if not bindings:
+            self._by_user.pop(tg_user_id, None)
+        users = self._by_server.get(server_id, {})
+        users.pop(tg_user_id, None)
+        if not users:
+            self._by_server.pop(server_id, None)
+
     async def get_binding(self, tg_user_id: str, server_id: Optional[str] = None) -> Optional[dict]:
         """获取用户绑定信息（指定服务器或第一个绑定）"""
-        async with aiosqlite.connect(TG_BINDINGS_DB) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
-            db.row_factory = aiosqlite.Row
-            if server_id:
-                # 获取指定服务器的绑定
-                async with db.execute(
-                    "SELECT * FROM tg_bindings WHERE tg_user_id = ? AND server_id = ?",
-                    (str(tg_user_id), server_id)
-                ) as cursor:
-                    row = await cursor.fetchone()
-                    if row:
-                        return dict(row)
-            else:
-                # 获取第一个绑定（兼容旧逻辑）
-                async with db.execute(
-                    "SELECT * FROM tg_bindings WHERE tg_user_id = ? ORDER BY created_at ASC LIMIT 1",
-                    (str(tg_user_id),)
-                ) as cursor:
-                    row = await cursor.fetchone()
-                    if row:
-                        return dict(row)
-        return None
+        await self._ensure_index()
+        bindings = self._by_user.get(str(tg_user_id))
+        if not bindings:
+            return None
+        if server_id:
+            # 获取指定服务器的绑定
+            binding = bindings.get(server_id)
+            return dict(binding) if binding else None
+        # 获取第一个绑定（兼容旧逻辑）
+        return dict(min(bindings.values(), key=lambda b: b["created_at"] or ""))
 
     async def get_user_bindings(self, tg_user_id: str) -> list[dict]:
         """获取用户的所有绑定"""
-        async with aiosqlite.connect(TG_BINDINGS_DB) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM tg_bindings WHERE tg_user_id = ? ORDER BY created_at ASC",
-                (str(tg_user_id),)
-            ) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        await self._ensure_index()
+        bindings = self._by_user.get(str(tg_user_id), {}).values()
+        return [dict(b) for b in sorted(bindings, key=lambda b: b["created_at"] or "")]
 
     async def get_bound_server_ids(self, tg_user_id: str) -> list[str]:
         """获取用户已绑定的服务器ID列表"""
-        async with aiosqlite.connect(TG_BINDINGS_DB) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
-            async with db.execute(
-                "SELECT server_id FROM tg_bindings WHERE tg_user_id = ?",
-                (str(tg_user_id),)
-            ) as cursor:
-                rows = await cursor.fetchall()
-                return [row[0] for row in rows]
+        await self._ensure_index()
+        return list(self._by_user.get(str(tg_user_id), {}))
 
     async def create_binding(
         self,
@@ -175,23 +216,33 @@ class TgBindingService:
         emby_username: str
     ) -> bool:
         """创建绑定关系"""
+        await self._ensure_index()
+        binding = {
+            "tg_user_id": str(tg_user_id),
+            "tg_username": tg_username or "",
+            "tg_first_name": tg_first_name or "",
+            "server_id": server_id,
+            "emby_user_id": emby_user_id,
+            "emby_username": emby_username,
+            "created_at": datetime.now().isoformat(),
+        }
         try:
-            async with aiosqlite.connect(TG_BINDINGS_DB) as db:
-                await db.execute("PRAGMA busy_timeout = 30000")
+            async with get_app_db(TG_BINDINGS_DB) as db:
                 await db.execute("""
                     INSERT OR REPLACE INTO tg_bindings
                     (tg_user_id, tg_username, tg_first_name, server_id, emby_user_id, emby_username, created_at)
                     VALUES (?, ?, ?, ?, ?, ?, ?)
                 """, (
-                    str(tg_user_id),
-                    tg_username or "",
-                    tg_first_name or "",
-                    server_id,
-                    emby_user_id,
-                    emby_username,
-                    datetime.now().isoformat()
+                    binding["tg_user_id"],
+                    binding["tg_username"],
+                    binding["tg_first_name"],
+                    binding["server_id"],
+                    binding["emby_user_id"],
+                    binding["emby_username"],
+                    binding["created_at"]
                 ))
                 await db.commit()
+            self._index_put(binding)
             return True
         except Exception as e:
             logger.error(f"Error creating binding: {e}")
@@ -199,42 +250,46 @@ class TgBindingService:
 
     async def delete_binding(self, tg_user_id: str, server_id: Optional[str] = None) -> bool:
         """删除绑定关系（指定服务器或全部）"""
+        await self._ensure_index()
+        tg_user_id = str(tg_user_id)
         try:
-            async with aiosqlite.connect(TG_BINDINGS_DB) as db:
-                await db.execute("PRAGMA busy_timeout = 30000")
+            async with get_app_db(TG_BINDINGS_DB) as db:
                 if server_id:
                     # 删除指定服务器的绑定
                     await db.execute(
                         "DELETE FROM tg_bindings WHERE tg_user_id = ? AND server_id = ?",
-                        (str(tg_user_id), server_id)
+                        (tg_user_id, server_id)
                     )
                 else:
                     # 删除所有绑定
                     await db.execute(
                         "DELETE FROM tg_bindings WHERE tg_user_id = ?",
-                        (str(tg_user_id),)
+                        (tg_user_id,)
                     )
                 await db.commit()
+            server_ids = [server_id] if server_id else list(self._by_user.get(tg_user_id, {}))
+            for sid in server_ids:
+                self._index_remove(tg_user_id, sid)
             return True
         except Exception as e:
             logger.error(f"Error deleting binding: {e}")
             return False
 
-    async def get_all_bindings(self, server_id: Optional[str] = None) -> list[dict]:
-        """获取所有绑定关系"""
-        async with aiosqlite.connect(TG_BINDINGS_DB) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
-            db.row_factory = aiosqlite.Row
-            if server_id:
-                query = "SELECT * FROM tg_bindings WHERE server_id = ? ORDER BY created_at DESC"
-                params = (server_id,)
-            else:
-                query = "SELECT * FROM tg_bindings ORDER BY created_at DESC"
-                params = ()
-
-            async with db.execute(query, params) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+    async def get_all_bindings(
+        self,
+        server_id: Optional[str] = None,
+        limit: Optional[int] = None,
+        offset: int = 0
+    ) -> list[dict]:
+        """获取所有绑定关系（按绑定时间倒序，可分页）"""
+        await self._ensure_index()
+        if server_id:
+            bindings = self._by_server.get(server_id, {}).values()
+        else:
+            bindings = [b for user_bindings in self._by_user.values() for b in user_bindings.values()]
+        bindings = sorted(bindings, key=lambda b: b["created_at"] or "", reverse=True)
+        end = offset + limit if limit is not None else None
+        return [dict(b) for b in bindings[offset:end]]
 
     async def delete_binding_by_admin(self, tg_user_id: str) -> bool:
         """管理员删除绑定"""
@@ -242,18 +297,10 @@ class TgBindingService:
 
     async def get_binding_count(self, server_id: Optional[str] = None) -> int:
         """获取绑定数量"""
-        async with aiosqlite.connect(TG_BINDINGS_DB) as db:
-            await db.execute("PRAGMA busy_timeout = 30000")
-            if server_id:
-                query = "SELECT COUNT(*) FROM tg_bindings WHERE server_id = ?"
-                params = (server_id,)
-            else:
-                query = "SELECT COUNT(*) FROM tg_bindings"
-                params = ()
-
-            async with db.execute(query, params) as cursor:
-                row = await cursor.fetchone()
-                return row[0] if row else 0
+        await self._ensure_index()
+        if server_id:
+            return len(self._by_server.get(server_id, {}))
+        return sum(len(bindings) for bindings in self._by_user.values())
 
 
 # 单例实例
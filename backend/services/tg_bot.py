@@ -14,6 +14,7 @@ from telegram.ext import (
     filters
 )
 from typing import Optional
+import hmac
 import json
 import os
 
@@ -22,6 +23,12 @@ from services.emby import emby_service
 from services.servers import server_service
 from services.report import report_service
 from services.report_config import report_config_service
+from services.tg_delivery import tg_delivery_queue
+from services.rollups import rollup_service
+from services.derived_data import derived_data_service
+from services.server_registry import server_registry
+from config import settings
+import instance_lock
 from logger import get_logger
 
 logger = get_logger("services.tg_bot")
@@ -32,6 +39,22 @@ BOT_CONFIG_FILE = "/config/tg_bot_config.json"
 # 会话状态
 SELECTING_SERVER, WAITING_USERNAME, WAITING_PASSWORD = range(3)
 
+# Webhook 模式下接收更新的路径（与 routers/tg_bot.py 中的路由一致）
+WEBHOOK_PATH = "/api/tg-bot/webhook"
+
+# 定时个人报告每批生成的用户数
+PERSONAL_REPORT_BATCH = 50
+
+PERIOD_NAMES = {"daily": "今日", "weekly": "本周", "monthly": "本月", "yearly": "本年"}
+
+# /stats 命令支持的周期参数写法
+PERIOD_ALIASES = {
+    "daily": "daily", "day": "daily", "today": "daily", "今日": "daily", "日": "daily",
+    "weekly": "weekly", "week": "weekly", "本周": "weekly", "周": "weekly",
+    "monthly": "monthly", "month": "monthly", "本月": "monthly", "月": "monthly",
+    "yearly": "yearly", "year": "yearly", "本年": "yearly", "年": "yearly",
+}
+
 
 class TgBotConfig:
     """Bot 配置管理"""
@@ -47,7 +70,17 @@ class TgBotConfig:
         default_config = {
             "enabled": False,
             "bot_token": "",
-            "default_period": "monthly"
+            "default_period": "monthly",
+            # 接收更新的方式：polling（长轮询）或 webhook（由 Telegram 推送到本服务）
+            "mode": "polling",
+            # webhook 模式下本服务的公网地址，例如 https://stats.example.com
+            "webhook_url": "",
+            # webhook 请求的校验密钥（webhook 模式必填，保存配置时为空则自动生成一次）
+            "webhook_secret": "",
+            # 定时向所有绑定用户推送个人报告（需手动开启）
+            "personal_reports_enabled": False,
+            "personal_reports_period": "monthly",
+            "personal_reports_cron": "0 10 1 * *"
         }
 
         if os.path.exists(BOT_CONFIG_FILE):
@@ -89,6 +122,17 @@ class TgBotService:
         self._running = False
         # 用于存储用户绑定过程中的临时数据
         self._bind_sessions = {}
+        # 正在生成中的报告请求 (tg_user_id, server_id, period)，重复点击直接忽略
+        self._pending_reports = set()
+        # Bot 触发的报告生成并发名额（首次使用时创建）
+        self._report_slots: Optional[asyncio.Semaphore] = None
+        # 当前接收更新的方式（启动后有效）
+        self._mode = "polling"
+        self._webhook_secret = ""
+
+    def _build_application(self, bot_token: str) -> Application:
+        """创建 Application"""
+        return Application.builder().token(bot_token).build()
 
     async def start(self):
         """启动 Bot"""
@@ -96,13 +140,17 @@ class TgBotService:
         if not config.get("enabled") or not config.get("bot_token"):
             logger.info("TgBot: Not configured or disabled")
             return
+        if not instance_lock.is_primary():
+            # 会话状态（如 /bind 流程）保存在进程内存中，Bot 只能在持有后台任务锁的进程中运行
+            logger.warning("TgBot: Another process is running the bot, not starting here")
+            return
 
         try:
             # 初始化绑定数据库
             await tg_binding_service.init_db()
 
             # 创建 Application
-            self.application = Application.builder().token(config["bot_token"]).build()
+            self.application = self._build_application(config["bot_token"])
 
             # 绑定会话处理器
             bind_handler = ConversationHandler(
@@ -125,6 +173,7 @@ class TgBotService:
             self.application.add_handler(bind_handler)
             self.application.add_handler(CommandHandler("unbind", self.cmd_unbind))
             self.application.add_handler(CommandHandler("report", self.cmd_report))
+            self.application.add_handler(CommandHandler("stats", self.cmd_stats))
             self.application.add_handler(CommandHandler("myinfo", self.cmd_myinfo))
             self.application.add_handler(CommandHandler("help", self.cmd_help))
 
@@ -134,10 +183,29 @@ class TgBotService:
             # 解绑确认回调
             self.application.add_handler(CallbackQueryHandler(self.unbind_confirmed, pattern="^unbind_"))
 
-            # 启动 polling
             await self.application.initialize()
             await self.application.start()
-            await self.application.updater.start_polling(drop_pending_updates=True)
+
+            if config.get("mode") == "webhook":
+                # webhook 模式：Telegram 将更新推送到 WEBHOOK_PATH，不占用长轮询连接。
+                # 仍需单 worker 部署：Bot 只在持有后台任务锁的进程中运行，
+                # 推送到其他 worker 的更新会返回 503。
+                # 不丢弃待处理更新，重启期间积压的更新由新进程继续处理
+                if not config.get("webhook_url"):
+                    raise ValueError("webhook_url is required in webhook mode")
+                if not config.get("webhook_secret"):
+                    raise ValueError("webhook_secret is required in webhook mode")
+                self._webhook_secret = config["webhook_secret"]
+                await self.application.bot.set_webhook(
+                    url=config["webhook_url"].rstrip("/") + WEBHOOK_PATH,
+                    secret_token=self._webhook_secret,
+                    allowed_updates=Update.ALL_TYPES
+                )
+                self._mode = "webhook"
+            else:
+                # 启动 polling（会自动删除已设置的 webhook）
+                await self.application.updater.start_polling(drop_pending_updates=True)
+                self._mode = "polling"
 
             # 设置 Bot 菜单命令
             commands = [
@@ -145,11 +213,15 @@ class TgBotService:
                 BotCommand("bind", "绑定 Emby 账户"),
                 BotCommand("unbind", "解除绑定"),
                 BotCommand("report", "获取观影报告"),
+                BotCommand("stats", "快速查看观影统计"),
                 BotCommand("myinfo", "查看绑定状态"),
                 BotCommand("help", "帮助信息"),
             ]
             await self.application.bot.set_my_commands(commands)
 
+            # 启动个人报告投递队列
+            tg_delivery_queue.start(self.application.bot)
+
             self._running = True
             logger.info("TgBot: Started successfully")
 
@@ -161,10 +233,13 @@ class TgBotService:
         """停止 Bot"""
         if self.application and self._running:
             try:
-                await self.application.updater.stop()
+                await tg_delivery_queue.stop()
+                if self.application.updater.running:
+                    await self.application.updater.stop()
                 await self.application.stop()
                 await self.application.shutdown()
                 self._running = False
+                self._webhook_secret = ""
                 logger.info("TgBot: Stopped")
             except Exception as e:
                 logger.error(f"TgBot: Error stopping: {e}")
@@ -173,6 +248,81 @@ class TgBotService:
         """检查 Bot 是否运行中"""
         return self._running
 
+    def get_mode(self) -> str:
+        """当前接收更新的方式"""
+        return self._mode
+
+    async def process_webhook_update(self, data: dict, secret_token: Optional[str]) -> bool:
+        """处理 webhook 推送的更新：校验密钥后放入 Application 的更新队列
+
+        Returns:
+            密钥校验失败返回 False
+        """
+        if not self._webhook_secret or not hmac.compare_digest(
+            (secret_token or "").encode(), self._webhook_secret.encode()
+        ):
+            return False
+        update = Update.de_json(data, self.application.bot)
+        await self.application.update_queue.put(update)
+        return True
+
+    # ==================== 定时个人报告 ====================
+
+    async def send_personal_reports(self, period: Optional[str] = None) -> dict:
+        """为所有绑定用户生成个人报告并加入投递队列（定时任务调用）
+
+        按服务器分组，每批 PERSONAL_REPORT_BATCH 个用户一次分组扫描生成报告；
+        投递队列满时在此等待，发送在队列的后台任务中进行，不阻塞 Bot 轮询
+
+        Returns:
+            {"queued": 已加入队列数, "failed": 生成失败数}
+        """
+        result = {"queued": 0, "failed": 0}
+        if not self._running or not tg_delivery_queue.is_running():
+            logger.info("TgBot: Not running, skipping personal reports")
+            return result
+
+        config = bot_config.load()
+        period = period or config.get("personal_reports_period") or config.get("default_period", "monthly")
+        period_name = PERIOD_NAMES.get(period, "")
+
+        bindings_by_server = {}
+        for binding in await tg_binding_service.get_all_bindings():
+            bindings_by_server.setdefault(binding["server_id"], []).append(binding)
+
+        for server_id, bindings in bindings_by_server.items():
+            server_config = await server_service.get_server(server_id)
+            if not server_config:
+                logger.warning(f"TgBot: Server {server_id} not found, skipping {len(bindings)} personal reports")
+                continue
+            report_cfg = report_config_service.load(server_id)
+
+            for i in range(0, len(bindings), PERSONAL_REPORT_BATCH):
+                batch = bindings[i:i + PERSONAL_REPORT_BATCH]
+                try:
+                    images = await report_service.generate_report_images_batch(
+                        [b["emby_user_id"] for b in batch],
+                        period=period,
+                        content_count=report_cfg.content_count,
+                        server_config=server_config
+                    )
+                except Exception as e:
+                    logger.error(f"TgBot: Error generating personal reports for server {server_id}: {e}")
+                    result["failed"] += len(batch)
+                    continue
+
+                for binding in batch:
+                    image_data = images.get(binding["emby_user_id"])
+                    if not image_data:
+                        result["failed"] += 1
+                        continue
+                    caption = f"📊 {binding['emby_username']} 的{period_name}观影报告"
+                    await tg_delivery_queue.enqueue(binding["tg_user_id"], image_data, caption)
+                    result["queued"] += 1
+
+        logger.info(f"TgBot: Personal reports ({period}) queued: {result['queued']}, failed: {result['failed']}")
+        return result
+
     # ==================== 命令处理器 ====================
 
     async def cmd_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -185,6 +335,7 @@ class TgBotService:
             "/bind - 绑定 Emby 账户\n"
             "/unbind - 解除绑定\n"
             "/report - 获取观影报告\n"
+            "/stats - 快速查看观影统计\n"
             "/myinfo - 查看绑定状态\n"
             "/help - 帮助信息\n\n"
             "请先使用 /bind 绑定你的 Emby 账户。"
@@ -201,6 +352,8 @@ class TgBotService:
             "  解除当前账户绑定\n\n"
             "/report - 获取观影报告\n"
             "  查看个人观影统计报告\n\n"
+            "/stats [周期] - 快速查看观影统计\n"
+            "  文字版统计，周期可选 日/周/月/年\n\n"
             "/myinfo - 查看绑定状态\n"
             "  显示当前绑定的账户信息\n\n"
             "/cancel - 取消当前操作\n"
@@ -475,8 +628,9 @@ class TgBotService:
 
         # 多个绑定，让用户选择要解绑哪个
         keyboard = []
+        servers = await server_service.get_server_map()
         for binding in bindings:
-            server = await server_service.get_server(binding["server_id"])
+            server = servers.get(binding["server_id"])
             server_name = server["name"] if server else "未知"
             keyboard.append([
                 InlineKeyboardButton(
@@ -586,8 +740,9 @@ class TgBotService:
         # 如果有多个绑定，先让用户选择服务器
         if len(bindings) > 1:
             keyboard = []
+            servers = await server_service.get_server_map()
             for binding in bindings:
-                server = await server_service.get_server(binding["server_id"])
+                server = servers.get(binding["server_id"])
                 server_name = server["name"] if server else "未知"
                 keyboard.append([
                     InlineKeyboardButton(
@@ -668,10 +823,32 @@ class TgBotService:
                 await query.edit_message_text("❌ 绑定信息已失效，请重新绑定。")
                 return
 
-            period_names = {"daily": "今日", "weekly": "本周", "monthly": "本月", "yearly": "本年"}
-            await query.edit_message_text(f"🔄 正在生成{period_names.get(period, '')}观影报告...")
+            request_key = (user_id, server_id, period)
+            if request_key in self._pending_reports:
+                # 同一报告正在生成，忽略重复点击
+                return
+
+            # 在后台任务中生成，Bot 按顺序处理更新，避免一个报告阻塞其他用户的命令
+            self._pending_reports.add(request_key)
+            context.application.create_task(self._send_report(query, update, binding, server_id, period))
+
+    async def _send_report(self, query, update: Update, binding: dict, server_id: str, period: str):
+        """生成并发送个人报告（后台任务）
+
+        报告生成受并发名额限制，名额用完时提示排队；相同报告的并发请求在
+        report_service 中合并为一次渲染，播放数据未变化时直接使用缓存
+        """
+        request_key = (str(update.effective_user.id), server_id, period)
+        period_name = PERIOD_NAMES.get(period, "")
+        if self._report_slots is None:
+            self._report_slots = asyncio.Semaphore(max(settings.TG_REPORT_CONCURRENCY, 1))
+
+        try:
+            if self._report_slots.locked():
+                await query.edit_message_text("⏳ 报告生成排队中，请稍候...")
+            async with self._report_slots:
+                await query.edit_message_text(f"🔄 正在生成{period_name}观影报告...")
 
-            try:
                 # 获取服务器配置
                 server_config = await server_service.get_server(server_id)
                 if not server_config:
@@ -689,16 +866,80 @@ class TgBotService:
                     server_config=server_config
                 )
 
-                # 发送图片
-                await query.delete_message()
-                await update.effective_chat.send_photo(
-                    photo=image_data,
-                    caption=f"📊 {binding['emby_username']} 的{period_names.get(period, '')}观影报告"
-                )
+            # 发送图片（不占用生成名额）
+            await query.delete_message()
+            await update.effective_chat.send_photo(
+                photo=image_data,
+                caption=f"📊 {binding['emby_username']} 的{period_name}观影报告"
+            )
 
-            except Exception as e:
-                logger.error(f"[TgBot] Error generating report: {e}")
+        except Exception as e:
+            logger.error(f"[TgBot] Error generating report: {e}")
+            try:
                 await query.edit_message_text(f"❌ 生成报告失败：{str(e)}")
+            except Exception:
+                pass
+        finally:
+            self._pending_reports.discard(request_key)
+
+    async def cmd_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """处理 /stats [周期] 命令：从每日汇总读取文字版统计（不渲染图片、不请求 Emby）"""
+        user_id = str(update.effective_user.id)
+
+        bindings = await tg_binding_service.get_user_bindings(user_id)
+        if not bindings:
+            await update.message.reply_text(
+                "❌ 你还没有绑定 Emby 账户。\n\n"
+                "请先使用 /bind 绑定账户。"
+            )
+            return
+
+        if context.args:
+            period = PERIOD_ALIASES.get(context.args[0].lower())
+            if not period:
+                await update.message.reply_text("❌ 周期参数错误，可选：日 / 周 / 月 / 年")
+                return
+        else:
+            period = bot_config.load().get("default_period", "monthly")
+            period = PERIOD_ALIASES.get(period, "monthly")
+        _, start_date, _ = report_service._get_period_info(period)
+
+        servers = await server_service.get_server_map()
+        sections = []
+        for binding in bindings:
+            server_config = servers.get(binding["server_id"])
+            if not server_config:
+                continue
+
+            state = await rollup_service.get_state(server_config)
+            if state is None or not (settings.DERIVED_REFRESH_CRON and derived_data_service.is_fresh(server_config)):
+                # 汇总在后台更新（同名任务运行中时不重复启动），命令直接读取现有汇总，不等待汇总锁
+                server_registry.get(server_config).spawn(
+                    "rollup_refresh", lambda cfg=server_config: rollup_service.refresh(cfg)
+                )
+            if state is None:
+                sections.append(f"📡 {server_config['name']}：统计数据准备中，请稍后再试")
+                continue
+
+            summary = await rollup_service.get_user_summary(binding["emby_user_id"], start_date, server_config)
+
+            lines = []
+            if len(bindings) > 1:
+                lines.append(f"📡 {server_config['name']}")
+            lines.append(f"📊 {binding['emby_username']} 的{PERIOD_NAMES[period]}观影统计")
+            lines.append(f"▶️ 播放次数：{summary['plays']}")
+            lines.append(f"⏱ 观看时长：{summary['duration'] / 3600:.1f} 小时")
+            lines.append(f"🔥 连续观看：{summary['streak']} 天")
+            if summary["top_titles"]:
+                lines.append("🏆 最常观看：")
+                for i, item in enumerate(summary["top_titles"], 1):
+                    lines.append(f"  {i}. {item['title']}（{item['plays']} 次）")
+            sections.append("\n".join(lines))
+
+        if not sections:
+            await update.message.reply_text("❌ 服务器配置错误，请联系管理员。")
+            return
+        await update.message.reply_text("\n\n".join(sections))
 
     # ==================== 信息查询 ====================
 
@@ -720,8 +961,9 @@ class TgBotService:
         info_text = f"📋 绑定信息\n\n💬 Telegram：{tg_display}（{user_id}）\n"
 
         # 显示所有绑定
+        servers = await server_service.get_server_map()
         for i, binding in enumerate(bindings, 1):
-            server = await server_service.get_server(binding["server_id"])
+            server = servers.get(binding["server_id"])
             server_name = server["name"] if server else "未知"
 
             if len(bindings) > 1:
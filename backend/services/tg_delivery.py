@@ -0,0 +1,123 @@
+"""
+Telegram 消息投递队列模块
+批量推送（如定时个人报告）通过队列异步发送，遵守 Telegram 的限流规则：
+全局发送速率、同一会话的发送间隔，遇到 429 时按 retry_after 暂停后重试
+"""
+import asyncio
+from typing import Optional
+from telegram import Bot
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+from config import settings
+from services.telegram import telegram_service
+from logger import get_logger
+
+logger = get_logger("services.tg_delivery")
+
+
+class TgDeliveryQueue:
+    """Telegram 图片消息投递队列
+
+    - 生成端调用 enqueue，队列满时等待（背压），不会把所有图片堆在内存中
+    - 与 telegram_service 共用同一 Bot 的限速器：每次发送前预约全局和会话两个时间槽
+    - 429 时全局暂停 retry_after 秒；网络错误指数退避；用户屏蔽 Bot 等错误直接放弃
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: list[asyncio.Task] = []
+        self._bot: Optional[Bot] = None
+        self._stats = {"sent": 0, "failed": 0, "retried": 0, "rate_limited": 0}
+
+    def start(self, bot: Bot):
+        """启动发送任务（Bot 启动后调用）"""
+        if self._workers:
+            return
+        self._bot = bot
+        self._queue = asyncio.Queue(maxsize=max(settings.TG_DELIVERY_QUEUE_SIZE, 1))
+        self._workers = [
+            asyncio.create_task(self._worker())
+            for _ in range(max(settings.TG_DELIVERY_WORKERS, 1))
+        ]
+        logger.info(f"TgDelivery: Started with {len(self._workers)} workers")
+
+    async def stop(self):
+        """停止发送任务，丢弃尚未发送的消息"""
+        workers = self._workers
+        self._workers = []
+        for task in workers:
+            task.cancel()
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
+        if self._queue is not None and self._queue.qsize():
+            logger.warning(f"TgDelivery: Dropped {self._queue.qsize()} pending messages")
+        self._queue = None
+        self._bot = None
+
+    def is_running(self) -> bool:
+        return bool(self._workers)
+
+    async def enqueue(self, chat_id: str, photo: bytes, caption: str = ""):
+        """加入发送队列（队列满时等待）"""
+        if self._queue is None:
+            raise RuntimeError("Telegram delivery queue is not running")
+        await self._queue.put((str(chat_id), photo, caption))
+
+    async def join(self):
+        """等待队列中的消息全部处理完毕"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def _send(self, chat_id: str, photo: bytes, caption: str) -> bool:
+        """发送单条消息，按错误类型重试"""
+        limiter = telegram_service.get_rate_limiter(self._bot.token)
+        max_retries = max(settings.TG_DELIVERY_MAX_RETRIES, 0)
+        for attempt in range(max_retries + 1):
+            await limiter.wait_turn(chat_id)
+            try:
+                await self._bot.send_photo(chat_id=chat_id, photo=photo, caption=caption or None)
+                return True
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                seconds = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+                self._stats["rate_limited"] += 1
+                logger.warning(f"TgDelivery: Rate limited, pausing {seconds}s")
+                await limiter.pause(seconds)
+            except (Forbidden, BadRequest) as e:
+                # 用户屏蔽了 Bot、会话不存在等，重试无意义
+                logger.warning(f"TgDelivery: Cannot send to {chat_id}: {e}")
+                return False
+            except (TimedOut, NetworkError) as e:
+                if attempt < max_retries:
+                    await asyncio.sleep(2 ** attempt)
+                logger.warning(f"TgDelivery: Network error sending to {chat_id}: {e}")
+            if attempt < max_retries:
+                self._stats["retried"] += 1
+        return False
+
+    async def _worker(self):
+        while True:
+            chat_id, photo, caption = await self._queue.get()
+            try:
+                if await self._send(chat_id, photo, caption):
+                    self._stats["sent"] += 1
+                else:
+                    self._stats["failed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["failed"] += 1
+                logger.error(f"TgDelivery: Error sending to {chat_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def get_stats(self) -> dict:
+        """获取投递统计（调试用）"""
+        return {
+            **self._stats,
+            "running": self.is_running(),
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+
+# 单例实例
+tg_delivery_queue = TgDeliveryQueue()
@@ -2,9 +2,10 @@
 用户服务模块
 处理用户相关的数据获取和匹配
 """
+import asyncio
 import json
-import aiosqlite
-from typing import Optional
+import os
+from typing import Optional, Dict, Tuple
 from config import settings
 from database import convert_guid_bytes_to_standard, get_users_db
 from logger import get_logger
@@ -12,52 +13,176 @@ from logger import get_logger
 logger = get_logger("services.users")
 
 
+def normalize_user_id(user_id: str) -> str:
+    """标准化用户ID（去除短横线，转小写）"""
+    return (user_id or "").replace("-", "").lower()
+
+
+def to_dashed_guid(user_id: str) -> str:
+    """将无短横线的 GUID 转换为标准格式（带短横线）"""
+    raw = normalize_user_id(user_id)
+    if len(raw) != 32:
+        return user_id
+    return f"{raw[0:8]}-{raw[8:12]}-{raw[12:16]}-{raw[16:20]}-{raw[20:32]}"
+
+
+class UserMap(dict):
+    """用户ID到用户名的映射（dict 子类，保持原有用法）
+
+    额外携带按标准化ID建立的索引（每个映射版本只构建一次），
+    覆盖 GUID 的常见写法，逐行匹配为 O(1)
+    """
+
+    # 未命中结果缓存上限，防止异常数据撑爆内存
+    MAX_RESOLVED = 10000
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.normalized: Dict[str, str] = {}
+        self.index: Dict[str, str] = {}
+        for uid, name in self.items():
+            norm = normalize_user_id(uid)
+            self.normalized.setdefault(norm, name)
+            dashed = to_dashed_guid(norm)
+            # 支持的写法：无短横线/带短横线 × 小写/大写，以及带花括号的格式
+            for key in (uid, norm, norm.upper(), dashed, dashed.upper(), f"{{{dashed}}}", f"{{{dashed.upper()}}}"):
+                self.index.setdefault(key, name)
+        # 索引未命中的ID -> 模糊匹配结果（None 表示无法匹配）
+        self._resolved: Dict[str, Optional[str]] = {}
+
+    def lookup(self, user_id: str) -> Optional[str]:
+        """按ID查找用户名，无法匹配时返回 None"""
+        username = self.index.get(user_id)
+        if username is not None:
+            return username
+
+        user_id_normalized = normalize_user_id(user_id).strip("{}")
+        username = self.normalized.get(user_id_normalized)
+        if username is not None:
+            return username
+
+        if user_id in self._resolved:
+            return self._resolved[user_id]
+
+        # 兼容截断或带前后缀的ID：每个不同的ID最多扫描一次，结果缓存
+        username = None
+        if user_id_normalized:
+            for norm, name in self.normalized.items():
+                if user_id_normalized in norm or norm in user_id_normalized:
+                    username = name
+                    break
+        if len(self._resolved) >= self.MAX_RESOLVED:
+            self._resolved.clear()
+        self._resolved[user_id] = username
+        return username
+
+
 class UserService:
     """用户服务类"""
 
-    async def get_user_map(self, server_config: Optional[dict] = None) -> dict[str, str]:
-        """获取用户ID到用户名的映射"""
+    def __init__(self):
+        # 每个 users.db 的缓存：db_path -> (文件签名, UserMap)
+        self._map_cache: Dict[str, Tuple[tuple, UserMap]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _get_users_db_path(self, server_config: Optional[dict] = None) -> str:
+        """获取 users.db 路径"""
+        if server_config:
+            return server_config.get('users_db', settings.USERS_DB)
+        return settings.USERS_DB
+
+    def _db_signature(self, db_path: str) -> Optional[tuple]:
+        """根据数据库文件（及 WAL 文件）的修改时间和大小生成签名，用于判断用户数据是否变化"""
+        signature = []
+        for path in (db_path, f"{db_path}-wal"):
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        if signature[0] is None:
+            return None
+        return tuple(signature)
+
+    def invalidate(self, server_config: Optional[dict] = None):
+        """清除指定服务器（或全部）的用户映射缓存"""
+        if server_config is None:
+            self._map_cache.clear()
+            return
+        self._map_cache.pop(self._get_users_db_path(server_config), None)
+
+    async def get_user_map(self, server_config: Optional[dict] = None) -> UserMap:
+        """获取用户ID到用户名的映射
+
+        结果按 users.db 缓存，数据库文件的修改时间或大小变化时重新加载
+        """
+        db_path = self._get_users_db_path(server_config)
+        signature = self._db_signature(db_path)
+
+        cached = self._map_cache.get(db_path)
+        if cached and signature is not None and cached[0] == signature:
+            return cached[1]
+
+        lock = self._locks.setdefault(db_path, asyncio.Lock())
+        async with lock:
+            # 等待锁期间可能已被其他请求加载
+            cached = self._map_cache.get(db_path)
+            if cached and signature is not None and cached[0] == signature:
+                return cached[1]
+
+            try:
+                user_map = await self._load_user_map(server_config)
+            except Exception as e:
+                # 读取失败（如 users.db 被锁定）时不缓存，沿用上次成功加载的映射
+                logger.error(f"Error loading users: {e}")
+                return cached[1] if cached else UserMap({})
+            if signature is not None:
+                self._map_cache[db_path] = (signature, user_map)
+            return user_map
+
+    async def _load_user_map(self, server_config: Optional[dict] = None) -> UserMap:
+        """从 users.db 读取用户映射（读取失败时抛出异常，由调用方处理）"""
         user_map = {}
-        try:
-            async with get_users_db(server_config) as db:
-                async with db.execute("SELECT guid, data FROM LocalUsersv2") as cursor:
-                    async for row in cursor:
-                        guid_bytes = row[0]
-                        data_bytes = row[1]
-                        try:
-                            # guid 是二进制格式，需要转换字节序
-                            if isinstance(guid_bytes, bytes):
-                                guid = convert_guid_bytes_to_standard(guid_bytes)
-                            else:
-                                guid = str(guid_bytes).lower().replace("-", "")
-                            # data 是 JSON
-                            if isinstance(data_bytes, bytes):
-                                data = json.loads(data_bytes.decode('utf-8', errors='ignore'))
-                            else:
-                                data = json.loads(data_bytes)
-                            user_map[guid] = data.get("Name", "Unknown")
-                        except (json.JSONDecodeError, KeyError, ValueError, UnicodeDecodeError):
-                            # 单条用户数据解析失败，跳过继续处理其他用户
-                            continue
-        except Exception as e:
-            logger.error(f"Error loading users: {e}")
-        return user_map
+        async with get_users_db(server_config) as db:
+            async with db.execute("SELECT guid, data FROM LocalUsersv2") as cursor:
+                async for row in cursor:
+                    guid_bytes = row[0]
+                    data_bytes = row[1]
+                    try:
+                        # guid 是二进制格式，需要转换字节序
+                        if isinstance(guid_bytes, bytes):
+                            guid = convert_guid_bytes_to_standard(guid_bytes)
+                        else:
+                            guid = str(guid_bytes).lower().replace("-", "")
+                        # data 是 JSON
+                        if isinstance(data_bytes, bytes):
+                            data = json.loads(data_bytes.decode('utf-8', errors='ignore'))
+                        else:
+                            data = json.loads(data_bytes)
+                        user_map[guid] = data.get("Name", "Unknown")
+                    except (json.JSONDecodeError, KeyError, ValueError, UnicodeDecodeError):
+                        # 单条用户数据解析失败，跳过继续处理其他用户
+                        continue
+        return UserMap(user_map)
 
     def match_username(self, user_id: str, user_map: dict[str, str]) -> str:
         """根据用户ID匹配用户名"""
         if not user_id:
             return "Unknown"
 
-        # 直接匹配
-        username = user_map.get(user_id)
-        if username:
-            return username
-
-        # 尝试不同格式匹配
-        user_id_normalized = user_id.replace("-", "").lower()
-        for uid, name in user_map.items():
-            if user_id_normalized in uid.lower() or uid.lower() in user_id_normalized:
-                return name
+        if isinstance(user_map, UserMap):
+            username = user_map.lookup(user_id)
+            if username:
+                return username
+        else:
+            # 普通字典：直接匹配 + 标准化匹配
+            username = user_map.get(user_id)
+            if username:
+                return username
+            user_id_normalized = normalize_user_id(user_id)
+            for uid, name in user_map.items():
+                if user_id_normalized in uid.lower() or uid.lower() in user_id_normalized:
+                    return name
 
         # 无法匹配，返回截断的ID
         return user_id[:8] + "..." if len(user_id) > 8 else user_id